@@ -1,8 +1,15 @@
 import csv
 import datetime
+import os.path
 import strategoutil as sutil
+import sys
 import yaml
 
+# The lookup of rows in the rain data is shared with the scripts folder.
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                             "scripts"))
+from rain_index import row_index
+
 
 def create_weather_forecast(rain_data_file, weather_forecast_file, start_date, horizon,
                             uncertainty):
@@ -62,9 +69,7 @@ def calculate_weather_intervals(rain_data, start_date, horizon, uncertainty):
     assert start_date + datetime.timedelta(minutes=horizon) <= rain_data[len(rain_data) - 1][0]
 
     # Go in rain_data to start date and time. Remember that each line represents 1 minute.
-    index = 0
-    while rain_data[index][0] != start_date:
-        index += 1
+    index = row_index(rain_data, start_date)
 
     # Initialize variables.
     raining = rain_data[index][1] > 0
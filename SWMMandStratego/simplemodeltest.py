@@ -10,6 +10,13 @@ import yaml
 import datetime
 import csv
 
+# The lookup of rows in the rain data and the writing of results are shared with the scripts
+# folder.
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))),
+                             "scripts"))
+from rain_index import row_index
+from swmm_recording import StreamingCsvWriter
+
 
 def insert_rain_data_file_path(swmm_inputfile, rain_data_file):
     """
@@ -29,27 +36,44 @@ def insert_rain_data_file_path(swmm_inputfile, rain_data_file):
 
 
 def run_swmm(swmm_inputfile, basin_id, orfice_id, time_step, output_csv_file, water_level,
-             valve_opening, start_time, end_time):
+             valve_opening, start_time, end_time, hotstart_file=None, resume=False):
     """
     Extracts the time sequential water level in the specified basin from swmm model and write it to
     a csv file.
 
+    With a hotstart file, the hydraulic state at the end time is saved to it. When resuming, the
+    simulation starts from the state saved in the hotstart file instead of from the provided water
+    level, such that the state of all nodes, links and subcatchments carries over between runs.
+    Swmm restarts its runoff time steps at each run, so chained runs only equal one uninterrupted
+    run when the model uses the same DRY_STEP as WET_STEP.
+
     :param str swmm_inputfile: swmm model path
     :param str basin_id: basin id from swmm
     :param int time_step: time interval in seconds
     :param str csv_file_basename: csv file basename
+    :param str hotstart_file: swmm hotstart file path, None to not save the state
+    :param bool resume: whether to start from the state saved in the hotstart file
     """
-    time_series = []
-    water_depth = []
-
+    # Write each step directly, forcing the rows to disk every hour of simulated time, such that
+    # the results written so far survive a crash and memory does not grow with the simulated period.
+    # The manifest written on closing marks a completed run, see StreamingCsvWriter.
+    flush_interval = max(1, 3600 // time_step)
+    water_depth = None
+    writer = StreamingCsvWriter(output_csv_file, None)
     with Simulation(swmm_inputfile) as sim:
         su = Nodes(sim)[basin_id]
-        su.initial_depth = water_level
+        if resume:
+            sim.use_hotstart(hotstart_file)
+        else:
+            su.initial_depth = water_level
         orf = Links(sim)[orfice_id]
-        orf.target_setting = valve_opening
 
         sim.start_time = start_time
         sim.end_time = end_time
+        if hotstart_file is not None:
+            # The last step may end just before the end time, so simulate one step more and save
+            # the state at the step that reaches the end time.
+            sim.end_time = end_time + datetime.timedelta(seconds=time_step)
 
         # TODO: Figure out what the difference is between the above options and using init_conditions
         # def init_conditions():
@@ -57,17 +81,91 @@ def run_swmm(swmm_inputfile, basin_id, orfice_id, time_step, output_csv_file, wa
         # sim.initial_conditions(init_conditions)
 
         sim.step_advance(time_step)
-        for step in sim:
-            time_series.append(sim.current_time)
-            water_depth.append(su.depth)
+        # Starting resets the link settings to those of the model or hotstart file, so only set the
+        # valve opening afterwards.
+        sim.start()
+        orf.target_setting = valve_opening
+        for i, step in enumerate(sim, 1):
+            water_depth = su.depth
+            writer.writerow([sim.current_time, water_depth])
+            if i % flush_interval == 0:
+                writer.flush()
+            if hotstart_file is not None and \
+                    sim.current_time >= end_time - datetime.timedelta(seconds=time_step / 2):
+                sim.save_hotstart(hotstart_file)
+                break
+    writer.close()
 
     sys.stdout.flush()
-    with open(output_csv_file, "w") as f:
-        writer = csv.writer(f)
-        for i, j in zip(time_series, water_depth):
-            writer.writerow([i, j])
+    return water_depth
+
 
-    return water_depth[len(water_depth) - 1]
+class SwmmSession:
+    """
+    A swmm simulation that stays open during a whole MPC experiment, and is advanced one control
+    period at a time.
+
+    The model is only parsed and initialized once. Each call of :meth:`advance` applies the valve
+    opening and continues the simulation from its current state, appending the water level of each
+    step to the csv file. The rows are forced to disk after each control period, see
+    StreamingCsvWriter.
+
+    :param str swmm_inputfile: swmm model path
+    :param str basin_id: basin id from swmm
+    :param str orfice_id: orifice id from swmm
+    :param int time_step: time interval in seconds
+    :param str output_csv_file: csv file path for the water level of each step
+    :param float water_level: initial water level in the basin [m]
+    :param datetime.datetime start_time: start time of the experiment
+    :param datetime.datetime end_time: end time of the experiment
+    """
+    def __init__(self, swmm_inputfile, basin_id, orfice_id, time_step, output_csv_file,
+                 water_level, start_time, end_time):
+        self.time_step = time_step
+        self.sim = Simulation(swmm_inputfile)
+        self.su = Nodes(self.sim)[basin_id]
+        self.su.initial_depth = water_level
+        self.orf = Links(self.sim)[orfice_id]
+        self.sim.start_time = start_time
+        self.sim.end_time = end_time
+        self.sim.step_advance(time_step)
+        self.current_time = start_time
+        self.writer = StreamingCsvWriter(output_csv_file, None)
+
+    def advance(self, valve_opening, until):
+        """
+        Simulate with the provided valve opening until the provided time.
+
+        :param float valve_opening: orifice setting, from 0 to 1
+        :param datetime.datetime until: time to simulate until
+        :return: water level in the basin at the end [m]
+        :rtype: float
+        :raises RuntimeError: if the simulation ends before the provided time
+        """
+        self.orf.target_setting = valve_opening
+        # Allow for the rounding of the simulation time to the routing step.
+        until -= datetime.timedelta(seconds=self.time_step / 2)
+        while self.current_time < until:
+            try:
+                next(self.sim)
+            except StopIteration:
+                self.writer.flush()
+                raise RuntimeError(f"The swmm simulation ended at {self.current_time}, before "
+                                   f"{until}; the end time of the session is too early.") from None
+            self.current_time = self.sim.current_time
+            self.writer.writerow([self.current_time, self.su.depth])
+        self.writer.flush()
+        return self.su.depth
+
+    def close(self):
+        self.sim.close()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
 
 def create_weather_forecast(rain_data_file, weather_forecast_file, start_date, horizon,
@@ -108,9 +206,7 @@ def calculate_weather_intervals(rain_data, start_date, horizon, uncertainty):
     assert start_date + datetime.timedelta(minutes=horizon) <= rain_data[len(rain_data) - 1][0]
 
     # Go in rain_data to start date and time. Remember that each line represents 1 minute.
-    index = 0
-    while rain_data[index][0] != start_date:
-        index += 1
+    index = row_index(rain_data, start_date)
 
     # Initialize variables.
     raining = rain_data[index][1] > 0
@@ -232,8 +328,20 @@ class MPCSetupPond(sutil.SafeMPCSetup):
 
     def run_external_simulator(self, chosen_action, controlperiod, step, **kwargs):
         max_out_flow = 60.0 * 95000.0  # Max outflow [cm3/min], 95000 cm3/s = 95 l/s.
+        if "swmm_session" in kwargs:
+            end_datetime = kwargs["start_date"] + datetime.timedelta(
+                minutes=(step + 1) * controlperiod)
+            new_water_level = kwargs["swmm_session"].advance(chosen_action / max_out_flow,
+                                                             end_datetime)
+            return {"w": new_water_level * 100,
+                    "t": self.controller.get_state("t") + controlperiod}
+
         start_datetime = kwargs["start_date"] + datetime.timedelta(minutes=step * controlperiod)
-        end_datetime = kwargs["start_date"] + datetime.timedelta(minutes=(step + 1) * controlperiod + 1)
+        end_datetime = kwargs["start_date"] + datetime.timedelta(minutes=(step + 1) * controlperiod)
+        hotstart_file = kwargs.get("swmm_hotstart_file")
+        if hotstart_file is None:
+            # Without hotstart, simulate one minute more to also get the level at the period end.
+            end_datetime += datetime.timedelta(minutes=1)
 
         # Run the SWMM model.
         new_water_level = run_swmm(swmm_inputfile,
@@ -244,7 +352,9 @@ class MPCSetupPond(sutil.SafeMPCSetup):
                                    self.controller.get_state("w") / 100,  # Unit controller = cm, unit SWMM = m.
                                    chosen_action / max_out_flow,
                                    start_datetime,
-                                   end_datetime)
+                                   end_datetime,
+                                   hotstart_file,
+                                   resume=hotstart_file is not None and step > 0)
 
         # Get the new state.
         return {"w": new_water_level * 100, "t": self.controller.get_state("t") + controlperiod}
@@ -313,8 +423,13 @@ if __name__ == "__main__":
     start_date = datetime.datetime(year=2019, month=9, day=5)  # The day to start the MPC with.
     uncertainty = 0.1  # The uncertainty in the weather forecast generation.
 
-    controller.run(period, horizon, duration, start_date=start_date,
-                   historical_rain_data_path=rain_data_file,
-                   weather_forecast_path=weather_forecast_path, uncertainty=uncertainty,
-                   basin_id=basin_id, orfice_id=orfice_id, swmm_time_step=swmm_time_step,
-                   swmm_result_file=swmm_result_file)
+    # Keep one swmm simulation open during the whole experiment.
+    end_date = start_date + datetime.timedelta(minutes=(duration + 1) * period)
+    with SwmmSession(swmm_inputfile, basin_id, orfice_id, swmm_time_step, swmm_result_file,
+                     controller.controller.get_state("w") / 100, start_date,
+                     end_date) as swmm_session:
+        controller.run(period, horizon, duration, start_date=start_date,
+                       historical_rain_data_path=rain_data_file,
+                       weather_forecast_path=weather_forecast_path, uncertainty=uncertainty,
+                       basin_id=basin_id, orfice_id=orfice_id, swmm_time_step=swmm_time_step,
+                       swmm_result_file=swmm_result_file, swmm_session=swmm_session)
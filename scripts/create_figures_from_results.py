@@ -1,10 +1,24 @@
 import csv
+import os.path
+import sys
 import matplotlib.pyplot as plt
 from collections import deque
 import dateutil
+from run_workspace import latest_results_folder
 
 if __name__ == "__main__":
-    results_path = "../swmm_models/swmm_demo3_results.csv"
+    # The results file can be given as argument, by default the one of the latest
+    # swmm_stratego_control.py run is shown.
+    if len(sys.argv) > 1:
+        results_path = sys.argv[1]
+    else:
+        base_folder = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+        results_folder = latest_results_folder(os.path.join(base_folder, "swmm_models", "results"),
+                                               prefix="swmm_demo3_")
+        if results_folder is None:
+            sys.exit("No results found, run swmm_stratego_control.py first or provide the results "
+                     "file as argument.")
+        results_path = os.path.join(results_folder, "swmm_demo3_results.csv")
     max_water_level = 2.0
 
     # Get data from file to initialize figures.
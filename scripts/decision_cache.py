@@ -0,0 +1,97 @@
+import json
+import os
+from collections import OrderedDict
+
+from run_workspace import atomic_write
+
+
+class DecisionCache:
+    """
+    Least recently used cache of control actions synthesized by Uppaal Stratego.
+
+    A decision is keyed on the controller state and the weather forecast it was synthesized for.
+    State variables with a resolution are discretized first, such that near-identical situations,
+    e.g. an almost empty pond during dry weather, share their decision.
+
+    The cache can be persisted to a json file, such that later runs start with the decisions of
+    earlier ones. It should only be shared between runs with the same model and query.
+
+    :param dict resolutions: bin width of each state variable to discretize, e.g. ``{"w": 1.0}``
+    :param int max_size: maximum number of decisions to keep
+    :param str file: json file to load the cache from and save it to, None to not persist it
+    """
+    def __init__(self, resolutions=None, max_size=4096, file=None):
+        self.resolutions = {} if resolutions is None else resolutions
+        self.max_size = max_size
+        self.file = file
+        self.decisions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if file is not None and os.path.isfile(file):
+            with open(file, "r") as f:
+                for key, action in json.load(f):
+                    self.decisions[to_tuple(key)] = action
+
+    def key(self, states, weather_forecast):
+        """
+        Get the cache key of a situation.
+
+        :param dict states: controller state variables and their values
+        :param list weather_forecast: weather intervals
+        :rtype: tuple
+        """
+        discretized = tuple(
+            (name, round(value / self.resolutions[name]) if name in self.resolutions else value)
+            for name, value in states.items())
+        return discretized, to_tuple(weather_forecast)
+
+    def get(self, key):
+        """
+        Get the cached decision of a situation.
+
+        :param tuple key: cache key, see :meth:`key`
+        :return: the control action, or None if the situation is not cached
+        """
+        action = self.decisions.get(key)
+        if action is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.decisions.move_to_end(key)
+        return action
+
+    def put(self, key, action):
+        """
+        Cache the decision of a situation, evicting the least recently used one when full.
+
+        :param tuple key: cache key, see :meth:`key`
+        :param action: control action synthesized for the situation
+        """
+        self.decisions[key] = action
+        self.decisions.move_to_end(key)
+        while len(self.decisions) > self.max_size:
+            self.decisions.popitem(last=False)
+
+    def __len__(self):
+        return len(self.decisions)
+
+    def __contains__(self, key):
+        return key in self.decisions
+
+    def save(self):
+        """
+        Save the cache to its json file, if it has one.
+        """
+        if self.file is None:
+            return
+        with atomic_write(self.file) as f:
+            json.dump(list(self.decisions.items()), f)
+
+
+def to_tuple(value):
+    """
+    Convert nested lists, as read from json, into nested tuples that can be used as key.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(to_tuple(item) for item in value)
+    return value
@@ -0,0 +1,66 @@
+from decision_cache import to_tuple
+
+
+class EventTrigger:
+    """
+    Decides when the controller should synthesize a new strategy, instead of executing the actions
+    planned by the previous strategy.
+
+    A new strategy is synthesized when the water level differs from the level the previous
+    strategy was synthesized for by more than the threshold, when the weather forecast differs from
+    the forecast the previous strategy was synthesized for, or when the previous strategy is
+    older than the maximum age. During long dry periods with a stable water level, a strategy is
+    thus only synthesized once every maximum age.
+
+    :param float level_threshold: maximum drift of the water level [cm]
+    :param int max_age: maximum number of control periods to execute a strategy
+    """
+    def __init__(self, level_threshold=2.0, max_age=6):
+        self.level_threshold = level_threshold
+        self.max_age = max_age
+        self.water_level = None
+        self.weather_forecast = None
+        self.actions = []
+        self.periods = max_age  # Number of control periods to execute the current plan.
+        self.age = 0  # Number of control periods since the strategy was synthesized.
+        self.replans = 0
+        self.skips = 0
+
+    def replan(self, water_level, weather_forecast):
+        """
+        Whether a new strategy should be synthesized at the current control instant.
+
+        :param float water_level: observed water level [cm]
+        :param list weather_forecast: weather intervals of the current control instant
+        :rtype: bool
+        """
+        return self.water_level is None or self.age + 1 >= self.periods or \
+            abs(water_level - self.water_level) > self.level_threshold or \
+            to_tuple(weather_forecast) != self.weather_forecast
+
+    def next_action(self):
+        """
+        Get the action the strategy planned for the current control instant. The last planned
+        action is kept when the strategy did not plan this far ahead.
+        """
+        self.age += 1
+        self.skips += 1
+        return self.actions[min(self.age, len(self.actions) - 1)]
+
+    def plan(self, water_level, weather_forecast, actions, periods=None):
+        """
+        Register the strategy synthesized at the current control instant.
+
+        :param float water_level: water level the strategy was synthesized for [cm]
+        :param list weather_forecast: weather intervals the strategy was synthesized for
+        :param list actions: actions of the strategy for the next control periods, starting with
+            the current one
+        :param int periods: number of control periods to execute the actions at most, None for the
+            maximum age
+        """
+        self.water_level = water_level
+        self.weather_forecast = to_tuple(weather_forecast)
+        self.actions = actions
+        self.periods = self.max_age if periods is None else min(periods, self.max_age)
+        self.age = 0
+        self.replans += 1
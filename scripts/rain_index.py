@@ -0,0 +1,31 @@
+import datetime
+
+
+def row_index(rain_data, date):
+    """
+    Return the row index of a date in the rain data rows, as read by read_rain_data().
+
+    Each row is a ``[datetime, rain]`` pair, one row per minute. The row of a date is found by
+    minute arithmetic relative to the first row. Only when the time axis contains gaps before that
+    date, we fall back to a binary search over the rows, so the rows are never scanned or copied.
+
+    :param list rain_data: rain data rows, sorted on time
+    :param datetime.datetime date: date to look up
+    :return: index of the row with the provided date
+    :rtype: int
+    """
+    index = (date - rain_data[0][0]) // datetime.timedelta(minutes=1)
+    if 0 <= index < len(rain_data) and rain_data[index][0] == date:
+        return index
+
+    # The time axis has gaps, so search for the date instead.
+    low, high = 0, len(rain_data)
+    while low < high:
+        middle = (low + high) // 2
+        if rain_data[middle][0] < date:
+            low = middle + 1
+        else:
+            high = middle
+    if low < len(rain_data) and rain_data[low][0] == date:
+        return low
+    raise ValueError(f"Date {date} is not present in the rain data.")
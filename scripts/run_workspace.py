@@ -0,0 +1,117 @@
+import contextlib
+import datetime
+import os
+import shutil
+import tempfile
+
+TMPFS_FOLDER = "/dev/shm"  # Memory-backed file system, used for workspaces when available.
+
+
+@contextlib.contextmanager
+def atomic_write(file, mode="w"):
+    """
+    Open a temporary file next to the provided file, which replaces that file once it is written.
+    Readers, also in other processes, thus never see a partially written file. On errors, the
+    temporary file is removed and the file is left as it was.
+
+    :param str file: path of the file to write
+    :param str mode: mode to open the temporary file with, "w" or "wb"
+    """
+    fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.chmod(temp_file, 0o644)  # Temporary files are only readable by the owner.
+        os.replace(temp_file, file)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+
+class RunWorkspace:
+    """
+    Private folder holding the files of a single run, such that runs on the same checkout can run
+    concurrently.
+
+    The swmm and uppaal templates are copied into the workspace before their paths are
+    substituted, and the files written during the run (query file, weather forecast, verifyta
+    output, swmm report) are put in the workspace as well. The workspace is created on tmpfs if
+    available, and removed when the run is done.
+
+    :param str prefix: prefix of the workspace folder name
+    :param str folder: folder to create the workspace in, None for tmpfs or else the system's
+        temporary folder
+    :param bool keep: whether to keep the workspace after the run, e.g. for debugging
+    """
+    def __init__(self, prefix="claire_run_", folder=None, keep=False):
+        if folder is None and os.path.isdir(TMPFS_FOLDER) and os.access(TMPFS_FOLDER, os.W_OK):
+            folder = TMPFS_FOLDER
+        self.folder = tempfile.mkdtemp(prefix=prefix, dir=folder)
+        self.keep = keep
+
+    def path(self, name):
+        """
+        Get the path of a file in the workspace.
+
+        :param str name: file name
+        :rtype: str
+        """
+        return os.path.join(self.folder, name)
+
+    def copy(self, file, name=None):
+        """
+        Copy a file into the workspace.
+
+        :param str file: path of the file to copy
+        :param str name: file name of the copy, None to keep the name
+        :return: path of the copy
+        :rtype: str
+        """
+        copy = self.path(os.path.basename(file) if name is None else name)
+        shutil.copyfile(file, copy)
+        return copy
+
+    def cleanup(self):
+        """
+        Remove the workspace, unless it should be kept.
+        """
+        if not self.keep:
+            shutil.rmtree(self.folder, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+
+def create_results_folder(folder, prefix="run_"):
+    """
+    Create a new folder for the results of a single run, named after the time the run started,
+    e.g. ``run_20190905-120000_k2x8q1m3``, such that concurrent runs do not overwrite each other's
+    results.
+
+    :param str folder: folder to create the results folder in, created if it does not exist
+    :param str prefix: prefix of the results folder name
+    :return: path of the results folder
+    :rtype: str
+    """
+    os.makedirs(folder, exist_ok=True)
+    return tempfile.mkdtemp(prefix=f"{prefix}{datetime.datetime.now():%Y%m%d-%H%M%S}_",
+                            dir=folder)
+
+
+def latest_results_folder(folder, prefix="run_"):
+    """
+    Get the results folder of the run that started last, as created by create_results_folder().
+
+    :param str folder: folder holding the results folders
+    :param str prefix: prefix of the results folder names
+    :return: path of the results folder, or None if there is none
+    :rtype: str
+    """
+    if not os.path.isdir(folder):
+        return None
+    names = [name for name in os.listdir(folder)
+             if name.startswith(prefix) and os.path.isdir(os.path.join(folder, name))]
+    return os.path.join(folder, max(names)) if names else None
@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import numpy as np
+from decision_cache import to_tuple
+
+
+class SpeculativeSynthesizer:
+    """
+    Synthesize the control actions of the next control instant while swmm simulates the current
+    control period.
+
+    The water level at the next control instant is predicted by extrapolating the change of the
+    water level during the last control period, i.e., assuming that the in- and outflow under the
+    current setting stay the same. Strategies are synthesized concurrently for a few candidate
+    levels around the prediction. At the next control instant, the action of the candidate closest
+    to the observed level is used, if it is within the tolerance and the forecast is the one the
+    candidates were synthesized for. Otherwise, the strategy should be synthesized as usual.
+
+    The synthesis runs in threads, as the work is done by verifyta in its own process. Each
+    synthesis should therefore use its own files, e.g. by using strategy_table.synthesize_action().
+    Cancelling the candidates sets the cancel event passed to their syntheses, which should then
+    kill verifyta, as a running thread cannot be stopped otherwise.
+
+    :param synthesize: function taking a water level [cm], a weather forecast and a cancel keyword
+        argument with a threading.Event, and returning the synthesized action
+    :param int candidates: number of candidate water levels
+    :param float spread: distance between the candidate water levels [cm]
+    :param float tolerance: maximum distance between the observed level and a candidate level
+        [cm], None for half the spread
+    :param int max_workers: number of concurrent syntheses, None for the number of candidates
+    """
+    def __init__(self, synthesize, candidates=3, spread=2.0, tolerance=None, max_workers=None):
+        self.synthesize = synthesize
+        self.offsets = spread * (np.arange(candidates) - (candidates - 1) / 2)
+        self.tolerance = spread / 2 if tolerance is None else tolerance
+        self.executor = ThreadPoolExecutor(max_workers=candidates if max_workers is None
+                                           else max_workers)
+        self.water_levels = None
+        self.weather_forecast = None
+        self.futures = []
+        self._cancel_event = threading.Event()
+        self.hits = 0
+        self.misses = 0
+
+    def predict(self, water_level, previous_water_level):
+        """
+        Get the candidate water levels of the next control instant.
+
+        :param float water_level: water level at the current control instant [cm]
+        :param float previous_water_level: water level at the previous control instant [cm], None
+            if there is none
+        :rtype: numpy.ndarray
+        """
+        change = 0.0 if previous_water_level is None else water_level - previous_water_level
+        return np.maximum(water_level + change + self.offsets, 0.0)
+
+    def submit(self, water_level, previous_water_level, weather_forecast, known=None):
+        """
+        Start synthesizing the actions of the candidate water levels of the next control instant.
+        Syntheses of earlier candidates are cancelled.
+
+        :param float water_level: water level at the current control instant [cm]
+        :param float previous_water_level: water level at the previous control instant [cm], None
+            if there is none
+        :param list weather_forecast: weather intervals of the next control instant
+        :param known: function taking a candidate water level [cm] and returning whether its
+            action is already known, e.g. from a strategy table or decision cache, such that it
+            is not synthesized. None to synthesize all candidates.
+        """
+        self.cancel()
+        water_levels = self.predict(water_level, previous_water_level)
+        if known is not None:
+            water_levels = np.array([level for level in water_levels if not known(float(level))])
+        if len(water_levels) == 0:
+            return
+        self.water_levels = water_levels
+        self.weather_forecast = to_tuple(weather_forecast)
+        self.futures = [self.executor.submit(self.synthesize, float(level), weather_forecast,
+                                             cancel=self._cancel_event)
+                        for level in self.water_levels]
+
+    def result(self, water_level, weather_forecast):
+        """
+        Get the action synthesized for the candidate closest to the observed water level, waiting
+        for its synthesis to finish.
+
+        :param float water_level: observed water level [cm]
+        :param list weather_forecast: weather intervals of the current control instant
+        :return: the action, or None if no candidate is close enough or the forecast has changed
+        """
+        if not self.futures or to_tuple(weather_forecast) != self.weather_forecast:
+            self.misses += 1
+            self.cancel()
+            return None
+        distances = np.abs(self.water_levels - water_level)
+        closest = int(np.argmin(distances))
+        if distances[closest] > self.tolerance:
+            self.misses += 1
+            self.cancel()
+            return None
+        self.hits += 1
+        action = self.futures[closest].result()
+        self.cancel()
+        return action
+
+    def cancel(self):
+        """
+        Cancel the syntheses, killing the running ones, and forget the candidates.
+        """
+        for future in self.futures:
+            future.cancel()
+        if self.futures:
+            # The running syntheses keep the set event, the next candidates get a new one.
+            self._cancel_event.set()
+            self._cancel_event = threading.Event()
+        self.water_levels = None
+        self.weather_forecast = None
+        self.futures = []
+
+    def close(self):
+        """
+        Cancel the running syntheses, and stop the threads.
+        """
+        self.cancel()
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
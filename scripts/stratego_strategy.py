@@ -0,0 +1,244 @@
+import itertools
+import json
+import math
+import re
+
+# Constant declarations of an uppaal model, e.g. const double Opening[C] = {1.0/7.0, 1.0};
+CONSTANT_PATTERN = re.compile(r"const\s+(?:int|double)\s+(\w+)\s*(\[[^\]]*\])?\s*=\s*([^;]*);")
+ARITHMETIC_PATTERN = re.compile(r"[\d.eE+\-*/() ]+")  # Expressions of literals only.
+MAX_POINT_STATES = 4096  # Maximum number of values of missing point variables to evaluate.
+
+
+class StrategoStrategy:
+    """
+    Strategy saved by Uppaal Stratego with saveStrategy(), evaluated in Python.
+
+    A strategy maps each discrete state, i.e., the values of its state variables (locations and
+    integers), to a regressor per action. The regressor is a tree over the point variables (clocks
+    and doubles), whose leaves are the expected values of taking the action. The chosen action is
+    the one with the minimum value, or the maximum if the strategy does not minimize.
+
+    A state is a dictionary of variable names, as in the strategy file, and their values.
+    Locations can be given by name or by index. State variables that are not given match any
+    value, such that states can be evaluated without tracking all locations of the model, as long
+    as the matching discrete states agree on the action. Likewise, point variables that are not
+    given can take any value, as long as the regressors choose the same action for all of them.
+
+    :param list actions: description of each action, e.g. its edge and assignments
+    :param list statevars: names of the state variables
+    :param list pointvars: names of the point variables
+    :param dict locationnames: location names by index, of each location variable
+    :param dict regressors: regressor tree of each action, by discrete state tuple
+    :param dict minimize: whether the values of a discrete state should be minimized
+    """
+    def __init__(self, actions, statevars, pointvars, locationnames, regressors, minimize):
+        self.actions = actions
+        self.statevars = statevars
+        self.pointvars = pointvars
+        self.locations = {name: {location: int(index) for index, location in names.items()}
+                          for name, names in locationnames.items()}
+        self.regressors = regressors
+        self.minimize = minimize
+        self._indices = {}  # Discrete states by the values of the given state variables.
+        self._bounds = {}  # Bounds of each point variable in the regressors, by discrete state.
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load a strategy saved by Uppaal Stratego in the state->regressor json format.
+
+        :param str file: json file path
+        :rtype: StrategoStrategy
+        """
+        with open(file, "r") as f:
+            strategy = json.load(f)
+        if strategy.get("type") != "state->regressor":
+            raise RuntimeError(f"The strategy {file} is not of the state->regressor type.")
+        actions = [strategy["actions"][str(index)] for index in range(len(strategy["actions"]))]
+        regressors = {}
+        minimize = {}
+        for key, regressor in strategy["regressors"].items():
+            state = tuple(int(value) for value in key.strip("()").split(","))
+            regressors[state] = {int(action): tree
+                                 for action, tree in regressor["regressor"].items()}
+            minimize[state] = bool(regressor.get("minimize", 1))
+        return cls(actions, strategy["statevars"], strategy["pointvars"],
+                   strategy["locationnames"], regressors, minimize)
+
+    def __len__(self):
+        return len(self.regressors)
+
+    def matching_states(self, state):
+        """
+        Get the discrete states of the strategy matching the given state variables.
+
+        :param dict state: variable names and their values
+        :rtype: list
+        """
+        given = tuple(index for index, name in enumerate(self.statevars) if name in state)
+        if given not in self._indices:
+            index = {}
+            for discrete_state in self.regressors:
+                index.setdefault(tuple(discrete_state[i] for i in given), []).append(
+                    discrete_state)
+            self._indices[given] = index
+        values = []
+        for i in given:
+            name = self.statevars[i]
+            value = state[name]
+            if isinstance(value, str):
+                value = self.locations[name].get(value.split(".")[-1], -1)
+            values.append(int(value))
+        return self._indices[given].get(tuple(values), [])
+
+    def point_states(self, discrete_state, state):
+        """
+        Get the states to evaluate the regressors of a discrete state in, when point variables
+        they depend on are not given. Each missing point variable takes a value in each interval
+        between the bounds the regressors compare it with.
+
+        :param tuple discrete_state: discrete state of the strategy
+        :param dict state: variable names and their values
+        :return: the given state completed with each combination of values of the missing point
+            variables, or an empty list if there are more than MAX_POINT_STATES combinations
+        :rtype: list
+        """
+        if discrete_state not in self._bounds:
+            bounds = {}
+            trees = list(self.regressors[discrete_state].values())
+            while trees:
+                tree = trees.pop()
+                if isinstance(tree, dict):
+                    bounds.setdefault(self.pointvars[tree["var"]], set()).add(tree["bound"])
+                    trees.extend((tree["low"], tree["high"]))
+            self._bounds[discrete_state] = {name: sorted(values)
+                                            for name, values in bounds.items()}
+        # A value of a bound lies in the interval up to it, and one above the largest bound lies
+        # in the last interval.
+        missing = {name: bounds + [bounds[-1] + 1.0]
+                   for name, bounds in self._bounds[discrete_state].items() if name not in state}
+        if math.prod(len(values) for values in missing.values()) > MAX_POINT_STATES:
+            return []
+        return [{**state, **dict(zip(missing, values))}
+                for values in itertools.product(*missing.values())]
+
+    def action_values(self, discrete_state, state):
+        """
+        Evaluate the regressors of a discrete state of the strategy.
+
+        :param tuple discrete_state: discrete state of the strategy
+        :param dict state: variable names and their values, including the point variables the
+            regressors depend on, see point_states()
+        :return: the value of each action
+        :rtype: dict
+        """
+        values = {}
+        for action, tree in self.regressors[discrete_state].items():
+            while isinstance(tree, dict):
+                value = state[self.pointvars[tree["var"]]]
+                tree = tree["low"] if value <= tree["bound"] else tree["high"]
+            values[action] = tree
+        return values
+
+    def best_action(self, state):
+        """
+        Get the action of the strategy in a state.
+
+        :param dict state: variable names and their values
+        :return: the action index, or None if the strategy does not cover the state, or the matching
+            discrete states or the values of the missing point variables choose different actions
+        :rtype: int
+        """
+        best = None
+        for discrete_state in self.matching_states(state):
+            point_states = self.point_states(discrete_state, state)
+            if not point_states:
+                return None
+            choose = min if self.minimize[discrete_state] else max
+            for point_state in point_states:
+                values = self.action_values(discrete_state, point_state)
+                if not values:
+                    return None
+                action = choose(values, key=values.get)
+                if best is not None and action != best:
+                    return None
+                best = action
+        return best
+
+    def assigned_value(self, action, variable, constants=None):
+        """
+        Get the value an action assigns to a variable.
+
+        :param int action: action index
+        :param str variable: variable name, e.g. ``Open``
+        :param dict constants: constants of the model, as read by read_constants(), to resolve
+            assignments like ``Open := Opening[2]``
+        :return: the assigned value, or None if the action does not assign a known value
+        :rtype: float
+        """
+        assignment = re.search(rf"(?<![\w.]){re.escape(variable)} := ([^,}}]+)",
+                               self.actions[action])
+        if assignment is None:
+            return None
+        expression = assignment.group(1).strip()
+        element = re.fullmatch(r"(\w+)\[(\d+)\]", expression)
+        if element is not None:
+            array = (constants or {}).get(element.group(1))
+            return None if array is None else array[int(element.group(2))]
+        return evaluate_literal(expression)
+
+    def decide(self, state, variable, constants=None):
+        """
+        Get the value the strategy assigns to the control variable in a state.
+
+        :param dict state: variable names and their values
+        :param str variable: control variable name, e.g. ``Open``
+        :param dict constants: constants of the model, see assigned_value()
+        :return: the value, or None if the strategy does not decide the state
+        :rtype: float
+        """
+        action = self.best_action(state)
+        return None if action is None else self.assigned_value(action, variable, constants)
+
+
+def read_constants(uppaal_model):
+    """
+    Read the constants of an uppaal model whose values are literal expressions, like
+    ``const int W = 200;`` or ``const double Opening[C] = {1.0/7.0, 4.0/7.0, 7.0/7.0};``.
+
+    Constants with the same name in different templates overwrite each other.
+
+    :param str uppaal_model: uppaal model path
+    :return: the value of each constant, as a list for arrays
+    :rtype: dict
+    """
+    with open(uppaal_model, "r") as f:
+        file_content = f.read()
+    constants = {}
+    for name, dimension, expression in CONSTANT_PATTERN.findall(file_content):
+        if dimension:
+            values = [evaluate_literal(value)
+                      for value in expression.strip().strip("{}").split(",")]
+            if None not in values:
+                constants[name] = values
+        else:
+            value = evaluate_literal(expression)
+            if value is not None:
+                constants[name] = value
+    return constants
+
+
+def evaluate_literal(expression):
+    """
+    Evaluate an arithmetic expression of number literals, like ``4.0/7.0``.
+
+    :return: the value, or None if the expression refers to anything else
+    :rtype: float
+    """
+    expression = expression.strip()
+    if not ARITHMETIC_PATTERN.fullmatch(expression):
+        return None
+    try:
+        return float(eval(expression, {"__builtins__": {}}))
+    except (SyntaxError, ZeroDivisionError):
+        return None
@@ -0,0 +1,239 @@
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import itertools
+import os.path
+import numpy as np
+import yaml
+import weather_forecast_generation as weather
+from run_workspace import RunWorkspace
+from swmm_stratego_control import MPCSetupPond, create_embedded_forecast_model, \
+    insert_paths_in_uppaal_model
+
+
+class StrategyTable:
+    """
+    Control actions synthesized offline for a grid of water levels and forecast classes.
+
+    A forecast class describes the first rain event of a forecast by three features: the minutes
+    until it starts, its duration in minutes and its rain in mm/min. Forecasts without rain form the
+    class with a dry spell of the whole horizon and no rain. Online, a forecast is assigned to the
+    nearest class, and the action is interpolated between the two nearest water levels only when
+    both have the same action. Interpolating different actions, e.g. openings 1/7 and 4/7, would
+    give an opening the model does not have and the synthesis never checked, so such states are
+    left to live synthesis instead.
+
+    :param numpy.ndarray water_levels: water levels of the grid [cm], increasing
+    :param numpy.ndarray classes: dry duration, rain duration and rain of each forecast class
+    :param numpy.ndarray actions: action of each water level (rows) and forecast class (columns)
+    :param int horizon: forecast horizon in minutes
+    :param float uncertainty: relative uncertainty of the interval durations
+    """
+    def __init__(self, water_levels, classes, actions, horizon, uncertainty):
+        self.water_levels = water_levels
+        self.classes = classes
+        self.actions = actions
+        self.horizon = horizon
+        self.uncertainty = uncertainty
+        # Scale the features to the range of the grid, to compare distances between features.
+        self._feature_min = classes.min(axis=0)
+        self._feature_max = classes.max(axis=0)
+        self._feature_scale = np.where(self._feature_max > self._feature_min,
+                                       self._feature_max - self._feature_min, 1.0)
+
+    @classmethod
+    def build(cls, water_levels, dry_durations, rain_durations, rain_intensities, synthesize,
+              horizon, uncertainty, max_workers=None):
+        """
+        Synthesize the actions of all grid points in a pool of processes.
+
+        :param list water_levels: water levels of the grid [cm]
+        :param list dry_durations: minutes until the rain starts of the forecast classes
+        :param list rain_durations: rain durations of the forecast classes, in minutes
+        :param list rain_intensities: rain of the forecast classes [mm/min]
+        :param synthesize: picklable function taking a water level and a weather forecast, and
+            returning the synthesized action, e.g. a partial of synthesize_action()
+        :param int horizon: forecast horizon in minutes
+        :param float uncertainty: relative uncertainty of the interval durations
+        :param int max_workers: number of processes, None for the number of processors
+        :rtype: StrategyTable
+        """
+        classes = forecast_classes(dry_durations, rain_durations, rain_intensities, horizon)
+        forecasts = [class_forecast(forecast_class, horizon, uncertainty)
+                     for forecast_class in classes]
+        grid = list(itertools.product(water_levels, forecasts))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            actions = list(executor.map(synthesize, *zip(*grid)))
+        actions = np.array(actions, dtype=float).reshape(len(water_levels), len(classes))
+        return cls(np.array(water_levels, dtype=float), classes, actions, horizon, uncertainty)
+
+    def save(self, file):
+        np.savez(file, water_levels=self.water_levels, classes=self.classes,
+                 actions=self.actions, horizon=self.horizon, uncertainty=self.uncertainty)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            return cls(data["water_levels"], data["classes"], data["actions"],
+                       int(data["horizon"]), float(data["uncertainty"]))
+
+    def forecast_class(self, weather_forecast):
+        """
+        Get the index of the forecast class nearest to a weather forecast.
+
+        :param list weather_forecast: weather intervals
+        :return: the class index, or None if the forecast is outside the range of the classes
+        :rtype: int
+        """
+        features = forecast_features(weather_forecast, self.horizon)
+        if np.any(features < self._feature_min) or np.any(features > self._feature_max):
+            return None
+        distances = np.sum(((self.classes - features) / self._feature_scale) ** 2, axis=1)
+        return int(np.argmin(distances))
+
+    def lookup(self, water_level, weather_forecast):
+        """
+        Get the action of a water level and weather forecast.
+
+        :param float water_level: water level [cm]
+        :param list weather_forecast: weather intervals
+        :return: the action of the water level if it is on the grid, or of both nearest water
+            levels if they agree, or None if they do not or the state is outside the grid
+        :rtype: float
+        """
+        if not self.water_levels[0] <= water_level <= self.water_levels[-1]:
+            return None
+        forecast_class = self.forecast_class(weather_forecast)
+        if forecast_class is None:
+            return None
+        actions = self.actions[:, forecast_class]
+        upper = int(np.searchsorted(self.water_levels, water_level))
+        if self.water_levels[upper] == water_level or actions[upper - 1] == actions[upper]:
+            return float(actions[upper])
+        return None
+
+
+def forecast_classes(dry_durations, rain_durations, rain_intensities, horizon):
+    """
+    Enumerate the forecast classes of all combinations of the provided features that fit in the
+    horizon, plus the class without rain.
+
+    :return: dry duration, rain duration and rain of each class
+    :rtype: numpy.ndarray
+    """
+    classes = [(horizon + 1, 0, 0.0)]
+    for dry, rain, intensity in itertools.product(dry_durations, rain_durations,
+                                                  rain_intensities):
+        if rain > 0 and intensity > 0 and dry + rain <= horizon + 1:
+            classes.append((dry, rain, intensity))
+    return np.array(classes, dtype=float)
+
+
+def class_forecast(forecast_class, horizon, uncertainty):
+    """
+    Create the representative weather forecast of a forecast class.
+
+    :param forecast_class: dry duration, rain duration and rain of the class
+    :param int horizon: forecast horizon in minutes
+    :param float uncertainty: relative uncertainty of the interval durations
+    :return: weather intervals
+    :rtype: list
+    """
+    dry, rain, intensity = forecast_class
+    durations = np.array([dry, rain, horizon + 1 - dry - rain], dtype=int)
+    raining = np.array([False, True, False])
+    rain_per_minute = np.array([0.0, intensity, 0.0])
+    runs = durations > 0
+    return weather.weather_intervals_from_runs(durations[runs], raining[runs],
+                                               rain_per_minute[runs], horizon, uncertainty)
+
+
+def forecast_features(weather_forecast, horizon):
+    """
+    Get the features of the first rain event of a weather forecast, from the middle of its
+    interval bounds.
+
+    :return: dry duration, rain duration and rain
+    :rtype: numpy.ndarray
+    """
+    dry_low, dry_high, rain_low, rain_high, rain = weather_forecast[0]
+    if rain_high == 0:
+        return np.array([horizon + 1, 0, 0.0])
+    return np.array([(dry_low + dry_high) / 2, (rain_low + rain_high) / 2, rain])
+
+
+def synthesize_action(water_level, weather_forecast, uppaal_template_path, libtable_path,
+                      model_cfg_dict, learning_cfg_dict, verifyta_command, period, horizon,
+                      cancel=None):
+    """
+    Synthesize the action of a single grid point in its own workspace.
+
+    :param float water_level: water level [cm]
+    :param list weather_forecast: weather intervals
+    :param str uppaal_template_path: uppaal model template path
+    :param str libtable_path: libtable path, None to embed the forecast in the model instead
+    :param threading.Event cancel: event that kills verifyta when set, None to not cancel
+    :return: the chosen action, or None if the synthesis was cancelled
+    """
+    with RunWorkspace(prefix="strategy_table_") as workspace:
+        if libtable_path is None:
+            model_template_path = workspace.path(os.path.basename(uppaal_template_path))
+            create_embedded_forecast_model(uppaal_template_path, model_template_path)
+            weather_forecast_path = None
+        else:
+            model_template_path = workspace.copy(uppaal_template_path)
+            weather_forecast_path = workspace.path("weather_forecast.csv")
+            insert_paths_in_uppaal_model(model_template_path, weather_forecast_path,
+                                         libtable_path)
+        controller = MPCSetupPond(model_template_path, workspace.path("result.txt"),
+                                  query_file=workspace.path("query.q"),
+                                  model_cfg_dict=model_cfg_dict,
+                                  learning_args=learning_cfg_dict,
+                                  verifyta_command=verifyta_command,
+                                  external_simulator=False,
+                                  action_variable="Open", debug=False, cancel=cancel)
+        controller.controller.update_state({"w": water_level})
+        return controller.run_single(period, horizon, weather_forecast=weather_forecast,
+                                     weather_forecast_path=weather_forecast_path)
+
+
+def main():
+    # Locate the Uppaal folder and files.
+    this_file = os.path.realpath(__file__)
+    base_folder = os.path.dirname(os.path.dirname(this_file))
+    uppaal_folder = os.path.join(base_folder, "uppaal")
+    uppaal_template_path = os.path.join(uppaal_folder, "pond_demo3.xml")
+    model_config_path = os.path.join(uppaal_folder, "pond_demo3_config.yaml")
+    learning_config_path = os.path.join(uppaal_folder, "verifyta_demo3_config.yaml")
+    libtable_path = os.path.join(uppaal_folder, "libtable.dylib")
+    strategy_table_path = os.path.join(uppaal_folder, "pond_demo3_strategy_table.npz")
+    verifyta_command = "verifyta-5-rc4"
+
+    # The same control settings as swmm_stratego_control.py.
+    period = 60  # Control period in time units (minutes).
+    horizon = 6  # How many periods to compute strategy for.
+    uncertainty = 0.1  # The uncertainty in the weather forecast generation.
+
+    # The grid of water levels [cm] and forecast classes.
+    water_levels = list(range(0, 201, 10))
+    dry_durations = [0, 30, 60, 120, 240]
+    rain_durations = [15, 60, 180]
+    rain_intensities = [0.01, 0.05, 0.2]
+
+    with open(model_config_path, "r") as yamlfile:
+        model_cfg_dict = yaml.safe_load(yamlfile)
+    with open(learning_config_path, "r") as yamlfile:
+        learning_cfg_dict = yaml.safe_load(yamlfile)
+
+    synthesize = functools.partial(synthesize_action, uppaal_template_path=uppaal_template_path,
+                                   libtable_path=libtable_path, model_cfg_dict=model_cfg_dict,
+                                   learning_cfg_dict=learning_cfg_dict,
+                                   verifyta_command=verifyta_command, period=period,
+                                   horizon=horizon)
+    table = StrategyTable.build(water_levels, dry_durations, rain_durations, rain_intensities,
+                                synthesize, horizon * period, uncertainty)
+    table.save(strategy_table_path)
+    print("procedure completed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
-from pyswmm import Simulation, Nodes, Links, RainGages, Subcatchments
+from pyswmm import Simulation, Links
 import os.path
-import csv
 import re
+from swmm_recording import TimeSeriesRecorder, load_observables, register_observables
 
 
-def swmm_control(swmm_inputfile, orifice_id, opening_settings, basin_id, time_step, csv_file_basename):
+def swmm_control(swmm_inputfile, orifice_id, opening_settings, basin_id, time_step, csv_file_basename,
+                 observables_file=None):
     """
     Implement the control strategy from uppal stratego to swmm
     requires:
@@ -14,66 +15,65 @@ def swmm_control(swmm_inputfile, orifice_id, opening_settings, basin_id, time_st
         basin_id: string, upstream basin ID
         time_step: float
         csv_file_basename: path
+        observables_file: path of a yaml file declaring the swmm observables to record, see
+            swmm_recording.load_observables(). By default, the observables of
+            default_observables() are recorded.
 
     returns:
-        one csv files with three columns:
+        one csv file without header row, with the time and a column per observable, e.g.:
         col 0. time 
         col 1. the upstream pond water level changes when implemented control strategy, meter above the bottom elevation of basin
         col 2. the orifice flow (discharge) changes when implemented control strategy, cubic meter per second
     """
-    time_series = []
-    water_depth = []
-    orifice_flow = []
-    basin_total_inflow = []
-    basin_total_outflow = []
-    basin_total_evaporation = []
-    overflow = []
-    rain = []
-    subcatchment_total_rain = []
-    subcatchment_total_runoff = []
-    subcatchment_total_infiltration = []
-    subcatchment_total_evaporation = []
-
     with Simulation(swmm_inputfile) as sim:
-        su = Nodes(sim)[basin_id]
         orifice = Links(sim)[orifice_id]
-        rg1 = RainGages(sim)["RG1"]
-        ca = Subcatchments(sim)["S1"]
+
+        recorder = TimeSeriesRecorder(sim.start_time, sim.end_time, time_step)
+        if observables_file is not None:
+            observables = load_observables(observables_file)
+        else:
+            observables = default_observables(basin_id, orifice_id)
+        register_observables(recorder, sim, observables)
 
         sim.step_advance(time_step)
         orifice.target_setting = opening_settings # set the control parameter
-        total_inflow = 0
-        total_outflow = 0
-        total_rainfall = 0
         for step in sim:
-            time_series.append(sim.current_time)
-            water_depth.append(su.depth)
-            orifice_flow.append(orifice.flow)
-            rain.append(rg1.rainfall)
-            total_inflow = total_inflow + su.total_inflow
-            basin_total_inflow.append(total_inflow)
-            overflow.append(su.statistics.get('flooding_volume'))
-            total_outflow = total_outflow + su.total_outflow
-            basin_total_outflow.append(total_outflow)
-            basin_total_evaporation.append(su.storage_statistics.get('evap_loss'))
-            total_rainfall = total_rainfall + ca.rainfall
-            subcatchment_total_rain.append(total_rainfall)
-            subcatchment_total_runoff.append(ca.statistics.get('runoff'))
-            subcatchment_total_infiltration.append(ca.statistics.get('infiltration'))
-            subcatchment_total_evaporation.append(ca.statistics.get('evaporation'))
+            recorder.record(sim.current_time)
 
     dirname = os.path.dirname(swmm_inputfile)
     output_csv_file = os.path.join(dirname, csv_file_basename + "." + "csv")
-    with open(output_csv_file, "w") as f:
-        writer = csv.writer(f)
-        for i, j, k, l, m, n, o, p, q, r, s, t in zip(time_series, water_depth, orifice_flow, rain,
-                                                      basin_total_inflow, basin_total_outflow, overflow,
-                                                      subcatchment_total_rain, subcatchment_total_runoff,
-                                                      subcatchment_total_infiltration,
-                                                      basin_total_evaporation,
-                                                      subcatchment_total_evaporation):
-            i = i.strftime('%Y-%m-%d %H:%M')
-            writer.writerow([i, j, k, l, m, n, o, p, q, r, s, t])
+    recorder.write_csv(output_csv_file, header=False)
+
+
+def default_observables(basin_id, orifice_id):
+    """
+    The swmm observables recorded by swmm_control() when no observables file is provided.
+
+    :param str basin_id: upstream basin ID
+    :param str orifice_id: orifice ID
+    :rtype: list
+    """
+    return [
+        {"name": "water_depth", "element": "node", "id": basin_id, "attribute": "depth"},
+        {"name": "orifice_flow", "element": "link", "id": orifice_id, "attribute": "flow"},
+        {"name": "rain", "element": "raingage", "id": "RG1", "attribute": "rainfall"},
+        {"name": "basin_total_inflow", "element": "node", "id": basin_id,
+         "attribute": "total_inflow", "mode": "total"},
+        {"name": "basin_total_outflow", "element": "node", "id": basin_id,
+         "attribute": "total_outflow", "mode": "total"},
+        {"name": "overflow", "element": "node", "id": basin_id,
+         "attribute": "statistics.flooding_volume"},
+        {"name": "subcatchment_total_rain", "element": "subcatchment", "id": "S1",
+         "attribute": "rainfall", "mode": "total"},
+        {"name": "subcatchment_total_runoff", "element": "subcatchment", "id": "S1",
+         "attribute": "statistics.runoff"},
+        {"name": "subcatchment_total_infiltration", "element": "subcatchment", "id": "S1",
+         "attribute": "statistics.infiltration"},
+        {"name": "basin_total_evaporation", "element": "node", "id": basin_id,
+         "attribute": "storage_statistics.evap_loss"},
+        {"name": "subcatchment_total_evaporation", "element": "subcatchment", "id": "S1",
+         "attribute": "statistics.evaporation"},
+    ]
 
 
 def insert_rain_data_file_path(swmm_inputfile, rain_data_file):
@@ -0,0 +1,194 @@
+import os
+import re
+from functools import cache
+
+TOKEN_PATTERN = re.compile(r'"[^"]*"|\S+')  # Tokens of a data line, quoted strings are one token.
+COLUMN_WIDTH = 16  # Width of the columns when a data line is written again.
+DATE_FORMAT = "%m/%d/%Y"
+TIME_FORMAT = "%H:%M:%S"
+RAIN_TIMESERIES = "long_term_rainfallgauge5061"  # Time series of the rain gauge in our models.
+
+
+class SwmmInputFile:
+    """
+    Swmm input (.inp) file, indexed on its sections.
+
+    Each section holds its lines as in the file, such that lines that are not edited are written
+    exactly as they were read. Edits address data lines by section and element name, and only
+    rewrite those lines. Reading a file parses it only once, after which each read returns a cheap
+    copy, such that many variants of a model can be created without reading the file again.
+
+    :param list preamble: lines before the first section
+    :param dict sections: lines of each section by section name, without the [NAME] line
+    """
+    def __init__(self, preamble, sections):
+        self.preamble = preamble
+        self.sections = sections
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parse the text of a swmm input file.
+
+        :param str text: file content
+        :rtype: SwmmInputFile
+        """
+        preamble = []
+        sections = {}
+        lines = preamble
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped.startswith("[") and stripped.endswith("]"):
+                lines = sections.setdefault(stripped[1:-1], [])
+            else:
+                lines.append(line)
+        return cls(preamble, sections)
+
+    @classmethod
+    def read(cls, file):
+        """
+        Read a swmm input file, parsing it only when it has not been parsed before or has changed.
+
+        :param str file: swmm model path
+        :return: a copy of the parsed file, which can be edited freely
+        :rtype: SwmmInputFile
+        """
+        stat = os.stat(file)
+        return _parse_file(os.path.abspath(file), stat.st_mtime_ns, stat.st_size).copy()
+
+    def copy(self):
+        """
+        Copy the input file. Lines are immutable strings, so only the line lists are copied.
+
+        :rtype: SwmmInputFile
+        """
+        return SwmmInputFile(list(self.preamble),
+                             {name: list(lines) for name, lines in self.sections.items()})
+
+    def to_text(self):
+        """
+        Get the content of the input file, as it would be written.
+
+        :rtype: str
+        """
+        lines = list(self.preamble)
+        for name, section_lines in self.sections.items():
+            lines.append(f"[{name}]")
+            lines.extend(section_lines)
+        return "\n".join(lines) + "\n"
+
+    def write(self, file):
+        """
+        Write the input file.
+
+        :param str file: swmm model path
+        """
+        with open(file, "w") as f:
+            f.write(self.to_text())
+
+    def rows(self, section):
+        """
+        Get the data lines of a section as lists of tokens, skipping comments and empty lines.
+
+        :param str section: section name
+        :rtype: list
+        """
+        return [tokens for tokens in (data_tokens(line) for line in self.sections[section])
+                if tokens]
+
+    def get_value(self, section, name, column):
+        """
+        Get a value of the data line of an element.
+
+        :param str section: section name
+        :param str name: element name, the first column of the data line
+        :param int column: column of the value, 0 being the element name
+        :rtype: str
+        """
+        return data_tokens(self.sections[section][self._line_index(section, name)])[column]
+
+    def set_value(self, section, name, column, value):
+        """
+        Set a value of the data line of an element.
+
+        :param str section: section name
+        :param str name: element name, the first column of the data line
+        :param int column: column of the value, 0 being the element name
+        :param value: new value
+        """
+        lines = self.sections[section]
+        index = self._line_index(section, name)
+        tokens = data_tokens(lines[index])
+        tokens[column] = str(value)
+        lines[index] = " ".join(token.ljust(COLUMN_WIDTH) for token in tokens).rstrip()
+
+    def _line_index(self, section, name):
+        for index, line in enumerate(self.sections[section]):
+            tokens = data_tokens(line)
+            if tokens and tokens[0] == name:
+                return index
+        raise KeyError(f"No element {name} in section [{section}].")
+
+    def get_option(self, name):
+        return self.get_value("OPTIONS", name, 1)
+
+    def set_option(self, name, value):
+        self.set_value("OPTIONS", name, 1, value)
+
+    def set_dates(self, start_time, end_time):
+        """
+        Set the simulation and reporting period.
+
+        :param datetime.datetime start_time: start of the simulation and reporting
+        :param datetime.datetime end_time: end of the simulation
+        """
+        for prefix, time in (("START", start_time), ("REPORT_START", start_time),
+                             ("END", end_time)):
+            self.set_option(prefix + "_DATE", time.strftime(DATE_FORMAT))
+            self.set_option(prefix + "_TIME", time.strftime(TIME_FORMAT))
+
+    def set_rain_data_file(self, timeseries, rain_data_file):
+        """
+        Set the file of a time series read from file, like the rain data of the rain gauge.
+
+        :param str timeseries: time series name
+        :param str rain_data_file: rain data file path
+        """
+        self.set_value("TIMESERIES", timeseries, 2, f'"{rain_data_file}"')
+
+    def set_initial_depth(self, storage_id, depth):
+        """
+        Set the initial water depth of a storage unit.
+
+        :param str storage_id: storage unit name
+        :param float depth: initial depth [m]
+        """
+        self.set_value("STORAGE", storage_id, 3, depth)
+
+    def set_orifice_geometry(self, orifice_id, height, width=None):
+        """
+        Set the cross section of an orifice.
+
+        :param str orifice_id: orifice name
+        :param float height: height or diameter of the opening [m]
+        :param float width: width of a rectangular opening [m], None to keep it
+        """
+        self.set_value("XSECTIONS", orifice_id, 2, height)
+        if width is not None:
+            self.set_value("XSECTIONS", orifice_id, 3, width)
+
+
+def data_tokens(line):
+    """
+    Split a line of an input file into its tokens, ignoring comments.
+
+    :param str line: line of an input file
+    :rtype: list
+    """
+    return TOKEN_PATTERN.findall(line.split(";", 1)[0])
+
+
+@cache
+def _parse_file(file, mtime_ns, size):
+    with open(file, "r") as f:
+        return SwmmInputFile.parse(f.read())
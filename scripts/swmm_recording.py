@@ -0,0 +1,351 @@
+import csv
+import datetime
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import yaml
+from pyswmm import Nodes, Links, RainGages, Subcatchments
+
+from run_workspace import atomic_write
+
+TIME_FORMAT = "%Y-%m-%d %H:%M"  # Format of the time column in the csv output.
+
+# Element types of observables, and the pyswmm collection to look up their ID in.
+ELEMENT_COLLECTIONS = {
+    "node": Nodes,
+    "link": Links,
+    "subcatchment": Subcatchments,
+    "raingage": RainGages,
+}
+
+
+class TimeSeriesRecorder:
+    """
+    Records observables of a swmm simulation at each time step in preallocated NumPy columns.
+
+    The columns are sized from the simulation period and time step, and only grow when the
+    simulation takes more steps than expected. Observables are registered by name, optionally with
+    a function returning their current value. The others get their value when recording.
+
+    With a chunk size, the columns only hold that many rows. After registering the observables,
+    :meth:`stream_to` makes the recorder write each full chunk to a csv file, such that memory use
+    does not grow with the simulation period and the rows written so far survive a crash. The
+    chunks can be written in a background thread, such that recording does not wait for the disk.
+
+    :param datetime.datetime start_time: start time of the simulation
+    :param datetime.datetime end_time: end time of the simulation
+    :param float time_step: time step of the simulation in seconds
+    :param int chunk_size: maximum number of rows to hold in memory when streaming
+    """
+    def __init__(self, start_time, end_time, time_step, chunk_size=None):
+        # One record at the start time, and one after each time step.
+        self.capacity = math.ceil((end_time - start_time).total_seconds() / time_step) + 1
+        if chunk_size is not None:
+            self.capacity = min(self.capacity, chunk_size)
+        self.size = 0
+        self.time = np.empty(self.capacity, dtype="datetime64[s]")
+        self.columns = {}
+        self.observables = {}
+        self.writer = None
+        self.executor = None
+        self._pending = None  # Future of the chunk being written in the background.
+
+    def register(self, name, observable=None, dtype=float, before=None):
+        """
+        Register an observable to record.
+
+        :param str name: name of the observable, used as column name
+        :param observable: function without arguments returning the current value of the
+            observable, or None if its value is provided to :meth:`record`
+        :param dtype: NumPy data type of the column
+        :param str before: name of the registered column to put this column before, None to put it
+            after all columns
+        """
+        assert name not in self.columns and name != "time"
+        assert self.writer is None  # The columns of the streamed file are fixed.
+        column = np.zeros(self.capacity, dtype=dtype)
+        if before is None:
+            self.columns[name] = column
+        else:
+            columns = list(self.columns.items())
+            index = list(self.columns).index(before)
+            self.columns = dict(columns[:index] + [(name, column)] + columns[index:])
+        if observable is not None:
+            self.observables[name] = observable
+
+    def record(self, time, **values):
+        """
+        Record the registered observables at the provided time.
+
+        :param datetime.datetime time: current simulation time
+        :param values: values of the observables registered without function
+        """
+        if self.size == self.capacity:
+            if self.writer is not None:
+                self.flush()
+            else:
+                self._grow()
+        self.time[self.size] = time
+        for name, column in self.columns.items():
+            if name in self.observables:
+                column[self.size] = self.observables[name]()
+            else:
+                column[self.size] = values[name]
+        self.size += 1
+
+    def _grow(self):
+        self.capacity *= 2
+        self.time = np.resize(self.time, self.capacity)
+        for name, column in self.columns.items():
+            self.columns[name] = np.resize(column, self.capacity)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, name):
+        if name == "time":
+            return self.time[:self.size]
+        return self.columns[name][:self.size]
+
+    def stream_to(self, file, max_bytes=None, background=False):
+        """
+        Stream the recorded rows to a csv file, in chunks of the recorder's capacity.
+
+        :param str file: path of the csv file, see :class:`StreamingCsvWriter`
+        :param int max_bytes: size after which the rows continue in a new file, None to not rotate
+        :param bool background: whether to write the chunks in a background thread
+        """
+        self.writer = StreamingCsvWriter(file, ["time"] + list(self.columns), max_bytes)
+        if background:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def flush(self):
+        """
+        Write the rows recorded since the previous flush to the csv file streamed to. In the
+        background, the rows are written after the previous chunk is done.
+        """
+        # The rows are copied from the columns, so the columns can be reused right away.
+        rows = self._rows()
+        self.size = 0
+        if self.executor is None:
+            self._write(rows)
+        else:
+            if self._pending is not None:
+                self._pending.result()  # Raise the errors of the previous chunk, if any.
+            self._pending = self.executor.submit(self._write, rows)
+
+    def _write(self, rows):
+        self.writer.writerows(rows)
+        self.writer.flush()
+
+    def close(self):
+        """
+        Write the remaining rows and complete the csv file streamed to.
+        """
+        self.flush()
+        if self.executor is not None:
+            self._pending.result()
+            self.executor.shutdown()
+        self.writer.close()
+
+    def save(self, file):
+        """
+        Save the recorded columns to a NumPy .npz file. When streaming, the columns are read back
+        from the csv files after :meth:`close`, such that they do not have to stay in memory during
+        the simulation.
+
+        :param str file: path of the .npz file
+        """
+        if self.writer is None:
+            np.savez(file, time=self["time"], **{name: self[name] for name in self.columns})
+            return
+        assert self.writer.f.closed
+        rows = []
+        for streamed_file in self.writer.files:
+            with open(streamed_file, "r") as f:
+                reader = csv.reader(f)
+                next(reader)  # Header row.
+                rows.extend(reader)
+        values = list(zip(*rows)) if rows else [()] * (len(self.columns) + 1)
+        np.savez(file, time=np.array(values[0], dtype="datetime64[s]"),
+                 **{name: np.array(column_values, dtype=column.dtype)
+                    for (name, column), column_values in zip(self.columns.items(), values[1:])})
+
+    def write_csv(self, file, header=True):
+        """
+        Write the recorded columns to a csv file, with a header row of the column names.
+
+        :param str file: path of the csv file
+        :param bool header: whether to write the header row
+        """
+        with open(file, "w") as f:
+            writer = csv.writer(f)
+            if header:
+                writer.writerow(["time"] + list(self.columns))
+            writer.writerows(self._rows())
+
+    def _rows(self):
+        times = [t.strftime(TIME_FORMAT) for t in self["time"].tolist()]
+        return zip(times, *(self[name].tolist() for name in self.columns))
+
+
+class StreamingCsvWriter:
+    """
+    Writes rows to a csv file while a simulation is still running.
+
+    Each flush forces the rows written so far to disk. With a maximum size, the rows continue in a
+    new file with the same header once a file exceeds it. Those files get a number appended, e.g.
+    ``results_1.csv``. Numbered files of an earlier run to the same file are removed at the start.
+    On :meth:`close`, a manifest ``<file>.manifest.json`` is written listing the files, the columns
+    and the number of rows. The manifest thus marks a completed run, while the csv files stay plain
+    csv. A missing manifest means the run did not finish.
+
+    :param str file: path of the (first) csv file
+    :param list header: column names, None to write the files without header row
+    :param int max_bytes: size after which the rows continue in a new file, None to not rotate
+    """
+    def __init__(self, file, header, max_bytes=None):
+        self.file = file
+        self.header = header
+        self.max_bytes = max_bytes
+        self.manifest_file = file + ".manifest.json"
+        self.files = []
+        self.rows = 0
+        if os.path.isfile(self.manifest_file):
+            os.remove(self.manifest_file)
+        index = 1
+        while os.path.isfile(self._numbered_file(index)):
+            os.remove(self._numbered_file(index))
+            index += 1
+        self._open_next_file()
+
+    def _numbered_file(self, index):
+        if index == 0:
+            return self.file
+        root, extension = os.path.splitext(self.file)
+        return f"{root}_{index}{extension}"
+
+    def _open_next_file(self):
+        file = self._numbered_file(len(self.files))
+        self.files.append(file)
+        self.f = open(file, "w")
+        self.writer = csv.writer(self.f)
+        if self.header is not None:
+            self.writer.writerow(self.header)
+
+    def writerow(self, row):
+        self.writer.writerow(row)
+        self.rows += 1
+
+    def writerows(self, rows):
+        for row in rows:
+            self.writerow(row)
+
+    def flush(self):
+        """
+        Force the rows written so far to disk, and continue in a new file if the current one is
+        too large.
+        """
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        if self.max_bytes is not None and self.f.tell() >= self.max_bytes:
+            self.f.close()
+            self._open_next_file()
+
+    def close(self):
+        """
+        Close the current file and write the manifest of the completed run.
+        """
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+        manifest = {
+            "files": [os.path.basename(file) for file in self.files],
+            "columns": self.header,
+            "rows": self.rows,
+            "completed": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+        with atomic_write(self.manifest_file) as f:
+            json.dump(manifest, f, indent=2)
+
+
+def load_observables(file):
+    """
+    Load the declarations of the observables to record from a yaml file.
+
+    The file contains a list of observables, each with the keys:
+
+    - name: column name
+    - element: element type, one of the keys of :data:`ELEMENT_COLLECTIONS`
+    - id: element ID in the swmm model
+    - attribute: pyswmm attribute of the element, e.g. ``depth``. Entries of dictionary attributes
+      are given with a dot, e.g. ``statistics.flooding_volume``.
+    - mode (optional): ``value`` to record the attribute as is (default), ``delta`` to record the
+      change since the previous record of a cumulative attribute, or ``total`` to record the
+      running total of the attribute.
+    - enabled (optional): whether to record the observable, true by default
+
+    :param str file: path of the yaml file
+    :return: the enabled observables
+    :rtype: list
+    """
+    with open(file, "r") as f:
+        observables = yaml.safe_load(f)
+    return [observable for observable in observables if observable.get("enabled", True)]
+
+
+def register_observables(recorder, sim, observables):
+    """
+    Register observables of the swmm elements to a recorder.
+
+    The element of each observable is looked up once, so recording only reads its attribute.
+
+    :param TimeSeriesRecorder recorder: recorder to register the observables to
+    :param pyswmm.Simulation sim: opened swmm simulation
+    :param list observables: observable declarations, as returned by :func:`load_observables`
+    """
+    for observable in observables:
+        recorder.register(observable["name"], observable_function(sim, observable))
+
+
+def observable_function(sim, observable):
+    """
+    Create the function returning the current value of an observable.
+
+    :param pyswmm.Simulation sim: opened swmm simulation
+    :param dict observable: observable declaration, see :func:`load_observables`
+    :rtype: function
+    """
+    element = ELEMENT_COLLECTIONS[observable["element"]](sim)[observable["id"]]
+    attribute, _, key = observable["attribute"].partition(".")
+    if key:
+        def sample():
+            return getattr(element, attribute)[key]
+    else:
+        def sample():
+            return getattr(element, attribute)
+
+    mode = observable.get("mode", "value")
+    if mode == "value":
+        return sample
+    elif mode == "delta":
+        previous = 0.0
+
+        def delta():
+            nonlocal previous
+            value = sample()
+            change, previous = value - previous, value
+            return change
+        return delta
+    elif mode == "total":
+        total = 0.0
+
+        def running_total():
+            nonlocal total
+            total += sample()
+            return total
+        return running_total
+    raise ValueError(f"Unknown mode {mode} of observable {observable['name']}.")
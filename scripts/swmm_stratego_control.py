@@ -1,16 +1,39 @@
-from pyswmm import Simulation, Nodes, Links, RainGages, Subcatchments
+from pyswmm import Simulation, Nodes, Links, RainGages
+from concurrent.futures import ThreadPoolExecutor
+import os
 import os.path
-import csv
 import re
+import signal
+import subprocess
 import strategoutil as sutil
 import datetime
+import math
 import sys
+import time
 import yaml
+import numpy as np
 import weather_forecast_generation as weather
+from decision_cache import DecisionCache
+from event_trigger import EventTrigger
+from run_workspace import RunWorkspace, create_results_folder
+from stratego_strategy import StrategoStrategy, read_constants
+from swmm_inp import SwmmInputFile, RAIN_TIMESERIES
+from swmm_recording import TimeSeriesRecorder, load_observables, register_observables
+
+FORECAST_TAG = "//TAG_weather_forecast"  # Tag replaced by the forecast in embedded models.
+RESULT_CHUNK_SIZE = 60  # Number of time steps between two writes of streamed results.
+# Where the action of a control instant came from, when synthesis has a deadline.
+FALLBACK_NONE = 0  # Synthesized within the deadline, or not synthesized at all.
+FALLBACK_LAST_STRATEGY = 1  # The next action of the strategy of the previous control instant.
+FALLBACK_LEVEL_RULE = 2  # The opening of the level rule.
+CANCEL_POLL_INTERVAL = 0.1  # Seconds between two checks whether a synthesis is cancelled.
 
 
 def swmm_control(swmm_inputfile, orifice_id, basin_id, time_step, csv_file_basename, controller,
-                 period, horizon, rain_data_file, weather_forecast_path, uncertainty):
+                 period, horizon, rain_data_file, weather_forecast_path, uncertainty,
+                 precompute_forecasts=True, nowcast_file=None, stream_results=True,
+                 max_result_bytes=None, observables_file=None, decision_cache=None,
+                 strategy_table=None, speculation=None, pipelined=False, event_trigger=None):
     """
     Implement the control strategy from uppal stratego to swmm
     requires:
@@ -18,33 +41,47 @@ def swmm_control(swmm_inputfile, orifice_id, basin_id, time_step, csv_file_basen
         orifice_id: string
         open_settings: percentage of orifice opening, float, from 0 to 1
         basin_id: string, upstream basin ID
-        time_step: float
+        time_step: float, seconds between two control instants. The weather forecasts start at
+            the minutes of the rain data, so it has to be a whole number of minutes.
         csv_file_basename: path
+        precompute_forecasts: whether to compute the weather forecasts of all control instants
+            before the simulation starts. The forecasts are also saved next to the csv file.
+            Otherwise, each forecast is updated incrementally from the previous one.
+        nowcast_file: path of a live rainfall nowcast file. If provided, the forecasts are
+            calculated from the latest nowcast instead, falling back to the rain data file when
+            the nowcast does not cover the forecast horizon.
+        stream_results: whether to write the results to the csv file during the simulation, in
+            chunks of RESULT_CHUNK_SIZE rows, such that they survive a crash. Otherwise, they are
+            only written at the end. Either way, an npz file with the same columns is saved at the
+            end.
+        max_result_bytes: size after which the streamed results continue in a new csv file, see
+            swmm_recording.StreamingCsvWriter. None to write a single file.
+        observables_file: path of a yaml file declaring the swmm observables to record, see
+            swmm_recording.load_observables(). By default, the water depth of both basins and the
+            rain are recorded.
+        decision_cache: DecisionCache to reuse the control actions of earlier situations, None to
+            synthesize a strategy at every control instant.
+        strategy_table: StrategyTable of actions synthesized offline, see strategy_table.py. If
+            provided, the actions are looked up in the table, and only synthesized for states
+            outside of its grid, or between grid points with different actions.
+        speculation: SpeculativeSynthesizer to synthesize the actions of the next control instant
+            while swmm simulates the current control period, see speculative_synthesis.py.
+        pipelined: whether to prepare the weather forecast of the next control instant and write
+            the streamed results in background threads, while verifyta synthesizes the strategy
+            of the current control instant.
+        event_trigger: EventTrigger deciding when to synthesize a new strategy, see
+            event_trigger.py. In between, the previous strategy is evaluated in the observed state
+            if the controller saves its strategies, and otherwise the actions it planned are
+            executed. None to synthesize a strategy at every control instant.
 
     returns:
-        one csv files with three columns:
+        one csv file with the columns:
         col 0. time 
         col 1. the upstream pond water level changes when implemented control strategy, meter above the bottom elevation of basin
         col 2. the orifice flow (discharge) changes when implemented control strategy, cubic meter per second
     """
-    time_series = []
-    water_depth_basin1 = []
-    water_depth_basin2 = []
-    orifice_settings = []
-    # orifice_flow = []
-    # basin_total_inflow = []
-    # basin_total_outflow = []
-    # basin_total_evaporation = []
-    # overflow = []
-    rain = []
-    weather_forecast_low = []
-    weather_forecast_high = []
-    weather_forecast_int = []
-    # subcatchment_total_rain = []
-    # subcatchment_total_runoff = []
-    # subcatchment_total_infiltration = []
-    # subcatchment_total_evaporation = []
-
+    if time_step <= 0 or time_step % 60 != 0:
+        raise ValueError(f"The time step of {time_step} seconds is not a whole number of minutes.")
     with Simulation(swmm_inputfile) as sim:
         sys.stdout.write('\n')
         i = 0
@@ -52,97 +89,289 @@ def swmm_control(swmm_inputfile, orifice_id, basin_id, time_step, csv_file_basen
         duration = interval.total_seconds() / 3600
         print_progress_bar(i, duration, "progress")
         su1 = Nodes(sim)[basin_id]
-        su2 = Nodes(sim)['SU2']
         orifice = Links(sim)[orifice_id]
-        # rg1 = RainGages(sim)["RG1"]
-        ca = Subcatchments(sim)["S1"]
         sim.step_advance(time_step)
+        # Start the simulation already, such that all observables can be read at the start time.
+        # Starting also resets the orifice setting, so the first control action is set afterwards.
+        sim.start()
         current_time = sim.start_time
 
+        dirname = os.path.dirname(swmm_inputfile)
+        output_csv_file = os.path.join(dirname, csv_file_basename + "." + "csv")
+        recorder = TimeSeriesRecorder(sim.start_time, sim.end_time, time_step,
+                                      RESULT_CHUNK_SIZE if stream_results else None)
+        if observables_file is not None:
+            observables = load_observables(observables_file)
+        else:
+            observables = default_observables(basin_id)
+        register_observables(recorder, sim, observables)
+        # Keep the column order of the results from before the observables were declarative.
+        recorder.register("orifice_setting", lambda: 1.75 * orifice.target_setting + 2,
+                          before="rain" if "rain" in recorder.columns else None)
+        recorder.register("forecast_low", dtype=np.int32)
+        recorder.register("forecast_high", dtype=np.int32)
+        recorder.register("forecast_int")
+        if controller.deadline is not None:
+            # Record how long each synthesis took, and whether a fallback action was used.
+            recorder.register("synthesis_time", lambda: controller.synthesis_time)
+            recorder.register("fallback", lambda: controller.fallback, dtype=np.int8)
+        if event_trigger is not None:
+            recorder.register("strategy_age", lambda: event_trigger.age, dtype=np.int32)
+            # Simulate the strategies long enough to plan the actions until they expire.
+            controller.simulated_periods = min(event_trigger.max_age, horizon)
+        if stream_results:
+            recorder.stream_to(output_csv_file, max_result_bytes, background=pipelined)
+
+        if nowcast_file is not None:
+            forecast_source = weather.NowcastSource(nowcast_file, horizon * period, uncertainty)
+        elif precompute_forecasts:
+            rain_data = weather.read_rain_data(rain_data_file)
+            forecast_source = weather.ForecastTable.build(rain_data, sim.start_time, sim.end_time,
+                                                          time_step // 60, horizon * period,
+                                                          uncertainty)
+            forecast_source.save(os.path.join(os.path.dirname(swmm_inputfile),
+                                              csv_file_basename + "_forecasts.npz"))
+        else:
+            rain_data = weather.read_rain_data(rain_data_file)
+            forecast_source = weather.IncrementalForecaster(rain_data, horizon * period,
+                                                            uncertainty)
+        prefetcher = None
+        if pipelined:
+            prefetcher = ForecastPrefetcher(controller, time_step, sim.end_time, horizon * period,
+                                            rain_data_file, uncertainty, forecast_source)
+
+        weather_forecast = None if prefetcher is None else prefetcher.get(current_time)
         orifice.target_setting = get_control_strategy(su1.depth, current_time, controller, period,
                                                       horizon, rain_data_file,
-                                                      weather_forecast_path, uncertainty)
-        orifice_settings.append(1.75*orifice.target_setting + 2)
-        rain_low, rain_high, rain_int = get_weather_forecast_result(weather_forecast_path)
-        weather_forecast_low.append(rain_low)
-        weather_forecast_high.append(rain_high)
-        weather_forecast_int.append(rain_int)
-        time_series.append(sim.start_time)
-        water_depth_basin1.append(su1.depth)
-        water_depth_basin2.append(su2.depth)
-        rain.append(0)
-        total_precipitation = 0
-
-        total_inflow = 0
-        total_outflow = 0
-        total_rainfall = 0
+                                                      weather_forecast_path, uncertainty,
+                                                      forecast_source, decision_cache,
+                                                      strategy_table, speculation,
+                                                      weather_forecast, event_trigger)
+        rain_low, rain_high, rain_int = get_weather_forecast_result(controller.weather_forecast)
+        recorder.record(sim.start_time, forecast_low=rain_low, forecast_high=rain_high,
+                        forecast_int=rain_int)
+        previous_water_level = None
+        if speculation is not None:
+            previous_water_level = speculate_next_step(speculation, controller, su1.depth, None,
+                                                       current_time, time_step, sim.end_time,
+                                                       period, horizon, rain_data_file,
+                                                       uncertainty, forecast_source, prefetcher,
+                                                       strategy_table, decision_cache)
         for step in sim:
             current_time = sim.current_time
-            time_series.append(current_time)
-            water_depth_basin1.append(su1.depth)
-            water_depth_basin2.append(su2.depth)
-            rain.append(ca.statistics.get('precipitation') - total_precipitation)
-            total_precipitation = ca.statistics.get('precipitation')
 
             i = i + 1
             print_progress_bar(i, duration, "progress")
             # Set the control parameter
+            weather_forecast = None if prefetcher is None else prefetcher.get(current_time)
             orifice.target_setting = get_control_strategy(su1.depth, current_time, controller,
                                                           period, horizon, rain_data_file,
-                                                          weather_forecast_path, uncertainty)
-            orifice_settings.append(1.75*orifice.target_setting + 2)
-            rain_low, rain_high, rain_int = get_weather_forecast_result(weather_forecast_path)
-            weather_forecast_low.append(rain_low)
-            weather_forecast_high.append(rain_high)
-            weather_forecast_int.append(rain_int)
-
-            # orifice_flow.append(orifice.flow)
-            # rain.append(rg1.rainfall)
-            # total_inflow = total_inflow + su.total_inflow
-            # basin_total_inflow.append(total_inflow)
-            # overflow.append(su.statistics.get('flooding_volume'))
-            # total_outflow = total_outflow + su.total_outflow
-            # basin_total_outflow.append(total_outflow)
-            # basin_total_evaporation.append(su.storage_statistics.get('evap_loss'))
-            # total_rainfall = total_rainfall + ca.rainfall
-            # subcatchment_total_rain.append(total_rainfall)
-            # subcatchment_total_runoff.append(ca.statistics.get('runoff'))
-            # subcatchment_total_infiltration.append(ca.statistics.get('infiltration'))
-            # subcatchment_total_evaporation.append(ca.statistics.get('evaporation'))
+                                                          weather_forecast_path, uncertainty,
+                                                          forecast_source, decision_cache,
+                                                          strategy_table, speculation,
+                                                          weather_forecast, event_trigger)
+            rain_low, rain_high, rain_int = get_weather_forecast_result(controller.weather_forecast)
+            recorder.record(current_time, forecast_low=rain_low, forecast_high=rain_high,
+                            forecast_int=rain_int)
+            if speculation is not None:
+                previous_water_level = speculate_next_step(speculation, controller, su1.depth,
+                                                           previous_water_level, current_time,
+                                                           time_step, sim.end_time, period,
+                                                           horizon, rain_data_file, uncertainty,
+                                                           forecast_source, prefetcher,
+                                                           strategy_table, decision_cache)
 
     i = i + 1
     print_progress_bar(i, duration, "progress")
-    dirname = os.path.dirname(swmm_inputfile)
-    output_csv_file = os.path.join(dirname, csv_file_basename + "." + "csv")
-    with open(output_csv_file, "w") as f:
-        writer = csv.writer(f)
-        writer.writerow(["time", "water_depth_basin1", "water_depth_basin2", "orifice_setting",
-                         "rain", "forecast_low", "forecast_high", "forecast_int"])
-        for i, j, k, l, m, n, o, p in zip(time_series, water_depth_basin1, water_depth_basin2,
-                                          orifice_settings, rain, weather_forecast_low,
-                                          weather_forecast_high, weather_forecast_int):
-            i = i.strftime('%Y-%m-%d %H:%M')
-            writer.writerow([i, j, k, l, m, n, o, p])
+    if prefetcher is not None:
+        prefetcher.close()
+    if decision_cache is not None:
+        decision_cache.save()
+    if stream_results:
+        recorder.close()
+    else:
+        recorder.write_csv(output_csv_file)
+    recorder.save(os.path.join(dirname, csv_file_basename + ".npz"))
+
+
+def default_observables(basin_id):
+    """
+    The swmm observables recorded by swmm_control() when no observables file is provided.
+
+    :param str basin_id: upstream basin ID
+    :rtype: list
+    """
+    return [
+        {"name": "water_depth_basin1", "element": "node", "id": basin_id, "attribute": "depth"},
+        {"name": "water_depth_basin2", "element": "node", "id": "SU2", "attribute": "depth"},
+        {"name": "rain", "element": "subcatchment", "id": "S1",
+         "attribute": "statistics.precipitation", "mode": "delta"},
+    ]
 
 
 def get_control_strategy(current_water_level, current_time, controller, period, horizon,
-                         rain_data_file, weather_forecast_path, uncertainty):
+                         rain_data_file, weather_forecast_path, uncertainty, forecast_source=None,
+                         decision_cache=None, strategy_table=None, speculation=None,
+                         weather_forecast=None, event_trigger=None):
     controller.controller.update_state({'w': current_water_level * 100}) #  Conversion from m to cm.
-    control_setting = controller.run_single(period, horizon, start_date=current_time,
-                                            historical_rain_data_path=rain_data_file,
-                                            weather_forecast_path=weather_forecast_path,
-                                            uncertainty=uncertainty)
-
+    controller.synthesis_time = 0.0
+    controller.fallback = FALLBACK_NONE
+    if decision_cache is None and strategy_table is None and speculation is None and \
+            weather_forecast is None and event_trigger is None:
+        return controller.run_single(period, horizon, start_date=current_time,
+                                     historical_rain_data_path=rain_data_file,
+                                     weather_forecast_path=weather_forecast_path,
+                                     uncertainty=uncertainty, forecast_source=forecast_source)
+
+    # Look up the decision of the current state and forecast before synthesizing a strategy.
+    if weather_forecast is None:
+        weather_forecast = controller.get_weather_forecast(
+            current_time, horizon * period, historical_rain_data_path=rain_data_file,
+            uncertainty=uncertainty, forecast_source=forecast_source)
+    controller.weather_forecast = weather_forecast
+    water_level = controller.controller.get_state("w")
+    if event_trigger is not None and not event_trigger.replan(water_level, weather_forecast):
+        # Evaluate the saved strategy in the observed state if possible, otherwise execute the plan.
+        control_setting = event_trigger.next_action()
+        strategy_setting = controller.evaluate_strategy(weather_forecast)
+        return control_setting if strategy_setting is None else strategy_setting
+
+    control_setting = None
+    actions = None  # The actions of the next control periods, if a strategy is synthesized.
+    if strategy_table is not None:
+        control_setting = strategy_table.lookup(water_level, weather_forecast)
+    key = None  # The cache key of a decision that is not cached yet.
+    if control_setting is None and decision_cache is not None:
+        key = decision_cache.key(controller.controller.get_states(), weather_forecast)
+        control_setting = decision_cache.get(key)
+        if control_setting is not None:
+            key = None
+    if control_setting is None and speculation is not None:
+        control_setting = speculation.result(water_level, weather_forecast)
+    if control_setting is None:
+        control_setting = controller.run_single(period, horizon, start_date=current_time,
+                                                historical_rain_data_path=rain_data_file,
+                                                weather_forecast_path=weather_forecast_path,
+                                                uncertainty=uncertainty,
+                                                weather_forecast=weather_forecast)
+        if controller.fallback == FALLBACK_NONE:
+            actions = controller.planned_actions(period)
+        else:
+            # A fallback action is no decision of the current situation, so it is neither cached
+            # nor planned beyond the current period, and the next control instant synthesizes again.
+            key = None
+    if key is not None:
+        decision_cache.put(key, control_setting)
+    if event_trigger is not None:
+        event_trigger.plan(water_level, weather_forecast,
+                           [control_setting] if actions is None else actions,
+                           periods=None if controller.fallback == FALLBACK_NONE else 1)
     return control_setting
 
 
-def get_weather_forecast_result(weather_forecast_path):
-    with open(weather_forecast_path, "r") as f:
-        weather_forecast = csv.reader(f, delimiter=',', quotechar='"')
-        headers = next(weather_forecast)
-        first_data = next(weather_forecast)
+def speculate_next_step(speculation, controller, current_water_level, previous_water_level,
+                        current_time, time_step, end_time, period, horizon, rain_data_file,
+                        uncertainty, forecast_source, prefetcher=None, strategy_table=None,
+                        decision_cache=None):
+    """
+    Start the speculative synthesis of the next control instant, if there is one. The forecast
+    is taken from the prefetcher if provided, which then keeps it for the next control instant.
+    Candidate water levels whose action the strategy table or decision cache already knows are
+    not synthesized.
+
+    :return: the current water level [cm], to pass as previous water level at the next control
+        instant
+    :rtype: float
+    """
+    water_level = current_water_level * 100  # Conversion from m to cm.
+    next_time = current_time + datetime.timedelta(seconds=time_step)
+    if next_time <= end_time:
+        if prefetcher is not None:
+            weather_forecast = prefetcher.peek(next_time)
+        else:
+            weather_forecast = controller.get_weather_forecast(
+                next_time, horizon * period, historical_rain_data_path=rain_data_file,
+                uncertainty=uncertainty, forecast_source=forecast_source)
+
+        def known(candidate_water_level):
+            if strategy_table is not None and \
+                    strategy_table.lookup(candidate_water_level, weather_forecast) is not None:
+                return True
+            if decision_cache is None:
+                return False
+            states = dict(controller.controller.get_states(), w=candidate_water_level)
+            return decision_cache.key(states, weather_forecast) in decision_cache
+
+        speculation.submit(water_level, previous_water_level, weather_forecast, known)
+    return water_level
+
+
+class ForecastPrefetcher:
+    """
+    Computes the weather forecast of the next control instant in a background thread, while the
+    strategy of the current control instant is synthesized.
+
+    The forecast source is only used by the background thread once the prefetcher is created, as
+    incremental forecast sources are not thread-safe.
 
-        return int(first_data[0]), int(first_data[1]), float(first_data[4])
+    :param MPCSetupPond controller: controller computing the forecasts
+    :param int time_step: time between two control instants in seconds
+    :param datetime.datetime end_time: time of the last control instant
+    :param int horizon: forecast horizon in minutes
+    """
+    def __init__(self, controller, time_step, end_time, horizon, rain_data_file, uncertainty,
+                 forecast_source):
+        self.controller = controller
+        self.time_step = datetime.timedelta(seconds=time_step)
+        self.end_time = end_time
+        self.horizon = horizon
+        self.rain_data_file = rain_data_file
+        self.uncertainty = uncertainty
+        self.forecast_source = forecast_source
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.date = None
+        self.future = None
+
+    def get(self, date):
+        """
+        Get the forecast of a control instant, and start computing the one of the next control
+        instant.
+
+        :param datetime.datetime date: time of the control instant
+        :rtype: list
+        """
+        weather_forecast = self.peek(date)
+        next_date = date + self.time_step
+        if next_date <= self.end_time:
+            self._submit(next_date)
+        return weather_forecast
+
+    def peek(self, date):
+        """
+        Get the forecast of a control instant, without prefetching the next one.
+
+        :param datetime.datetime date: time of the control instant
+        :rtype: list
+        """
+        if self.date != date:
+            self._submit(date)
+        return self.future.result()
+
+    def _submit(self, date):
+        self.date = date
+        self.future = self.executor.submit(self.controller.get_weather_forecast, date,
+                                           self.horizon,
+                                           historical_rain_data_path=self.rain_data_file,
+                                           uncertainty=self.uncertainty,
+                                           forecast_source=self.forecast_source)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def get_weather_forecast_result(weather_forecast):
+    first_data = weather_forecast[0]
+    return int(first_data[0]), int(first_data[1]), float(first_data[4])
 
 
 def print_progress_bar(i, max, post_text):
@@ -168,7 +397,212 @@ def print_progress_bar(i, max, post_text):
     sys.stdout.flush()
 
 
+class PondStrategoController(sutil.StrategoController):
+    """
+    Stratego controller that also inserts the weather forecast into the simulation model, for models
+    created with create_embedded_forecast_model().
+    """
+    weather_forecast = None  # The weather forecast to embed, None if it is read from file.
+
+    def insert_state(self):
+        """
+        Insert the current state and, if set, the weather forecast into the simulation model.
+
+        Overrides StrategoController.insert_state().
+        """
+        super().insert_state()
+        if self.weather_forecast is not None:
+            sutil.insert_to_modelfile(self.simulation_file, FORECAST_TAG,
+                                      uppaal_forecast_declarations(self.weather_forecast))
+
+
 class MPCSetupPond(sutil.SafeMPCSetup):
+    """
+    MPC setup of the pond models.
+
+    Besides the arguments of SafeMPCSetup, synthesis can be given a wall-clock deadline. Verifyta
+    is killed when it is not done within the deadline, and the action is taken from the strategy
+    of the previous control instant instead, or from the fallback rule if that strategy is not
+    available.
+
+    :param float deadline: wall-clock budget of each synthesis in seconds, None for no budget
+    :param fallback_rule: function from the water level [cm] to the action, None for the
+        LevelRule of the model template
+
+    With a strategy file, each synthesized strategy is also saved by Stratego, and loaded as a
+    StrategoStrategy, such that it can be evaluated in other states without running verifyta.
+
+    :param str strategy_file: json file to save the synthesized strategies to, None to not save
+        them
+
+    A synthesis running in another thread, like a speculative one, can be cancelled. Verifyta is
+    then killed, and the action is None.
+
+    :param threading.Event cancel: event that cancels the synthesis when set, None to not cancel it
+    """
+    weather_forecast = None  # The weather forecast of the latest iteration.
+    simulated_periods = 1  # Number of control periods to simulate the synthesized strategy for.
+    stratego_output = None  # Output of the latest synthesis, None if it missed the deadline.
+    strategy = None  # StrategoStrategy of the latest synthesis, if saved.
+
+    def __init__(self, *args, deadline=None, fallback_rule=None, strategy_file=None, cancel=None,
+                 **kwargs):
+        super().__init__(*args, **kwargs)
+        self.controller = PondStrategoController(self.model_template_file, self.model_cfg_dict)
+        self.deadline = deadline
+        self.fallback_rule = fallback_rule
+        self.strategy_file = strategy_file
+        self.cancel = cancel
+        self._constants = None  # Constants of the model template, read when first needed.
+        self.deadline_misses = 0
+        self.synthesis_time = 0.0  # Wall-clock time of the latest synthesis in seconds.
+        self.fallback = FALLBACK_NONE  # Where the latest action came from.
+        self._next_action = None  # Next action of the latest strategy, and when to apply it.
+        self._next_action_date = None
+
+    def run_single(self, control_period, horizon, **kwargs):
+        """
+        Synthesize a strategy and get its first action, or the fallback action if synthesis
+        misses the deadline, or None if it is cancelled.
+
+        Overrides MPCsetup.run_single().
+        """
+        if self.deadline is None and self.cancel is None:
+            return super().run_single(control_period, horizon, **kwargs)
+        if not sutil.check_tool_existence(self.verifyta_command):
+            raise RuntimeError(
+                f"Cannot find the supplied verifyta command: {self.verifyta_command}")
+
+        start = time.monotonic()
+        result = self.step_without_sim(control_period, horizon, 1, 0, **kwargs)
+        self.synthesis_time = time.monotonic() - start
+        date = kwargs.get("start_date")
+        if result is None and self.cancel is not None and self.cancel.is_set():
+            return None
+        if result is None:
+            self.deadline_misses += 1
+            if self._next_action is not None and date is not None and \
+                    date == self._next_action_date:
+                self.fallback = FALLBACK_LAST_STRATEGY
+                action = self._next_action
+            else:
+                if self.fallback_rule is None:
+                    self.fallback_rule = LevelRule.from_model(self.model_template_file)
+                self.fallback = FALLBACK_LEVEL_RULE
+                action = self.fallback_rule(self.controller.get_state("w"))
+            self._next_action = None
+            return action
+
+        self.fallback = FALLBACK_NONE
+        self._next_action = extract_action_at(result, self.action_variable, control_period)
+        self._next_action_date = None if date is None else \
+            date + datetime.timedelta(minutes=control_period)
+        return self.extract_control_action_from_stratego(result)
+
+    def run_verifyta(self, horizon, control_period, final, *args, **kwargs):
+        """
+        Run verifyta, within the deadline if there is one.
+
+        Overrides SafeMPCSetup.run_verifyta().
+
+        :return: the output of verifyta, or None if it missed the deadline or was cancelled
+        """
+        if self.strategy_file is not None and os.path.isfile(self.strategy_file):
+            os.remove(self.strategy_file)  # Such that a strategy of an earlier step is not loaded.
+        if self.deadline is None and self.cancel is None:
+            result = super().run_verifyta(horizon, control_period, final, *args, **kwargs)
+        else:
+            deadline = math.inf if self.deadline is None else time.monotonic() + self.deadline
+            result = self.run_stratego_until(deadline)
+            if result is not None and not sutil.successful_result(result):
+                self.create_alternative_query_file(horizon, control_period, final)
+                result = self.run_stratego_until(deadline)
+
+            if self.controller.cleanup:
+                self.controller.remove_simfile()
+        self.stratego_output = result
+        self.strategy = None
+        if result is not None and self.strategy_file is not None and \
+                os.path.isfile(self.strategy_file):
+            self.strategy = StrategoStrategy.load(self.strategy_file)
+        return result
+
+    def evaluate_strategy(self, weather_forecast):
+        """
+        Evaluate the latest saved strategy in the current state, at the start of the provided
+        weather forecast.
+
+        The state is the state of the model at its start: the first interval of the forecast, the
+        time and the clocks of the rain and controller templates reset, and no maximum water level
+        observed yet.
+
+        :param list weather_forecast: weather intervals
+        :return: the action, or None if there is no saved strategy or it does not decide the state
+        :rtype: float
+        """
+        if self.strategy is None:
+            return None
+        if self._constants is None:
+            self._constants = read_constants(self.model_template_file)
+        dry_low, dry_high, rain_low, rain_high = weather_forecast[0][:4]
+        state = dict(self.controller.get_states())
+        state.update({"Rain.i": 0, "Rain.dryL": dry_low, "Rain.dryU": dry_high,
+                      "Rain.rainL": rain_low, "Rain.rainU": rain_high, "Rain.d": 0.0,
+                      "Controller.x": 0.0, "wmax": 0.0, "#time": 0.0, "#t(0)": 0.0})
+        return self.strategy.decide(state, self.action_variable, self._constants)
+
+    def planned_actions(self, control_period):
+        """
+        Get the actions of the latest synthesized strategy for the simulated control periods.
+
+        :param int control_period: control period in Uppaal time units
+        :return: the action of each control period, starting with the first, or None if the
+            latest synthesis missed the deadline
+        :rtype: list
+        """
+        if self.stratego_output is None:
+            return None
+        return [extract_action_at(self.stratego_output, self.action_variable, k * control_period)
+                for k in range(self.simulated_periods)]
+
+    def run_stratego_until(self, deadline):
+        """
+        Run verifyta on the simulation model, and kill it if it is still running at the deadline
+        or when the synthesis is cancelled.
+
+        :param float deadline: time.monotonic() at which to kill verifyta
+        :return: the output of verifyta, or None if it was killed
+        :rtype: str
+        """
+        if self.cancel is not None and self.cancel.is_set():
+            return None
+        task = " ".join(arg for arg in (self.verifyta_command,
+                                        f'"{self.controller.simulation_file}"',
+                                        f'"{self.query_file}"',
+                                        sutil.merge_verifyta_args(self.learning_args)) if arg)
+        # Start a new session, such that the shell and verifyta can be killed together.
+        process = subprocess.Popen(task, shell=True, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, start_new_session=True)
+        while True:
+            timeout = max(deadline - time.monotonic(), 0)
+            if self.cancel is not None:
+                timeout = min(timeout, CANCEL_POLL_INTERVAL)
+            try:
+                stdout, stderr = process.communicate(timeout=timeout)
+                break
+            except subprocess.TimeoutExpired:
+                if time.monotonic() >= deadline or \
+                        (self.cancel is not None and self.cancel.is_set()):
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.communicate()
+                    return None
+        if stderr:
+            raise RuntimeError("Uppaal finished with the following error message:\n\n" +
+                               stderr.decode("utf-8") + "\n" +
+                               "You can run the following command in a terminal to recreate the "
+                               "error:\n\n" + task)
+        return stdout.decode("utf-8")
+
     def create_query_file(self, horizon, period, final):
         """
         Create the query file for each step of the pond model. Current
@@ -180,9 +614,12 @@ class MPCSetupPond(sutil.SafeMPCSetup):
             line1 = f"strategy opt = minE (c) [<={horizon}*{period}]: <> (t=={final} && o <= 0)\n"
             f.write(line1)
             f.write("\n")
-            line2 = f"simulate 1 [<={period}+1] {{ {self.controller.get_var_names_as_string()} " \
-                    f"}} under opt\n"
+            line2 = f"simulate 1 [<={self.simulated_periods * period}+1] " \
+                    f"{{ {self.controller.get_var_names_as_string()} }} under opt\n"
             f.write(line2)
+            if self.strategy_file is not None:
+                f.write("\n")
+                f.write(f"saveStrategy(\"{self.strategy_file}\", opt)\n")
 
     def create_alternative_query_file(self, horizon, period, final):
         """
@@ -195,20 +632,110 @@ class MPCSetupPond(sutil.SafeMPCSetup):
             line1 = f"strategy opt = minE (wmax) [<={horizon}*{period}]: <> (t=={final})\n"
             f.write(line1)
             f.write("\n")
-            line2 = f"simulate [<={period}+1;1] {{ {self.controller.get_var_names_as_string()} " \
-                    f"}} under opt\n"
+            line2 = f"simulate [<={self.simulated_periods * period}+1;1] " \
+                    f"{{ {self.controller.get_var_names_as_string()} }} under opt\n"
             f.write(line2)
+            if self.strategy_file is not None:
+                f.write("\n")
+                f.write(f"saveStrategy(\"{self.strategy_file}\", opt)\n")
 
     def perform_at_start_iteration(self, controlperiod, horizon, duration, step, **kwargs):
         """
         Performs some customizable preprocessing steps at the start of each MPC iteration.
 
         Overrides SafeMPCsetup.perform_at_start_iteration().
+
+        Without a weather forecast path, the forecast is embedded in the simulation model instead
+        of written to file. The model template should then be created with
+        create_embedded_forecast_model(). A weather forecast computed in advance can be provided
+        as weather_forecast.
+        """
+        if kwargs.get("weather_forecast") is not None:
+            self.weather_forecast = kwargs["weather_forecast"]
+        else:
+            current_date = kwargs["start_date"] + datetime.timedelta(hours=step)
+            self.weather_forecast = self.get_weather_forecast(current_date,
+                                                              horizon * controlperiod, **kwargs)
+
+        if kwargs["weather_forecast_path"] is None:
+            self.controller.weather_forecast = self.weather_forecast
+        else:
+            weather.write_weather_forecast(kwargs["weather_forecast_path"], self.weather_forecast)
+
+    def get_weather_forecast(self, date, horizon, **kwargs):
+        """
+        Get the weather forecast starting at the provided date, from the forecast source if it
+        covers the date, and otherwise from the historical rain data.
+
+        :param datetime.datetime date: start date of the forecast
+        :param int horizon: forecast horizon in minutes
+        :return: weather intervals
+        :rtype: list
+        """
+        # ForecastTable, IncrementalForecaster or NowcastSource.
+        forecast_source = kwargs.get("forecast_source")
+        if forecast_source is not None and date in forecast_source:
+            return forecast_source.forecast_at(date)
+        return weather.create_weather_forecast(kwargs["historical_rain_data_path"], None, date,
+                                               horizon, kwargs["uncertainty"])
+
+
+class LevelRule:
+    """
+    Fallback controller choosing an orifice opening by the water level of the pond: the higher the
+    level, the wider the opening.
+
+    :param list openings: openings to choose from, increasing
+    :param list thresholds: water levels [cm] from which on the next opening is chosen, one less
+        than the openings
+    """
+    def __init__(self, openings, thresholds):
+        assert len(thresholds) == len(openings) - 1
+        self.openings = openings
+        self.thresholds = thresholds
+
+    @classmethod
+    def from_model(cls, uppaal_model):
+        """
+        Create the rule of the openings Opening[C] of a pond model, dividing the levels up to the
+        maximum water height W evenly over the openings.
+
+        :param str uppaal_model: uppaal model path
+        :rtype: LevelRule
         """
-        current_date = kwargs["start_date"] + datetime.timedelta(hours=step)
-        weather.create_weather_forecast(kwargs["historical_rain_data_path"],
-                                        kwargs["weather_forecast_path"], current_date,
-                                        horizon * controlperiod, kwargs["uncertainty"])
+        constants = read_constants(uppaal_model)
+        if "Opening" not in constants or "W" not in constants:
+            raise RuntimeError(f"The uppaal model {uppaal_model} does not declare the openings "
+                               f"Opening[C] and maximum water height W.")
+        openings = sorted(constants["Opening"])
+        thresholds = [constants["W"] * k / len(openings) for k in range(1, len(openings))]
+        return cls(openings, thresholds)
+
+    def __call__(self, water_level):
+        return self.openings[int(np.searchsorted(self.thresholds, water_level, side="right"))]
+
+
+def extract_action_at(stratego_output, action_variable, time):
+    """
+    Extract the control action at the provided time from the simulation output of Stratego.
+
+    :param str stratego_output: output of Uppaal Stratego
+    :param str action_variable: name of the control variable
+    :param float time: time in Uppaal time units
+    :return: the last action at or before the time, or None if there is none
+    :rtype: float
+    """
+    float_re = r"[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?"
+    pattern = action_variable + r":\n\[0\]:( \(" + float_re + "," + float_re + r"\))*"
+    result = re.search(pattern, stratego_output)
+    if result is None:
+        return None
+    action = None
+    for t, value in sutil.get_float_tuples(result.group()):
+        if t > time:
+            break
+        action = value
+    return action
 
 
 def insert_rain_data_file_path(swmm_inputfile, rain_data_file):
@@ -248,44 +775,103 @@ def insert_paths_in_uppaal_model(uppaal_model, weather_forecast_path, libtable_p
         f.truncate()
 
 
+def create_embedded_forecast_model(uppaal_model, embedded_model):
+    """
+    Create a copy of the uppaal model that gets the weather forecast embedded in its declarations,
+    instead of reading it from a csv file with libtable.
+
+    The libtable import is removed, the csv file is replaced by a tag for the forecast arrays, and
+    the libtable calls become lookups in these arrays.
+
+    :param str uppaal_model: uppaal model path, reading the weather forecast with libtable
+    :param str embedded_model: path of the model to create
+    """
+    with open(uppaal_model, "r") as f:
+        file_content = f.read()
+    file_content, n = re.subn(r"const int file_id = table_read_csv\([^;]*\);", FORECAST_TAG,
+                              file_content, count=1)
+    if n == 0:
+        raise RuntimeError(f"The uppaal model {uppaal_model} does not read a weather forecast with "
+                           f"libtable.")
+    file_content = re.sub(r"(// Import data reading functions\n)?import \"[^\"]*\"\s*\{.*?\};\n", "",
+                          file_content, count=1, flags=re.DOTALL)
+    file_content = re.sub(r"const int (rows|cols) = table_(rows|cols)\(file_id\);\n", "",
+                          file_content)
+    file_content = re.sub(r"table_(rows|cols)\(file_id\)", r"\1", file_content)
+    file_content = re.sub(r"read_(int|double)\(file_id,\s*([^,]+),\s*([^,()]+)\)",
+                          r"forecast_\1[\2][\3]", file_content)
+    with open(embedded_model, "w") as f:
+        f.write(file_content)
+
+
+def uppaal_forecast_declarations(weather_forecast):
+    """
+    Declare the weather forecast as constant arrays for a model created with
+    create_embedded_forecast_model().
+
+    :param list weather_forecast: weather intervals
+    :return: uppaal declarations of rows, cols, forecast_int and forecast_double
+    :rtype: str
+    """
+    int_rows = ", ".join("{" + ", ".join(str(int(value)) for value in row) + "}"
+                         for row in weather_forecast)
+    double_rows = ", ".join("{" + ", ".join(np.format_float_positional(float(value), trim="0")
+                                            for value in row) + "}"
+                            for row in weather_forecast)
+    return (f"const int rows = {len(weather_forecast)};\n"
+            f"const int cols = {len(weather_forecast[0])};\n"
+            f"const int forecast_int[rows][cols] = {{{int_rows}}};\n"
+            f"const double forecast_double[rows][cols] = {{{double_rows}}};")
+
+
 def main():
     # First figure out where the swmm model file is located. This is also OS dependent.
     this_file = os.path.realpath(__file__)
     base_folder = os.path.dirname(os.path.dirname(this_file))
     swmm_folder = "swmm_models"
-    swmm_inputfile = os.path.join(base_folder, swmm_folder, "swmm_demo3.inp")
-    assert (os.path.isfile(swmm_inputfile))
-
-    # We found the model. Now we have to include the correct path to the rain data into the model.
+    swmm_template_path = os.path.join(base_folder, swmm_folder, "swmm_demo3.inp")
+    assert (os.path.isfile(swmm_template_path))
     rain_data_file = "swmm_5061.dat"  # Assumed to be in the same folder as the swmm model input file.
     rain_data_file = os.path.join(base_folder, swmm_folder, rain_data_file)
-    insert_rain_data_file_path(swmm_inputfile, rain_data_file)
 
     # Finally we can specify other variables of swimm.
     orifice_id = "OR1"
     basin_id = "SU1"
     time_step = 60 * 60  # 60 seconds/min x 60 min/h -> 1 h
-    swmm_results = "swmm_demo3_results"
+    # Absolute, so the results are written to a results folder of this run instead of the
+    # workspace, which is removed afterwards.
+    results_folder = create_results_folder(os.path.join(base_folder, swmm_folder, "results"),
+                                           prefix="swmm_demo3_")
+    swmm_results = os.path.join(results_folder, "swmm_demo3_results")
+    swmm_observables = os.path.join(base_folder, swmm_folder, "swmm_demo3_observables.yaml")
 
     # Now we locate the Uppaal folder and files.
     uppaal_folder_name = "uppaal"
     uppaal_folder = os.path.join(base_folder, uppaal_folder_name)
-    model_template_path = os.path.join(uppaal_folder, "pond_demo3.xml")
-    query_file_path = os.path.join(uppaal_folder, "pond_demo3_query.q")
+    uppaal_template_path = os.path.join(uppaal_folder, "pond_demo3.xml")
     model_config_path = os.path.join(uppaal_folder, "pond_demo3_config.yaml")
     learning_config_path = os.path.join(uppaal_folder, "verifyta_demo3_config.yaml")
-    weather_forecast_path = os.path.join(uppaal_folder, "demo3_weather_forecast.csv")
-    output_file_path = os.path.join(uppaal_folder, "demo3_result.txt")
     verifyta_command = "verifyta-5-rc4"
-    insert_paths_in_uppaal_model(model_template_path, weather_forecast_path,
-                                 os.path.join(uppaal_folder, "libtable.dylib"))
+    embed_weather_forecast = False  # Whether to embed the forecast in the model instead of libtable.
 
     # Define uppaal model variables.
     action_variable = "Open"  # Name of the control variable.
-    debug = True  # Whether to run in debug mode.
+    debug = True  # Whether to run in debug mode, which keeps the workspace with the model copies.
     period = 60  # Control period in time units (minutes).
     horizon = 6  # How many periods to compute strategy for.
     uncertainty = 0.1  # The uncertainty in the weather forecast generation.
+    synthesis_deadline = None  # Wall-clock budget of each synthesis in seconds, None for no budget.
+    # Whether to write the results during the simulation, such that they survive a crash, instead
+    # of only at the end.
+    stream_results = True
+    max_result_bytes = 64 * 2 ** 20  # Size after which streamed results continue in a new file.
+    # Whether to reuse the decisions of situations with the same forecast and a pond level within
+    # 1 cm, instead of synthesizing a strategy at every control instant.
+    cache_decisions = False
+    decision_cache = DecisionCache(resolutions={"w": 1.0}) if cache_decisions else None
+    # Whether to only synthesize a new strategy when the situation changes, and to evaluate the
+    # saved strategy in the observed state in between.
+    event_triggered = False
 
     # Get model and learning config dictionaries from files.
     with open(model_config_path, "r") as yamlfile:
@@ -293,16 +879,50 @@ def main():
     with open(learning_config_path, "r") as yamlfile:
         learning_cfg_dict = yaml.safe_load(yamlfile)
 
-    # Construct the MPC object.
-    controller = MPCSetupPond(model_template_path, output_file_path, query_file=query_file_path,
-                              model_cfg_dict=model_cfg_dict,
-                              learning_args=learning_cfg_dict,
-                              verifyta_command=verifyta_command,
-                              external_simulator=False,
-                              action_variable=action_variable, debug=debug)
-
-    swmm_control(swmm_inputfile, orifice_id, basin_id, time_step, swmm_results, controller,
-                 period, horizon, rain_data_file, weather_forecast_path, uncertainty)
+    # Run on copies of the templates, such that other runs can use the same templates concurrently.
+    with RunWorkspace(keep=debug) as workspace:
+        # Include the correct path to the rain data into the swmm model.
+        swmm_model = SwmmInputFile.read(swmm_template_path)
+        swmm_model.set_rain_data_file(RAIN_TIMESERIES, rain_data_file)
+        swmm_inputfile = workspace.path(os.path.basename(swmm_template_path))
+        swmm_model.write(swmm_inputfile)
+
+        query_file_path = workspace.path("pond_demo3_query.q")
+        weather_forecast_path = workspace.path("demo3_weather_forecast.csv")
+        output_file_path = workspace.path("demo3_result.txt")
+        strategy_file_path = workspace.path("demo3_strategy.json") if event_triggered else None
+        event_trigger = EventTrigger() if event_triggered else None
+        if embed_weather_forecast:
+            model_template_path = workspace.path("pond_demo3_embedded.xml")
+            create_embedded_forecast_model(uppaal_template_path, model_template_path)
+            weather_forecast_path = None
+        else:
+            model_template_path = workspace.copy(uppaal_template_path)
+            insert_paths_in_uppaal_model(model_template_path, weather_forecast_path,
+                                         os.path.join(uppaal_folder, "libtable.dylib"))
+
+        # Construct the MPC object.
+        controller = MPCSetupPond(model_template_path, output_file_path,
+                                  query_file=query_file_path,
+                                  model_cfg_dict=model_cfg_dict,
+                                  learning_args=learning_cfg_dict,
+                                  verifyta_command=verifyta_command,
+                                  external_simulator=False,
+                                  action_variable=action_variable, debug=debug,
+                                  deadline=synthesis_deadline, strategy_file=strategy_file_path)
+
+        swmm_control(swmm_inputfile, orifice_id, basin_id, time_step, swmm_results, controller,
+                     period, horizon, rain_data_file, weather_forecast_path, uncertainty,
+                     stream_results=stream_results, max_result_bytes=max_result_bytes,
+                     observables_file=swmm_observables, decision_cache=decision_cache,
+                     event_trigger=event_trigger)
+    if synthesis_deadline is not None:
+        print(f"\nsyntheses that missed the deadline: {controller.deadline_misses}")
+    if event_trigger is not None:
+        print(f"\nstrategies synthesized: {event_trigger.replans}, reused: {event_trigger.skips}")
+    if debug:
+        print(f"\nworkspace kept at {workspace.folder}")
+    print(f"results written to {results_folder}")
     print("procedure completed!")
 
 
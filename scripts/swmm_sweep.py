@@ -0,0 +1,149 @@
+from pyswmm import Simulation, Nodes, Links
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os.path
+import csv
+from run_workspace import RunWorkspace, create_results_folder
+from swmm_inp import SwmmInputFile, RAIN_TIMESERIES
+
+KPI_NAMES = ["max_depth", "mean_depth", "final_depth", "flooding_volume", "max_orifice_flow"]
+
+
+def create_scenarios(swmm_inputfiles, rain_data_files, orifice_settings, initial_depths):
+    """
+    Create the scenarios of all combinations of the provided models, rain data and settings.
+
+    :param list swmm_inputfiles: swmm model paths
+    :param list rain_data_files: rain data file paths
+    :param list orifice_settings: static orifice settings, from 0 to 1
+    :param list initial_depths: initial water depths of the basin [m]
+    :return: the scenarios, as dictionaries
+    :rtype: list
+    """
+    return [{"swmm_inputfile": swmm_inputfile, "rain_data_file": rain_data_file,
+             "orifice_setting": orifice_setting, "initial_depth": initial_depth}
+            for swmm_inputfile, rain_data_file, orifice_setting, initial_depth
+            in itertools.product(swmm_inputfiles, rain_data_files, orifice_settings,
+                                 initial_depths)]
+
+
+def run_scenario(scenario, basin_id, orifice_id, time_step):
+    """
+    Simulate a scenario on its own copy of the swmm model, and compute its KPIs.
+
+    The copy is made in a RunWorkspace, such that scenarios running in parallel do not share the
+    model, report or output files.
+
+    :param dict scenario: scenario, as created by create_scenarios()
+    :param str basin_id: basin id from swmm
+    :param str orifice_id: orifice id from swmm
+    :param int time_step: time interval in seconds
+    :return: the KPIs of the scenario, see KPI_NAMES
+    :rtype: dict
+    """
+    with RunWorkspace(prefix="swmm_sweep_") as workspace:
+        # Each worker process parses a model only once, and edits a copy per scenario.
+        model = SwmmInputFile.read(scenario["swmm_inputfile"])
+        model.set_rain_data_file(RAIN_TIMESERIES, os.path.abspath(scenario["rain_data_file"]))
+        model.set_initial_depth(basin_id, scenario["initial_depth"])
+        swmm_inputfile = workspace.path(os.path.basename(scenario["swmm_inputfile"]))
+        model.write(swmm_inputfile)
+
+        with Simulation(swmm_inputfile) as sim:
+            su = Nodes(sim)[basin_id]
+            orifice = Links(sim)[orifice_id]
+            orifice.target_setting = scenario["orifice_setting"]
+            sim.step_advance(time_step)
+
+            steps = 0
+            total_depth = 0.0
+            max_depth = 0.0
+            max_orifice_flow = 0.0
+            sampled_time = None
+
+            def sample():
+                nonlocal steps, total_depth, max_depth, max_orifice_flow, sampled_time
+                steps += 1
+                total_depth += su.depth
+                max_depth = max(max_depth, su.depth)
+                max_orifice_flow = max(max_orifice_flow, orifice.flow)
+                sampled_time = sim.current_time
+
+            for step in sim:
+                sample()
+            # The step that reaches the end time ends the iteration instead of being returned, so
+            # its state is only sampled afterwards.
+            if sim.current_time != sampled_time:
+                sample()
+            return {
+                "max_depth": max_depth,
+                "mean_depth": total_depth / steps if steps > 0 else 0.0,
+                "final_depth": su.depth,
+                "flooding_volume": su.statistics["flooding_volume"],
+                "max_orifice_flow": max_orifice_flow,
+            }
+
+
+def run_sweep(scenarios, basin_id, orifice_id, time_step, max_workers=None):
+    """
+    Simulate all scenarios in a pool of processes.
+
+    :param list scenarios: scenarios, as created by create_scenarios()
+    :param str basin_id: basin id from swmm
+    :param str orifice_id: orifice id from swmm
+    :param int time_step: time interval in seconds
+    :param int max_workers: number of processes, None for the number of processors
+    :return: the KPIs of each scenario, in the order of the scenarios
+    :rtype: list
+    """
+    # A pyswmm simulation can only run once per process at a time, hence processes.
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run_scenario, scenarios, itertools.repeat(basin_id),
+                                 itertools.repeat(orifice_id), itertools.repeat(time_step)))
+
+
+def write_sweep_results(file, scenarios, results):
+    """
+    Write the scenarios and their KPIs to a csv file, one row per scenario indexed by its number.
+
+    :param str file: csv file path
+    :param list scenarios: scenarios, as created by create_scenarios()
+    :param list results: KPIs of each scenario, as returned by run_sweep()
+    """
+    with open(file, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(["scenario", "swmm_inputfile", "rain_data_file", "orifice_setting",
+                         "initial_depth"] + KPI_NAMES)
+        for i, (scenario, kpis) in enumerate(zip(scenarios, results)):
+            writer.writerow([i, os.path.basename(scenario["swmm_inputfile"]),
+                             os.path.basename(scenario["rain_data_file"]),
+                             scenario["orifice_setting"], scenario["initial_depth"]] +
+                            [kpis[name] for name in KPI_NAMES])
+
+
+if __name__ == "__main__":
+    # First figure out where the swmm model files are located. This is also OS dependent.
+    this_file = os.path.realpath(__file__)
+    base_folder = os.path.dirname(os.path.dirname(this_file))
+    swmm_folder = os.path.join(base_folder, "swmm_models")
+    swmm_inputfiles = [os.path.join(swmm_folder, "swmm_demo3.inp")]
+    rain_data_files = [os.path.join(swmm_folder, "swmm_5061.dat")]
+
+    # The grid of settings to sweep.
+    orifice_settings = [0.0, 1 / 7, 4 / 7, 1.0]
+    initial_depths = [0.0, 0.5, 1.0]
+
+    orifice_id = "OR1"
+    basin_id = "SU1"
+    time_step = 60
+    # A results folder per sweep, such that concurrent sweeps do not overwrite each other.
+    results_folder = create_results_folder(os.path.join(swmm_folder, "results"),
+                                           prefix="swmm_sweep_")
+    sweep_results = os.path.join(results_folder, "swmm_sweep_results.csv")
+
+    scenarios = create_scenarios(swmm_inputfiles, rain_data_files, orifice_settings,
+                                 initial_depths)
+    results = run_sweep(scenarios, basin_id, orifice_id, time_step)
+    write_sweep_results(sweep_results, scenarios, results)
+    print(f"results written to {sweep_results}")
+    print("procedure completed!")
@@ -1,23 +1,67 @@
 import csv
 import datetime
+import hashlib
+import os
+import re
+from collections import deque
 from functools import cache
 
+import numpy as np
+
+from rain_index import row_index
+from run_workspace import atomic_write
+
+EPOCH = datetime.datetime(1970, 1, 1)
+RAIN_CACHE_FOLDER = ".rain_cache"  # Folder next to the rain data file holding its binary cache.
+
+# Default perturbations of ensemble forecasts, as (numpy.random.Generator method, *parameters).
+# The onset shift moves the whole forecast of a member in time by the sampled minutes, the duration
+# and intensity of the rain intervals are multiplied by the sampled factors.
+DEFAULT_ENSEMBLE_PERTURBATIONS = {
+    "onset": ("normal", 0.0, 15.0),
+    "duration": ("normal", 1.0, 0.1),
+    "intensity": ("normal", 1.0, 0.1),
+}
+
+NOWCAST_DATE_FORMAT = "%d-%b-%Y %H:%M:%S"  # Timestamp format of the rainfall nowcast files.
+NOWCAST_DATE_LENGTH = 20  # Length of the timestamps, e.g. 29-Aug-2023 17:07:00.
+# Number of bytes read last that are checked again, to recognize a nowcast file rewritten in place.
+NOWCAST_TAIL_BYTES = 64
+MONTH_ABBREVIATIONS = [b"Jan", b"Feb", b"Mar", b"Apr", b"May", b"Jun", b"Jul", b"Aug", b"Sep",
+                       b"Oct", b"Nov", b"Dec"]
+MICROMETER_PER_SECOND_TO_MM_PER_MINUTE = 0.06
+
 
 def create_weather_forecast(rain_data_file, weather_forecast_file, start_date, horizon,
                             uncertainty):
     """
     Create a weather forecast from historical rain data.
+
+    The forecast is only written to file if a weather forecast file is provided.
+
+    :return: weather intervals
+    :rtype: list
     """
-    rain_data = read_rain_data(rain_data_file)
-    weather_forecast = calculate_weather_intervals(rain_data, start_date, horizon, uncertainty)
-    write_weather_forecast(weather_forecast_file, weather_forecast)
+    rain_events = read_rain_events(rain_data_file)
+    weather_forecast = rain_events.weather_intervals(start_date, horizon, uncertainty)
+    if weather_forecast_file is not None:
+        write_weather_forecast(weather_forecast_file, weather_forecast)
+    return weather_forecast
 
 
-@cache
 def read_rain_data(data_file):
     """
     Read the historical rain data from file.
+
+    The parsed data is cached on disk next to the data file, such that other processes reading
+    the same (unchanged) file can memory-map the cache instead of parsing the file again. It is not
+    kept in memory between calls: the forecasts only need the rain events, see read_rain_events().
     """
+    cache_files = rain_cache_files(data_file)
+    if all(os.path.isfile(f) for f in cache_files):
+        minutes, intensities = (np.load(f, mmap_mode="r") for f in cache_files)
+        return RainSeries(minutes, intensities)
+
     with open(data_file, "r") as f:
         lines = f.readlines()
         rain_data = []
@@ -26,7 +70,273 @@ def read_rain_data(data_file):
             # In <name>.dat rain file, we have mm/dd/yyyy hh:mm:ss x.y per line.
             dt = datetime.datetime.strptime(words[0] + " " + words[1], "%m/%d/%Y %H:%M:%S")
             rain_data.append([dt, float(words[2]) / 60])  # Divided by 60 to get mm/h -> mm/min.
-    return rain_data
+    rain_series = RainSeries.from_rows(rain_data)
+    write_rain_cache(data_file, rain_series)
+    return rain_series
+
+
+@cache
+def read_rain_events(data_file):
+    """
+    Read the rain events of the historical rain data from file. Only the events are kept in
+    memory, not the rain data they are indexed from.
+
+    :rtype: RainEvents
+    """
+    return RainEvents.from_series(read_rain_data(data_file))
+
+
+def rain_cache_files(data_file):
+    """
+    Get the paths of the binary cache files of a rain data file.
+
+    The cache files are keyed on the absolute path, modification time and size of the data file,
+    so a changed data file never matches an old cache.
+
+    :param str data_file: rain data file path
+    :return: paths of the minutes and intensities cache files
+    :rtype: tuple(str, str)
+    """
+    data_file = os.path.abspath(data_file)
+    stat = os.stat(data_file)
+    key = hashlib.sha1(f"{data_file}:{stat.st_mtime_ns}:{stat.st_size}".encode()).hexdigest()
+    base = os.path.join(os.path.dirname(data_file), RAIN_CACHE_FOLDER,
+                        os.path.basename(data_file) + "." + key[:16])
+    return base + ".minutes.npy", base + ".rain.npy"
+
+
+def write_rain_cache(data_file, rain_series):
+    """
+    Write the binary cache files of a rain data file. Cache files of older versions of the data
+    file are removed. Failing to write the cache is not an error, as it only affects speed.
+
+    :param str data_file: rain data file path
+    :param RainSeries rain_series: the rain data read from the data file
+    """
+    cache_files = rain_cache_files(data_file)
+    cache_folder = os.path.dirname(cache_files[0])
+    try:
+        os.makedirs(cache_folder, exist_ok=True)
+        # Only match the cache files of this data file, not those of e.g. <name>.dat.bak.
+        pattern = re.compile(re.escape(os.path.basename(data_file)) +
+                             r"\.[0-9a-f]{16}\.(minutes|rain)\.npy")
+        for name in os.listdir(cache_folder):
+            if pattern.fullmatch(name) and os.path.join(cache_folder, name) not in cache_files:
+                os.remove(os.path.join(cache_folder, name))
+        for cache_file, array in zip(cache_files, (rain_series.minutes, rain_series.intensities)):
+            # Other processes never load a partial cache.
+            with atomic_write(cache_file, "wb") as f:
+                np.save(f, array)
+    except OSError:
+        pass
+
+
+class RainSeries:
+    """
+    Historical rain data indexed on its time axis.
+
+    The data is stored columnar: the time of each row as whole minutes since the Unix epoch, and the
+    rain in mm/min, one row per minute. The row of a date is found by minute arithmetic relative to
+    the first row. Only when the time axis contains gaps before that date, we fall back to a binary
+    search. Indexing a row gives the ``[datetime, rain]`` pair as read from the rain data file.
+
+    :param numpy.ndarray minutes: time of each row in minutes since the epoch, sorted
+    :param numpy.ndarray intensities: rain of each row [mm/min]
+    """
+    def __init__(self, minutes, intensities):
+        self.minutes = minutes
+        self.intensities = intensities
+        self.start_date = minutes_to_datetime(minutes[0])
+
+    @classmethod
+    def from_rows(cls, rain_data):
+        """
+        Create a rain series from a list of ``[datetime, rain]`` rows.
+
+        :param list rain_data: rain data rows, sorted on time
+        :rtype: RainSeries
+        """
+        minutes = np.array([datetime_to_minutes(row[0]) for row in rain_data], dtype=np.int64)
+        intensities = np.array([row[1] for row in rain_data], dtype=float)
+        return cls(minutes, intensities)
+
+    def __len__(self):
+        return len(self.minutes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # Slices give the rows, like slicing the rain data list did.
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return [minutes_to_datetime(self.minutes[index]), float(self.intensities[index])]
+
+    def index_of(self, date):
+        """
+        Return the row index of the provided date.
+
+        :param datetime.datetime date: date to look up
+        :return: index of the row with the provided date
+        :rtype: int
+        """
+        minute = whole_minutes(date)
+        index = minute - int(self.minutes[0])
+        if 0 <= index < len(self.minutes) and self.minutes[index] == minute:
+            return index
+
+        # The time axis has gaps, so search for the date instead.
+        index = int(np.searchsorted(self.minutes, minute, side="left"))
+        if index < len(self.minutes) and self.minutes[index] == minute:
+            return index
+        raise ValueError(f"Date {date} is not present in the rain data.")
+
+    def index_after(self, date):
+        """
+        Return the index of the first row that is later than the provided date.
+
+        :param datetime.datetime date: date to look up
+        :return: index of the first row after the date, or the number of rows if there is none
+        :rtype: int
+        """
+        minute = datetime_to_minutes(date)
+        index = minute - int(self.minutes[0])
+        if 0 <= index < len(self.minutes) and self.minutes[index] == minute:
+            return index + 1
+        return int(np.searchsorted(self.minutes, minute, side="right"))
+
+    def check_contiguous(self, first, last):
+        """
+        Check that the rows from first up to last are consecutive minutes, as the forecasts that
+        count one row per minute require. Use RainEvents for rain data with missing minutes.
+
+        :param int first: first row
+        :param int last: row after the last row
+        """
+        if last - first > 1 and self.minutes[last - 1] - self.minutes[first] != last - first - 1:
+            raise ValueError(f"The rain data has missing minutes after "
+                             f"{minutes_to_datetime(self.minutes[first])}.")
+
+
+def datetime_to_minutes(date):
+    """
+    Convert a datetime into the number of whole minutes since the Unix epoch.
+    """
+    return (date - EPOCH) // datetime.timedelta(minutes=1)
+
+
+def whole_minutes(date):
+    """
+    Convert a datetime into the number of minutes since the Unix epoch, like
+    datetime_to_minutes(), but only for a whole minute. The rows of the rain data are whole
+    minutes, so a forecast cannot start in between.
+    """
+    minutes, remainder = divmod(date - EPOCH, datetime.timedelta(minutes=1))
+    if remainder:
+        raise ValueError(f"Date {date} is not present in the rain data, as it is not a whole "
+                         f"minute.")
+    return minutes
+
+
+def minutes_to_datetime(minutes):
+    """
+    Convert a number of minutes since the Unix epoch into a datetime.
+    """
+    return EPOCH + datetime.timedelta(minutes=int(minutes))
+
+
+class RainEvents:
+    """
+    Index of the rain events of historical rain data.
+
+    Only the rain events are stored: the first minute, the minute after the last minute and the
+    total rain of each event, and the rain of all raining minutes in one compact array. Minutes
+    missing from the rain data count as dry, so a gap in the time axis also ends a rain event.
+    Forecast queries look up the events within the horizon by binary search, and then only loop
+    over those events.
+
+    :param int first_minute: first minute covered by the rain data, since the epoch
+    :param int last_minute: last minute covered by the rain data, since the epoch
+    :param numpy.ndarray starts: first minute of each event, since the epoch
+    :param numpy.ndarray ends: minute after the last minute of each event, since the epoch
+    :param numpy.ndarray wet_rain: rain of the raining minutes of all events [mm/min]
+    """
+    def __init__(self, first_minute, last_minute, starts, ends, wet_rain):
+        self.first_minute = first_minute
+        self.last_minute = last_minute
+        self.starts = starts
+        self.ends = ends
+        self.wet_rain = wet_rain
+        # Position of the first raining minute of each event in wet_rain.
+        self.offsets = np.concatenate(([0], np.cumsum(ends - starts)))
+
+    @classmethod
+    def from_series(cls, rain_data):
+        """
+        Create the rain event index of a rain series.
+
+        :param RainSeries rain_data: historical rain data
+        :rtype: RainEvents
+        """
+        if not isinstance(rain_data, RainSeries):
+            rain_data = RainSeries.from_rows(rain_data)
+        minutes = np.asarray(rain_data.minutes)
+        rain = np.asarray(rain_data.intensities)
+        if not np.all(rain >= 0):
+            raise RuntimeError("Rain data has unexpected values.")
+
+        wet = np.flatnonzero(rain > 0)
+        wet_minutes = minutes[wet]
+        # A new event starts at a raining minute that does not directly follow the previous one.
+        new_event = np.ones(len(wet), dtype=bool)
+        new_event[1:] = wet_minutes[1:] != wet_minutes[:-1] + 1
+        starts = wet_minutes[new_event]
+        # An event ends after the raining minute before the start of the next event.
+        last_of_event = np.append(np.flatnonzero(new_event[1:]), len(wet) - 1)[:len(starts)]
+        ends = wet_minutes[last_of_event] + 1
+        return cls(int(minutes[0]), int(minutes[-1]), starts, ends, rain[wet].astype(float))
+
+    def __len__(self):
+        return len(self.starts)
+
+    def weather_intervals(self, start_date, horizon, uncertainty):
+        """
+        Calculate the weather intervals starting from a specified date and time, like
+        calculate_weather_intervals() does for rain data without missing minutes.
+
+        :param datetime.datetime start_date: start date of the forecast
+        :param int horizon: forecast horizon in minutes
+        :param float uncertainty: relative uncertainty of the interval durations
+        :return: weather intervals
+        :rtype: list
+        """
+        assert horizon > 0
+        first = whole_minutes(start_date)
+        last = first + horizon + 1  # The last minute of the horizon is included.
+        assert self.first_minute <= first and last - 1 <= self.last_minute
+
+        # The events overlapping the horizon, clipped to it.
+        i = int(np.searchsorted(self.ends, first, side="right"))
+        j = int(np.searchsorted(self.starts, last, side="left"))
+        starts = np.maximum(self.starts[i:j], first)
+        ends = np.minimum(self.ends[i:j], last)
+
+        # Alternate the dry runs before each event and after the last one with the events.
+        dry_durations = np.diff(np.concatenate(([first], np.column_stack((starts, ends)).ravel(),
+                                                [last])))[0::2]
+        durations = np.empty(2 * len(starts) + 1, dtype=np.int64)
+        durations[0::2] = dry_durations
+        durations[1::2] = ends - starts
+        rain_per_minute = np.zeros(len(durations))
+        for k in range(len(starts)):
+            offset = self.offsets[i + k] + starts[k] - self.starts[i + k]
+            # Accumulate in the same order as calculate_weather_intervals() to get identical sums.
+            rain = self.wet_rain[offset:offset + ends[k] - starts[k]]
+            rain_per_minute[2 * k + 1] = np.add.accumulate(rain)[-1] / durations[2 * k + 1]
+        raining = np.zeros(len(durations), dtype=bool)
+        raining[1::2] = True
+
+        # Remove the empty dry runs at the start and end of the horizon.
+        keep = durations > 0
+        return weather_intervals_from_runs(durations[keep], raining[keep], rain_per_minute[keep],
+                                           horizon, uncertainty)
 
 
 def calculate_weather_intervals(rain_data, start_date, horizon, uncertainty):
@@ -40,9 +350,10 @@ def calculate_weather_intervals(rain_data, start_date, horizon, uncertainty):
     assert start_date + datetime.timedelta(minutes=horizon) <= rain_data[len(rain_data) - 1][0]
 
     # Go in rain_data to start date and time. Remember that each line represents 1 minute.
-    index = 0
-    while rain_data[index][0] != start_date:
-        index += 1
+    if isinstance(rain_data, RainSeries):
+        index = rain_data.index_of(start_date)
+    else:
+        index = row_index(rain_data, start_date)
 
     # Initialize variables.
     raining = rain_data[index][1] > 0
@@ -115,13 +426,637 @@ def calculate_weather_intervals(rain_data, start_date, horizon, uncertainty):
     return weather_intervals
 
 
+def calculate_weather_intervals_vectorized(rain_data, start_date, horizon, uncertainty):
+    """
+    Calculate the same weather intervals as calculate_weather_intervals(), but with NumPy.
+
+    The dry and rain intervals are found as runs of zero and nonzero rain in a single pass over the
+    horizon, so Python only loops over the rain intervals to sum their rain. Each row is one minute,
+    so the rain data should not miss any minute within the horizon.
+    """
+    # Check start_date.
+    assert horizon > 0
+    assert start_date >= rain_data[0][0]
+    assert start_date + datetime.timedelta(minutes=horizon) <= rain_data[len(rain_data) - 1][0]
+
+    if not isinstance(rain_data, RainSeries):
+        rain_data = RainSeries.from_rows(rain_data)
+    first = rain_data.index_of(start_date)
+    last = rain_data.index_after(start_date + datetime.timedelta(minutes=horizon))
+    rain_data.check_contiguous(first, last)
+    rain = rain_data.intensities[first:last]
+    if not np.all(rain >= 0):
+        raise RuntimeError("Rain data has unexpected values.")
+
+    starts, durations, raining = rain_runs(rain)
+    rain_per_minute = np.zeros(len(starts))
+    for k in np.flatnonzero(raining):
+        # Accumulate in the same order as calculate_weather_intervals() to get identical sums.
+        run = rain[starts[k]:starts[k] + durations[k]]
+        rain_per_minute[k] = np.add.accumulate(run)[-1] / durations[k]
+    return weather_intervals_from_runs(durations, raining, rain_per_minute, horizon, uncertainty)
+
+
+def rain_runs(rain):
+    """
+    Split a rain array into runs of dry (zero) and raining (nonzero) minutes.
+
+    :param numpy.ndarray rain: rain per minute
+    :return: start index, duration and whether it is raining of each run
+    :rtype: tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray)
+    """
+    raining = rain > 0
+    starts = np.concatenate(([0], np.flatnonzero(raining[1:] != raining[:-1]) + 1))
+    durations = np.diff(np.append(starts, len(rain)))
+    return starts, durations, raining[starts]
+
+
+def weather_intervals_from_runs(durations, raining, rain_per_minute, horizon, uncertainty):
+    """
+    Turn alternating dry and rain runs into the [dryL, dryU, rainL, rainU, rain] weather intervals.
+
+    A leading rain run gets a dummy dry interval, a trailing dry run gets an empty rain interval,
+    and two days of dry weather are appended for safety in Uppaal Stratego.
+
+    :param numpy.ndarray durations: duration of each run in minutes
+    :param numpy.ndarray raining: whether it is raining during each run
+    :param numpy.ndarray rain_per_minute: average rain per minute of each run, 0 for dry runs
+    :param int horizon: forecast horizon in minutes
+    :param float uncertainty: relative uncertainty of the interval durations
+    :return: weather intervals
+    :rtype: list
+    """
+    lower = np.rint(durations * (1 - uncertainty)).astype(int)
+    upper = np.rint(durations * (1 + uncertainty)).astype(int)
+    if durations[-1] == horizon + 1:  # Nothing will change.
+        lower[-1] = upper[-1] = durations[-1]
+
+    # Pad the runs such that they start dry and end raining, so they can be paired.
+    rain = rain_per_minute.tolist()
+    if raining[0]:
+        lower, upper = np.append(0, lower), np.append(0, upper)
+        rain.insert(0, 0)
+    trailing_dry = len(rain) % 2 == 1
+    if trailing_dry:
+        lower, upper = np.append(lower, 0), np.append(upper, 0)
+        rain.append(0)
+
+    bounds = np.column_stack((lower[0::2], upper[0::2], lower[1::2], upper[1::2])).tolist()
+    weather_intervals = [row + [r] for row, r in zip(bounds, rain[1::2])]
+    if trailing_dry:
+        weather_intervals[-1][4] = 0
+
+    # Add two days of dry weather for safety in Uppaal Stratego.
+    weather_intervals.append([24 * 60, 24 * 60, 24 * 60, 24 * 60, 0])
+    return weather_intervals
+
+
+class ForecastTable:
+    """
+    Weather forecasts for all control instants of a simulation run.
+
+    The forecasts are computed in one pass over the rain data with :meth:`build` and stored in a
+    compact table: the interval bounds of all forecasts in one integer array and their rain in one
+    float array. The rows of the forecast at control instant ``k`` are
+    ``offsets[k]:offsets[k + 1]``. Each forecast equals the output of
+    calculate_weather_intervals_vectorized() for that instant, so the rain data should not miss any
+    minute between the first control instant and the end of the last horizon.
+
+    :param datetime.datetime start_date: date of the first control instant
+    :param int period: minutes between two control instants
+    :param numpy.ndarray bounds: the dryL, dryU, rainL and rainU columns of all forecasts
+    :param numpy.ndarray rain: the rain column of all forecasts
+    :param numpy.ndarray offsets: first row of each forecast, followed by the total number of rows
+    """
+    def __init__(self, start_date, period, bounds, rain, offsets):
+        self.start_date = start_date
+        self.period = period
+        self.bounds = bounds
+        self.rain = rain
+        self.offsets = offsets
+
+    @classmethod
+    def build(cls, rain_data, start_date, end_date, period, horizon, uncertainty):
+        """
+        Calculate the weather forecasts of all control instants between the start and end date.
+
+        :param RainSeries rain_data: historical rain data
+        :param datetime.datetime start_date: date of the first control instant
+        :param datetime.datetime end_date: no control instants after this date
+        :param int period: minutes between two control instants
+        :param int horizon: forecast horizon in minutes
+        :param float uncertainty: relative uncertainty of the interval durations
+        :rtype: ForecastTable
+        """
+        assert period > 0
+        assert start_date <= end_date
+        n_instants = (end_date - start_date) // datetime.timedelta(minutes=period) + 1
+        last_date = start_date + datetime.timedelta(minutes=(n_instants - 1) * period + horizon)
+        assert horizon > 0
+        assert start_date >= rain_data[0][0]
+        assert last_date <= rain_data[len(rain_data) - 1][0]
+
+        if not isinstance(rain_data, RainSeries):
+            rain_data = RainSeries.from_rows(rain_data)
+        first = rain_data.index_of(start_date)
+        rain_data.check_contiguous(first, rain_data.index_after(last_date))
+        minutes = rain_data.minutes[first:rain_data.index_after(last_date)]
+        rain = rain_data.intensities[first:first + len(minutes)]
+        if not np.all(rain >= 0):
+            raise RuntimeError("Rain data has unexpected values.")
+
+        # Split the whole covered period into runs once, and accumulate the rain within each run in
+        # the same order as calculate_weather_intervals(), such that the sums are identical.
+        starts, durations, raining = rain_runs(rain)
+        ends = starts + durations
+        run_cumulative = np.zeros(len(rain))
+        for k in np.flatnonzero(raining):
+            run_cumulative[starts[k]:ends[k]] = np.add.accumulate(rain[starts[k]:ends[k]])
+
+        instants = datetime_to_minutes(start_date) + period * np.arange(n_instants)
+        firsts = np.searchsorted(minutes, instants, side="left")
+        lasts = np.searchsorted(minutes, instants + horizon, side="right")
+        if np.any(minutes[np.minimum(firsts, len(minutes) - 1)] != instants):
+            raise ValueError("Not all control instants are present in the rain data.")
+
+        all_bounds = []
+        all_rain = []
+        offsets = [0]
+        for a, b in zip(firsts.tolist(), lasts.tolist()):
+            # Clip the runs overlapping with this horizon to the horizon.
+            r0 = np.searchsorted(starts, a, side="right") - 1
+            r1 = np.searchsorted(starts, b, side="left")
+            run_starts = np.maximum(starts[r0:r1], a)
+            run_ends = np.minimum(ends[r0:r1], b)
+            run_durations = run_ends - run_starts
+            run_raining = raining[r0:r1]
+            rain_per_minute = np.zeros(r1 - r0)
+            for k in np.flatnonzero(run_raining):
+                if run_starts[k] == starts[r0 + k]:
+                    total = run_cumulative[run_ends[k] - 1]
+                else:
+                    # Horizon starts during the rain run, so accumulate from the horizon start.
+                    total = np.add.accumulate(rain[run_starts[k]:run_ends[k]])[-1]
+                rain_per_minute[k] = total / run_durations[k]
+            forecast = weather_intervals_from_runs(run_durations, run_raining, rain_per_minute,
+                                                   horizon, uncertainty)
+            all_bounds.extend(row[:4] for row in forecast)
+            all_rain.extend(row[4] for row in forecast)
+            offsets.append(offsets[-1] + len(forecast))
+
+        return cls(start_date, period, np.array(all_bounds, dtype=np.int32),
+                   np.array(all_rain, dtype=float), np.array(offsets, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, date):
+        try:
+            self.instant_index(date)
+        except ValueError:
+            return False
+        return True
+
+    def instant_index(self, date):
+        """
+        Return the index of the control instant at the provided date.
+
+        :param datetime.datetime date: date of the control instant
+        :rtype: int
+        """
+        index, remainder = divmod(date - self.start_date, datetime.timedelta(minutes=self.period))
+        if remainder or not 0 <= index < len(self):
+            raise ValueError(f"Date {date} is not a control instant of the forecast table.")
+        return index
+
+    def forecast_at(self, date):
+        """
+        Get the weather forecast of the control instant at the provided date.
+
+        :param datetime.datetime date: date of the control instant
+        :return: weather intervals, as calculate_weather_intervals_vectorized() returns them
+        :rtype: list
+        """
+        index = self.instant_index(date)
+        rows = slice(self.offsets[index], self.offsets[index + 1])
+        # The rain column only holds an integer 0 for intervals without rain.
+        return [bounds + [rain if rain > 0 else 0]
+                for bounds, rain in zip(self.bounds[rows].tolist(), self.rain[rows].tolist())]
+
+    def save(self, file):
+        """
+        Save the forecast table to a NumPy .npz file, so it can be inspected after the run.
+
+        :param str file: file path
+        """
+        np.savez(file, start_date=datetime_to_minutes(self.start_date), period=self.period,
+                 bounds=self.bounds, rain=self.rain, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, file):
+        """
+        Load a forecast table saved with :meth:`save`.
+
+        :param str file: file path
+        :rtype: ForecastTable
+        """
+        with np.load(file) as data:
+            return cls(minutes_to_datetime(data["start_date"]), int(data["period"]),
+                       data["bounds"], data["rain"], data["offsets"])
+
+
+class IncrementalForecaster:
+    """
+    Weather forecasts for consecutive control instants, updated incrementally.
+
+    The dry and rain runs of the previous horizon are kept. When the next forecast starts within
+    that horizon, the runs that have passed are dropped and only the newly visible rain data is
+    added, instead of rebuilding all intervals. Each forecast equals the output of
+    calculate_weather_intervals_vectorized() for the same date, so the rain data should not miss
+    any minute within the horizons.
+
+    :param RainSeries rain_data: historical rain data
+    :param int horizon: forecast horizon in minutes
+    :param float uncertainty: relative uncertainty of the interval durations
+    """
+    def __init__(self, rain_data, horizon, uncertainty):
+        assert horizon > 0
+        if not isinstance(rain_data, RainSeries):
+            rain_data = RainSeries.from_rows(rain_data)
+        self.rain_data = rain_data
+        self.horizon = horizon
+        self.uncertainty = uncertainty
+        self._first = None  # First row of the current horizon.
+        self._last = None  # First row after the current horizon.
+        self._runs = deque()  # Runs as [start row, end row, raining, accumulated rain].
+
+    def __contains__(self, date):
+        end_date = date + datetime.timedelta(minutes=self.horizon)
+        return self.rain_data.start_date <= date and end_date <= self.rain_data[-1][0]
+
+    def forecast_at(self, date):
+        """
+        Get the weather forecast starting at the provided date.
+
+        :param datetime.datetime date: start date of the forecast
+        :return: weather intervals, as calculate_weather_intervals_vectorized() returns them
+        :rtype: list
+        """
+        assert date in self
+        first = self.rain_data.index_of(date)
+        last = self.rain_data.index_after(date + datetime.timedelta(minutes=self.horizon))
+        self.rain_data.check_contiguous(first, last)
+        if self._first is None or not self._first <= first < self._last or last < self._last:
+            # No overlap with the previous horizon, so start from scratch.
+            self._runs.clear()
+            self._last = first
+        self._drop_until(first)
+        self._extend_until(last)
+        self._first = first
+
+        durations = np.array([end - start for start, end, _, _ in self._runs])
+        raining = np.array([run[2] for run in self._runs])
+        rain_per_minute = np.array([run[3] for run in self._runs]) / durations
+        return weather_intervals_from_runs(durations, raining, rain_per_minute, self.horizon,
+                                           self.uncertainty)
+
+    def _drop_until(self, first):
+        while self._runs and self._runs[0][1] <= first:
+            self._runs.popleft()
+        if self._runs and self._runs[0][0] < first:
+            run = self._runs[0]
+            run[0] = first
+            if run[2]:
+                # Accumulate again from the new start, as calculate_weather_intervals() would.
+                run[3] = np.add.accumulate(self.rain_data.intensities[first:run[1]])[-1]
+
+    def _extend_until(self, last):
+        rain = self.rain_data.intensities[self._last:last]
+        if not np.all(rain >= 0):
+            raise RuntimeError("Rain data has unexpected values.")
+        if len(rain) == 0:
+            return
+
+        starts, durations, raining = rain_runs(rain)
+        for start, duration, run_raining in zip((starts + self._last).tolist(), durations.tolist(),
+                                                raining.tolist()):
+            values = self.rain_data.intensities[start:start + duration]
+            if self._runs and self._runs[-1][2] == run_raining:
+                # The last run continues, so continue accumulating its rain.
+                run = self._runs[-1]
+                run[1] = start + duration
+                if run_raining:
+                    run[3] = np.add.accumulate(np.append(run[3], values))[-1]
+            else:
+                total = np.add.accumulate(values)[-1] if run_raining else 0.0
+                self._runs.append([start, start + duration, run_raining, total])
+        self._last = last
+
+
+class NowcastSource:
+    """
+    Weather forecasts from a live rainfall nowcast file, as written by the CLAIRE simulator.
+
+    The nowcast file is a csv file with a header row and rows of ``timestamp,rain``, with the rain
+    in micrometer per second. The file is tailed: each update only reads the bytes appended since
+    the previous update, keeping an incomplete last line for the next update. When the file is
+    truncated or replaced, also by copying over it in place, it is read again from the start. The
+    rain is kept in mm/min, so the
+    forecasts are calculated with calculate_weather_intervals_vectorized(), which requires the
+    nowcast to have a row for every minute of the horizon.
+
+    :param str nowcast_file: path of the rainfall nowcast file
+    :param int horizon: forecast horizon in minutes
+    :param float uncertainty: relative uncertainty of the interval durations
+    """
+    def __init__(self, nowcast_file, horizon, uncertainty):
+        assert horizon > 0
+        self.nowcast_file = nowcast_file
+        self.horizon = horizon
+        self.uncertainty = uncertainty
+        self._reset(None)
+
+    def _reset(self, file_id):
+        self._file_id = file_id  # Device and inode of the file read so far.
+        self._offset = 0  # Number of bytes read so far.
+        self._tail = b""  # Last bytes read so far, to recognize a file rewritten in place.
+        self._partial_line = b""
+        self._size = 0  # Number of rows read so far.
+        self._minutes = np.empty(0, dtype=np.int64)
+        self._intensities = np.empty(0, dtype=float)
+
+    def update(self):
+        """
+        Read the rows appended to the nowcast file since the previous update.
+
+        :return: the number of new rows
+        :rtype: int
+        """
+        try:
+            with open(self.nowcast_file, "rb") as f:
+                stat = os.fstat(f.fileno())
+                file_id = (stat.st_dev, stat.st_ino)
+                if file_id != self._file_id or stat.st_size < self._offset or \
+                        not self._unchanged(f):
+                    self._reset(file_id)
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        self._offset += len(data)
+        self._tail = (self._tail + data)[-NOWCAST_TAIL_BYTES:]
+
+        lines = (self._partial_line + data).split(b"\n")
+        self._partial_line = lines.pop()
+        minutes, intensities = parse_nowcast_lines(lines)
+        if len(minutes) == 0:
+            return 0
+        if self._size > 0 and minutes[0] <= self._minutes[self._size - 1]:
+            # The nowcast was rewritten in place, so only keep the rows before the new ones.
+            self._size = int(np.searchsorted(self._minutes[:self._size], minutes[0]))
+        self._append(minutes, intensities)
+        return len(minutes)
+
+    def _unchanged(self, f):
+        f.seek(self._offset - len(self._tail))
+        return f.read(len(self._tail)) == self._tail
+
+    def _append(self, minutes, intensities):
+        size = self._size + len(minutes)
+        if size > len(self._minutes):
+            # Grow the buffers geometrically, so appending stays amortized constant time per row.
+            capacity = max(size, 2 * len(self._minutes), 1024)
+            self._minutes = np.resize(self._minutes, capacity)
+            self._intensities = np.resize(self._intensities, capacity)
+        self._minutes[self._size:size] = minutes
+        self._intensities[self._size:size] = intensities
+        self._size = size
+
+    @property
+    def rain_data(self):
+        """
+        The nowcast read so far as a rain series, or None when it is still empty.
+
+        :rtype: RainSeries
+        """
+        if self._size == 0:
+            return None
+        return RainSeries(self._minutes[:self._size], self._intensities[:self._size])
+
+    def __contains__(self, date):
+        self.update()
+        return self._covers(date)
+
+    def _covers(self, date):
+        if self._size == 0:
+            return False
+        end_date = date + datetime.timedelta(minutes=self.horizon)
+        return minutes_to_datetime(self._minutes[0]) <= date and \
+            datetime_to_minutes(end_date) <= self._minutes[self._size - 1]
+
+    def forecast_at(self, date):
+        """
+        Get the weather forecast starting at the provided date from the latest nowcast.
+
+        :param datetime.datetime date: start date of the forecast
+        :return: weather intervals, as calculate_weather_intervals_vectorized() returns them
+        :rtype: list
+        """
+        # The membership test usually just read the nowcast, so only tail the file again when the
+        # nowcast read so far does not cover the forecast.
+        if not self._covers(date):
+            self.update()
+        assert self._covers(date)
+        return calculate_weather_intervals_vectorized(self.rain_data, date, self.horizon,
+                                                      self.uncertainty)
+
+
+def parse_nowcast_lines(lines):
+    """
+    Parse the ``timestamp,rain`` lines of a nowcast file at once, skipping the header and empty
+    lines.
+
+    The timestamps have the fixed width format NOWCAST_DATE_FORMAT, so their fields are read from
+    fixed byte positions for all lines together.
+
+    :param list lines: lines of the nowcast file, as bytes
+    :return: the time of each row in minutes since the epoch, and the rain in mm/min
+    :rtype: tuple(numpy.ndarray, numpy.ndarray)
+    """
+    if not lines:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+    fields = np.char.partition(np.char.strip(np.array(lines, dtype=bytes)), b",")
+    stamps, values = fields[:, 0], fields[:, 2]
+    rows = (np.char.str_len(stamps) == NOWCAST_DATE_LENGTH) & \
+        np.char.isdigit(stamps.astype("S1")) & (np.char.str_len(values) > 0)
+    stamps = stamps[rows].astype(f"S{NOWCAST_DATE_LENGTH}")
+    values = values[rows]
+    if len(stamps) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=float)
+
+    chars = stamps.view(np.uint8).reshape(-1, NOWCAST_DATE_LENGTH).astype(np.int64)
+
+    def number(first, last):
+        digits = chars[:, first:last] - ord("0")
+        return digits @ (10 ** np.arange(last - first - 1, -1, -1))
+
+    months = np.array([int.from_bytes(month, "big") for month in MONTH_ABBREVIATIONS])
+    month_order = np.argsort(months)
+    keys = chars[:, 3] << 16 | chars[:, 4] << 8 | chars[:, 5]
+    month = month_order[np.searchsorted(months[month_order], keys)]
+    days = ((number(7, 11) - 1970).astype("datetime64[Y]").astype("datetime64[M]") +
+            month.astype("timedelta64[M]")).astype("datetime64[D]") + \
+        (number(0, 2) - 1).astype("timedelta64[D]")
+    minutes = days.astype(np.int64) * 24 * 60 + number(12, 14) * 60 + number(15, 17)
+    intensities = values.astype(float) * MICROMETER_PER_SECOND_TO_MM_PER_MINUTE
+    return minutes, intensities
+
+
+def calculate_weather_ensemble(rain_data, start_date, horizon, uncertainty, size,
+                               perturbations=None, seed=None):
+    """
+    Calculate an ensemble of perturbed weather forecasts starting from a specified date and time.
+
+    The dry and rain runs of the horizon are computed once, as in
+    calculate_weather_intervals_vectorized(). The perturbations of all ensemble members are then
+    sampled at once. The duration and intensity factors are sampled per rain run, while the onset
+    shift is sampled once per member, such that each member is a coherent time shift of the
+    perturbed runs. Each member is turned into weather intervals in the usual format.
+
+    :param RainSeries rain_data: historical rain data
+    :param datetime.datetime start_date: start date of the forecasts
+    :param int horizon: forecast horizon in minutes
+    :param float uncertainty: relative uncertainty of the interval durations
+    :param int size: number of ensemble members
+    :param dict perturbations: distributions of the rain onset shift, rain duration factor and rain
+        intensity factor, see :data:`DEFAULT_ENSEMBLE_PERTURBATIONS`. Missing entries are not
+        perturbed.
+    :param seed: seed for numpy.random.default_rng()
+    :return: weather intervals of each ensemble member
+    :rtype: list
+    """
+    assert horizon > 0
+    assert size > 0
+    assert start_date >= rain_data[0][0]
+    assert start_date + datetime.timedelta(minutes=horizon) <= rain_data[len(rain_data) - 1][0]
+    perturbations = DEFAULT_ENSEMBLE_PERTURBATIONS if perturbations is None else perturbations
+
+    if not isinstance(rain_data, RainSeries):
+        rain_data = RainSeries.from_rows(rain_data)
+    first = rain_data.index_of(start_date)
+    last = rain_data.index_after(start_date + datetime.timedelta(minutes=horizon))
+    rain_data.check_contiguous(first, last)
+    rain = rain_data.intensities[first:last]
+    if not np.all(rain >= 0):
+        raise RuntimeError("Rain data has unexpected values.")
+
+    starts, durations, raining = rain_runs(rain)
+    rain_per_minute = np.zeros(len(starts))
+    for k in np.flatnonzero(raining):
+        rain_per_minute[k] = np.add.accumulate(rain[starts[k]:starts[k] + durations[k]])[-1] / \
+                             durations[k]
+
+    # Sample the perturbations of all members at once, one row per member.
+    rng = np.random.default_rng(seed)
+
+    def sample(name, default):
+        if name not in perturbations:
+            return np.full((size, len(starts)), default)
+        method, *parameters = perturbations[name]
+        return getattr(rng, method)(*parameters, size=(size, len(starts)))
+
+    member_durations = np.where(raining,
+                                np.maximum(np.rint(durations * sample("duration", 1.0)), 1),
+                                durations).astype(int)
+    member_rain = np.maximum(rain_per_minute * sample("intensity", 1.0), 0.0)
+    if "onset" in perturbations:
+        method, *parameters = perturbations["onset"]
+        shifts = np.rint(getattr(rng, method)(*parameters, size=size)).astype(int)
+    else:
+        shifts = np.zeros(size, dtype=int)
+
+    weather_ensemble = []
+    for k in range(size):
+        runs = shift_runs(member_durations[k], raining, member_rain[k], shifts[k], horizon)
+        weather_ensemble.append(weather_intervals_from_runs(*runs, horizon, uncertainty))
+    return weather_ensemble
+
+
+def shift_runs(durations, raining, rain_per_minute, shift, horizon):
+    """
+    Shift dry and rain runs in time, and fit them to the horizon again.
+
+    A later onset lengthens the leading dry run, or adds one. An earlier onset cuts the first
+    minutes off. The runs are then cut off after the horizon, or the last run is extended with dry
+    weather up to the horizon.
+
+    :param numpy.ndarray durations: duration of each run in minutes
+    :param numpy.ndarray raining: whether it is raining during each run
+    :param numpy.ndarray rain_per_minute: average rain per minute of each run, 0 for dry runs
+    :param int shift: minutes to shift the runs later, negative to shift them earlier
+    :param int horizon: forecast horizon in minutes
+    :return: durations, raining and rain_per_minute of the shifted runs
+    :rtype: tuple
+    """
+    durations, raining, rain = list(durations), list(raining), list(rain_per_minute)
+    if shift > 0:
+        if raining[0]:
+            durations.insert(0, 0)
+            raining.insert(0, False)
+            rain.insert(0, 0.0)
+        durations[0] += shift
+    remaining = -shift
+    while remaining > 0 and durations:
+        cut = min(remaining, durations[0])
+        durations[0] -= cut
+        remaining -= cut
+        if durations[0] == 0:
+            del durations[0], raining[0], rain[0]
+
+    # Keep exactly horizon + 1 minutes, like the runs of the rain data.
+    total = horizon + 1
+    ends = np.cumsum(durations)
+    kept = int(np.searchsorted(ends, total, side="left")) + 1
+    durations, raining, rain = durations[:kept], raining[:kept], rain[:kept]
+    missing = total - sum(durations)
+    if missing < 0:
+        durations[-1] += missing
+    elif missing > 0:
+        if durations and not raining[-1]:
+            durations[-1] += missing
+        else:
+            durations.append(missing)
+            raining.append(False)
+            rain.append(0.0)
+    return np.array(durations), np.array(raining), np.array(rain)
+
+
+def write_weather_ensemble(file, weather_ensemble):
+    """
+    Writes each member of a weather forecast ensemble to its own csv file, named after the provided
+    file with the member number appended, e.g. ``forecast_0.csv``.
+
+    :param str file: csv file path the ensemble file names are derived from
+    :param list weather_ensemble: weather intervals of each ensemble member
+    :return: the csv file path of each ensemble member
+    :rtype: list
+    """
+    root, extension = os.path.splitext(file)
+    files = [f"{root}_{k}{extension}" for k in range(len(weather_ensemble))]
+    for member_file, weather_forecast in zip(files, weather_ensemble):
+        write_weather_forecast(member_file, weather_forecast)
+    return files
+
+
 def write_weather_forecast(file, weather_forecast):
     """
     Writes the weather forecast to a csv file. Overwrites current content.
+
+    The forecast is first written to a temporary file that then replaces the csv file, so readers
+    never see a partially written forecast.
     """
-    with open(file, "w") as f:
-        weather_writer = csv.writer(f, delimiter=',', quotechar='"',
-                                    quoting=csv.QUOTE_MINIMAL)
+    with atomic_write(file) as f:
+        weather_writer = csv.writer(f, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
         weather_writer.writerow(['#dryL', 'dryU', 'rainL', 'rainU', 'rain'])
         for row in weather_forecast:
             weather_writer.writerow(row)
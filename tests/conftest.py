@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+# The scripts are not a package, they import each other from the scripts folder.
+BASE_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BASE_FOLDER, "scripts"))
+sys.path.insert(1, os.path.join(BASE_FOLDER, "SWMMandStratego"))
+
+FAKE_VERIFYTA = """#!{python}
+import os
+import re
+import sys
+import time
+
+model, query = sys.argv[1], sys.argv[2]
+time.sleep(float(os.environ.get("FAKE_VERIFYTA_SLEEP", "0")))
+if os.environ.get("FAKE_VERIFYTA_DONE"):
+    open(os.path.join(os.environ["FAKE_VERIFYTA_DONE"], str(os.getpid())), "w").close()
+with open(model, "r") as f:
+    w = float(re.search(r"clock w = ([-0-9.e]+);", f.read()).group(1))
+opening = 1.0 if w > 100 else 4 / 7 if w > 30 else 1 / 7
+print("Formula is satisfied.")
+print("Open:")
+print(f"[0]: (0,1) (0,{{opening}}) (60,{{opening}}) (60,{{1 / 7}}) (61,{{1 / 7}})")
+"""
+
+
+@pytest.fixture
+def fake_verifyta(tmp_path, monkeypatch):
+    """
+    Put a fake verifyta command on the path, which answers the queries of the pond models without
+    synthesizing: the opening is 1/7, 4/7 or 1 by the water level, and 1/7 after the first control
+    period. It answers after FAKE_VERIFYTA_SLEEP seconds, and then creates a file named by its
+    process id in the folder FAKE_VERIFYTA_DONE, if set, such that killed runs can be told apart.
+
+    :return: the verifyta command
+    """
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    command = bin_folder / "verifyta-fake"
+    command.write_text(FAKE_VERIFYTA.format(python=sys.executable))
+    command.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_folder) + os.pathsep + os.environ["PATH"])
+    return command.name
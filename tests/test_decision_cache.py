@@ -0,0 +1,41 @@
+from decision_cache import DecisionCache, to_tuple
+
+FORECAST = [[0, 0, 60, 60, 0.1], [120, 120, 0, 0, 0.0]]
+
+
+def test_key_discretizes_states_with_resolution():
+    cache = DecisionCache(resolutions={"w": 1.0})
+    key = cache.key({"w": 10.3, "t": 0}, FORECAST)
+    assert key == ((("w", 10), ("t", 0)), to_tuple(FORECAST))
+    assert cache.key({"w": 9.7, "t": 0}, FORECAST) == key
+    assert cache.key({"w": 10.6, "t": 0}, FORECAST) != key
+    assert cache.key({"w": 10.3, "t": 1}, FORECAST) != key
+    assert cache.key({"w": 10.3, "t": 0}, FORECAST[:1]) != key
+
+
+def test_least_recently_used_decision_is_evicted():
+    cache = DecisionCache(max_size=2)
+    keys = [cache.key({"w": w}, FORECAST) for w in range(3)]
+    cache.put(keys[0], 0.1)
+    cache.put(keys[1], 0.5)
+    assert cache.get(keys[0]) == 0.1  # The first decision is now the most recently used.
+    cache.put(keys[2], 1.0)
+    assert len(cache) == 2
+    assert keys[1] not in cache
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == 0.1
+    assert cache.get(keys[2]) == 1.0
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_saved_cache_is_loaded_with_the_same_keys(tmp_path):
+    file = str(tmp_path / "decisions.json")
+    cache = DecisionCache(resolutions={"w": 1.0}, file=file)
+    key = cache.key({"w": 10.3, "Controller.location": "Controller._id3"}, FORECAST)
+    cache.put(key, 4 / 7)
+    cache.save()
+
+    loaded = DecisionCache(resolutions={"w": 1.0}, file=file)
+    assert len(loaded) == 1
+    assert loaded.get(loaded.key({"w": 9.9, "Controller.location": "Controller._id3"},
+                                 FORECAST)) == 4 / 7
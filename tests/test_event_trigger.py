@@ -0,0 +1,35 @@
+from event_trigger import EventTrigger
+
+FORECAST = [[0, 0, 60, 60, 0.1], [1440, 1440, 1440, 1440, 0.0]]
+DRY_FORECAST = [[361, 361, 0, 0, 0.0], [1440, 1440, 1440, 1440, 0.0]]
+
+
+def test_replan_when_level_or_forecast_change():
+    event_trigger = EventTrigger(level_threshold=2.0, max_age=6)
+    assert event_trigger.replan(40.0, FORECAST)
+    event_trigger.plan(40.0, FORECAST, [0.5, 1.0])
+    assert not event_trigger.replan(41.5, FORECAST)
+    assert not event_trigger.replan(38.0, [list(interval) for interval in FORECAST])
+    assert event_trigger.replan(42.5, FORECAST)
+    assert event_trigger.replan(40.0, DRY_FORECAST)
+
+
+def test_plan_is_executed_until_it_expires():
+    event_trigger = EventTrigger(max_age=3)
+    event_trigger.plan(40.0, FORECAST, [0.5, 1.0])
+    assert not event_trigger.replan(40.0, FORECAST)
+    assert event_trigger.next_action() == 1.0
+    assert not event_trigger.replan(40.0, FORECAST)
+    # The last planned action is kept when the plan does not reach this far.
+    assert event_trigger.next_action() == 1.0
+    assert event_trigger.age == 2
+    assert event_trigger.replan(40.0, FORECAST)
+    assert (event_trigger.replans, event_trigger.skips) == (1, 2)
+
+
+def test_plan_of_a_single_period_is_replaced_at_the_next_control_instant():
+    event_trigger = EventTrigger(max_age=3)
+    event_trigger.plan(40.0, FORECAST, [0.5], periods=1)
+    assert event_trigger.replan(40.0, FORECAST)
+    event_trigger.plan(40.0, FORECAST, [0.5, 0.5, 1.0], periods=10)
+    assert event_trigger.periods == 3
@@ -0,0 +1,27 @@
+import os
+
+import pytest
+
+from run_workspace import atomic_write
+
+
+def test_atomic_write_replaces_file(tmp_path):
+    file = tmp_path / "forecast.csv"
+    file.write_text("old\n")
+    with atomic_write(str(file)) as f:
+        f.write("new\n")
+        assert file.read_text() == "old\n"  # Not visible before the write completes.
+    assert file.read_text() == "new\n"
+    assert os.stat(file).st_mode & 0o777 == 0o644
+    assert os.listdir(tmp_path) == ["forecast.csv"]
+
+
+def test_failed_atomic_write_leaves_file(tmp_path):
+    file = tmp_path / "forecast.csv"
+    file.write_text("old\n")
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(file)) as f:
+            f.write("partial")
+            raise RuntimeError
+    assert file.read_text() == "old\n"
+    assert os.listdir(tmp_path) == ["forecast.csv"]
@@ -0,0 +1,71 @@
+import csv
+import datetime
+import os.path
+
+import pytest
+
+from conftest import BASE_FOLDER
+from simplemodeltest import SwmmSession, run_swmm
+from swmm_inp import SwmmInputFile, RAIN_TIMESERIES
+
+START = datetime.datetime(2019, 9, 5)
+HOURS = 4
+TIME_STEP = 60
+
+
+@pytest.fixture
+def swmm_inputfile(tmp_path):
+    """
+    The demo3 swmm model, with one hour of heavy rain such that the basin fills during the test
+    period. Swmm restarts its runoff time steps at each run, so the dry runoff step is set to the
+    wet one for chained runs to follow the uninterrupted run.
+    """
+    rain_data_file = tmp_path / "rain.dat"
+    with open(rain_data_file, "w") as f:
+        for minute in range(60 * (HOURS + 1)):
+            date = START + datetime.timedelta(minutes=minute)
+            rain = 30.0 if 30 <= minute < 90 else 0.0
+            f.write(f"{date:%m/%d/%Y %H:%M:%S} {rain}\n")
+    model = SwmmInputFile.read(os.path.join(BASE_FOLDER, "swmm_models", "swmm_demo3.inp"))
+    model.set_rain_data_file(RAIN_TIMESERIES, str(rain_data_file))
+    model.set_option("DRY_STEP", model.get_option("WET_STEP"))
+    swmm_inputfile = str(tmp_path / "swmm_demo3.inp")
+    model.write(swmm_inputfile)
+    return swmm_inputfile
+
+
+def read_water_levels(file):
+    with open(file, "r") as f:
+        return {row[0]: float(row[1]) for row in csv.reader(f)}
+
+
+def test_chained_hotstart_runs_match_uninterrupted_run(swmm_inputfile, tmp_path):
+    # Simulate one minute more to also get the level at the end, as without hotstart file.
+    end = START + datetime.timedelta(hours=HOURS, minutes=1)
+    uninterrupted_file = str(tmp_path / "uninterrupted.csv")
+    run_swmm(swmm_inputfile, "SU1", "OR1", TIME_STEP, uninterrupted_file, 0.0, 0.5, START, end)
+
+    hotstart_file = str(tmp_path / "state.hsf")
+    chained = {}
+    for hour in range(HOURS):
+        chained_file = str(tmp_path / f"chained_{hour}.csv")
+        water_level = run_swmm(swmm_inputfile, "SU1", "OR1", TIME_STEP, chained_file, 0.0, 0.5,
+                               START + datetime.timedelta(hours=hour),
+                               START + datetime.timedelta(hours=hour + 1), hotstart_file,
+                               resume=hour > 0)
+        chained.update(read_water_levels(chained_file))
+        assert water_level == chained[f"{START + datetime.timedelta(hours=hour + 1)}"]
+
+    uninterrupted = read_water_levels(uninterrupted_file)
+    assert max(uninterrupted.values()) > 0.1
+    assert list(chained) == list(uninterrupted)
+    assert list(chained.values()) == pytest.approx(list(uninterrupted.values()), abs=5e-6)
+
+
+def test_session_refuses_to_advance_past_its_end(swmm_inputfile, tmp_path):
+    end = START + datetime.timedelta(hours=1)
+    with SwmmSession(swmm_inputfile, "SU1", "OR1", TIME_STEP, str(tmp_path / "session.csv"), 0.0,
+                     START, end) as session:
+        assert session.advance(0.5, START + datetime.timedelta(minutes=30)) > 0
+        with pytest.raises(RuntimeError):
+            session.advance(0.5, end + datetime.timedelta(hours=1))
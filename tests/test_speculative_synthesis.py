@@ -0,0 +1,74 @@
+import functools
+import os
+import os.path
+import time
+
+import pytest
+import yaml
+
+from conftest import BASE_FOLDER
+from speculative_synthesis import SpeculativeSynthesizer
+from strategy_table import synthesize_action
+
+FORECAST = [[0, 0, 60, 60, 0.1], [1440, 1440, 1440, 1440, 0.0]]
+
+
+@pytest.fixture
+def synthesize(fake_verifyta):
+    uppaal_folder = os.path.join(BASE_FOLDER, "uppaal")
+    with open(os.path.join(uppaal_folder, "pond_demo3_config.yaml"), "r") as yamlfile:
+        model_cfg_dict = yaml.safe_load(yamlfile)
+    with open(os.path.join(uppaal_folder, "verifyta_demo3_config.yaml"), "r") as yamlfile:
+        learning_cfg_dict = yaml.safe_load(yamlfile)
+    return functools.partial(synthesize_action,
+                             uppaal_template_path=os.path.join(uppaal_folder, "pond_demo3.xml"),
+                             libtable_path=None, model_cfg_dict=model_cfg_dict,
+                             learning_cfg_dict=learning_cfg_dict, verifyta_command=fake_verifyta,
+                             period=60, horizon=6)
+
+
+def test_action_of_closest_candidate_is_used(synthesize):
+    with SpeculativeSynthesizer(synthesize, candidates=3, spread=2.0) as speculation:
+        speculation.submit(50.0, 40.0, FORECAST)
+        assert speculation.water_levels.tolist() == [58.0, 60.0, 62.0]
+        assert speculation.result(60.5, FORECAST) == pytest.approx(4 / 7)
+        # The candidates are forgotten once used, and only match the forecast and nearby levels.
+        assert speculation.result(60.5, FORECAST) is None
+        speculation.submit(50.0, 40.0, FORECAST)
+        assert speculation.result(60.0, FORECAST[1:]) is None
+        speculation.submit(50.0, 40.0, FORECAST)
+        assert speculation.result(65.0, FORECAST) is None
+        assert (speculation.hits, speculation.misses) == (1, 3)
+
+
+def test_cancelled_syntheses_are_killed(synthesize, tmp_path, monkeypatch):
+    done_folder = tmp_path / "done"
+    done_folder.mkdir()
+    monkeypatch.setenv("FAKE_VERIFYTA_SLEEP", "1")
+    monkeypatch.setenv("FAKE_VERIFYTA_DONE", str(done_folder))
+    with SpeculativeSynthesizer(synthesize, candidates=2) as speculation:
+        speculation.submit(50.0, None, FORECAST)
+        futures = speculation.futures
+        time.sleep(0.3)  # Such that verifyta is running.
+        start = time.monotonic()
+        speculation.cancel()
+        assert [future.result() for future in futures] == [None, None]
+        assert time.monotonic() - start < 0.8
+    time.sleep(1.0)  # Verifyta would have finished by now, had it not been killed.
+    assert list(done_folder.iterdir()) == []
+
+
+def test_known_candidates_are_not_synthesized():
+    synthesized = []
+
+    def synthesize(water_level, weather_forecast, cancel):
+        synthesized.append(water_level)
+        return 1.0
+
+    with SpeculativeSynthesizer(synthesize, candidates=3, spread=2.0) as speculation:
+        speculation.submit(50.0, None, FORECAST, known=lambda water_level: water_level < 50.0)
+        assert speculation.water_levels.tolist() == [50.0, 52.0]
+        assert speculation.result(50.0, FORECAST) == 1.0
+        speculation.submit(50.0, None, FORECAST, known=lambda water_level: True)
+        assert speculation.result(50.0, FORECAST) is None
+    assert 48.0 not in synthesized
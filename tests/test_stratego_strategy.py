@@ -0,0 +1,80 @@
+import json
+import os.path
+
+import pytest
+
+from conftest import BASE_FOLDER
+from stratego_strategy import StrategoStrategy, read_constants
+
+# A small strategy in the format of saveStrategy(): the controller chooses the smallest opening
+# while the pond is low, and otherwise the largest opening, or the middle one when it is raining.
+STRATEGY = {
+    "version": 1.0,
+    "type": "state->regressor",
+    "representation": "map",
+    "actions": {
+        "0": "Controller._id4->Controller._id3 { 1, tau, x := 0, Open := Opening[0] }",
+        "1": "Controller._id4->Controller._id3 { 1, tau, x := 0, Open := Opening[1] }",
+        "2": "Controller._id4->Controller._id3 { 1, tau, x := 0, Open := Opening[2] }",
+        "3": "WAIT",
+    },
+    "statevars": ["Controller.location", "Rain.i"],
+    "pointvars": ["w", "rain"],
+    "locationnames": {"Controller.location": {"0": "_id3", "1": "_id4"}},
+    "regressors": {
+        "(1,0)": {
+            "type": "act->point->val",
+            "representation": "simpletree",
+            "minimize": 1,
+            "regressor": {
+                "0": {"var": 0, "bound": 50.0, "low": 1.0, "high": 30.0},
+                "1": {"var": 0, "bound": 50.0, "low": 2.0,
+                      "high": {"var": 1, "bound": 0.0, "low": 25.0, "high": 10.0}},
+                "2": {"var": 0, "bound": 50.0, "low": 3.0, "high": 20.0},
+            },
+        },
+    },
+}
+
+
+@pytest.fixture
+def strategy(tmp_path):
+    file = tmp_path / "strategy.json"
+    file.write_text(json.dumps(STRATEGY))
+    return StrategoStrategy.load(str(file))
+
+
+@pytest.fixture
+def constants():
+    return read_constants(os.path.join(BASE_FOLDER, "uppaal", "pond_demo3.xml"))
+
+
+def test_read_constants(constants):
+    assert constants["W"] == 200
+    assert constants["Opening"] == pytest.approx([1 / 7, 4 / 7, 7 / 7])
+
+
+def test_best_action(strategy):
+    state = {"Controller.location": "Controller._id4", "Rain.i": 0}
+    assert strategy.best_action({**state, "w": 40.0, "rain": 0.0}) == 0
+    assert strategy.best_action({**state, "w": 60.0, "rain": 0.0}) == 2
+    assert strategy.best_action({**state, "w": 60.0, "rain": 0.1}) == 1
+    assert strategy.best_action({"Controller.location": 1, "Rain.i": 0, "w": 60.0,
+                                 "rain": 0.1}) == 1
+    assert strategy.best_action({**state, "Rain.i": 1, "w": 40.0, "rain": 0.0}) is None
+
+
+def test_best_action_with_missing_point_variables(strategy):
+    state = {"Controller.location": "Controller._id4", "Rain.i": 0}
+    # Without rain, the action is only decided when it does not depend on the rain.
+    assert strategy.best_action({**state, "w": 40.0}) == 0
+    assert strategy.best_action({**state, "w": 60.0}) is None
+    # Missing state variables match any discrete state.
+    assert strategy.best_action({"w": 40.0, "rain": 0.0}) == 0
+
+
+def test_assigned_value(strategy, constants):
+    assert strategy.assigned_value(1, "Open", constants) == pytest.approx(4 / 7)
+    assert strategy.assigned_value(1, "Open") is None
+    assert strategy.assigned_value(3, "Open", constants) is None
+    assert strategy.decide({"w": 60.0, "rain": 0.0}, "Open", constants) == pytest.approx(1.0)
@@ -0,0 +1,43 @@
+from strategy_table import StrategyTable, class_forecast, forecast_classes
+
+HORIZON = 360
+UNCERTAINTY = 0.1
+OPENINGS = [1 / 7, 4 / 7, 7 / 7]
+
+
+def synthesize(water_level, weather_forecast):
+    """
+    Stub of the synthesis: the largest opening for a full pond, the middle one when rain is
+    forecast, and otherwise the smallest one.
+    """
+    if water_level >= 100:
+        return OPENINGS[2]
+    return OPENINGS[1] if weather_forecast[0][4] > 0 else OPENINGS[0]
+
+
+def build_table():
+    return StrategyTable.build([0, 50, 100, 150], [0, 60], [60], [0.05], synthesize, HORIZON,
+                               UNCERTAINTY, max_workers=2)
+
+
+def test_build_synthesizes_every_grid_point():
+    table = build_table()
+    assert table.actions.shape == (4, 3)
+    dry, rain = class_forecast(table.classes[0], HORIZON, UNCERTAINTY), \
+        class_forecast(table.classes[1], HORIZON, UNCERTAINTY)
+    assert table.actions[:, table.forecast_class(dry)].tolist() == \
+        [OPENINGS[0], OPENINGS[0], OPENINGS[2], OPENINGS[2]]
+    assert table.actions[:, table.forecast_class(rain)].tolist() == \
+        [OPENINGS[1], OPENINGS[1], OPENINGS[2], OPENINGS[2]]
+
+
+def test_lookup_only_returns_synthesized_actions(tmp_path):
+    file = str(tmp_path / "table.npz")
+    build_table().save(file)
+    table = StrategyTable.load(file)
+    rain = class_forecast(forecast_classes([60], [60], [0.05], HORIZON)[1], HORIZON, UNCERTAINTY)
+    assert table.lookup(50, rain) == OPENINGS[1]  # On the grid.
+    assert table.lookup(25, rain) == OPENINGS[1]  # Between grid points with the same action.
+    assert table.lookup(100, rain) == OPENINGS[2]
+    assert table.lookup(75, rain) is None  # Between grid points with different actions.
+    assert table.lookup(160, rain) is None  # Outside the grid.
@@ -0,0 +1,60 @@
+import datetime
+import glob
+import os.path
+
+import pytest
+
+from conftest import BASE_FOLDER
+from swmm_inp import SwmmInputFile, RAIN_TIMESERIES
+
+INP_FILES = sorted(glob.glob(os.path.join(BASE_FOLDER, "**", "*.inp"), recursive=True))
+
+
+def test_repo_has_swmm_models():
+    assert os.path.join(BASE_FOLDER, "swmm_models", "swmm_demo3.inp") in INP_FILES
+
+
+@pytest.mark.parametrize("inp_file", INP_FILES,
+                         ids=[os.path.relpath(file, BASE_FOLDER) for file in INP_FILES])
+def test_unedited_model_is_written_as_read(inp_file, tmp_path):
+    copy = str(tmp_path / "model.inp")
+    SwmmInputFile.read(inp_file).write(copy)
+    with open(inp_file, "r") as f, open(copy, "r") as g:
+        assert g.read() == f.read()
+
+
+@pytest.mark.parametrize("inp_file", INP_FILES,
+                         ids=[os.path.relpath(file, BASE_FOLDER) for file in INP_FILES])
+def test_edits_only_change_the_edited_lines(inp_file, tmp_path):
+    model = SwmmInputFile.read(inp_file)
+    start = datetime.datetime(2019, 9, 5)
+    model.set_dates(start, start + datetime.timedelta(days=2))
+    model.set_rain_data_file(RAIN_TIMESERIES, "/data/rain file.dat")
+    edited_file = str(tmp_path / "model.inp")
+    model.write(edited_file)
+
+    edited = SwmmInputFile.read(edited_file)
+    assert edited.get_option("START_DATE") == "09/05/2019"
+    assert edited.get_option("END_DATE") == "09/07/2019"
+    assert edited.get_option("REPORT_START_TIME") == "00:00:00"
+    assert edited.get_value("TIMESERIES", RAIN_TIMESERIES, 2) == '"/data/rain file.dat"'
+    with open(inp_file, "r") as f, open(edited_file, "r") as g:
+        original_lines, edited_lines = f.read().splitlines(), g.read().splitlines()
+    assert len(edited_lines) == len(original_lines)
+    changed = [line for line, original_line in zip(edited_lines, original_lines)
+               if line != original_line]
+    assert len(changed) <= 7  # Six dates and times, and the rain data file.
+    # Reading again returns the parsed file as it was, not the edited copy.
+    assert SwmmInputFile.read(inp_file).to_text() == "\n".join(original_lines) + "\n"
+
+
+def test_element_values_are_edited_by_name():
+    model = SwmmInputFile.read(os.path.join(BASE_FOLDER, "swmm_models", "swmm_demo3.inp"))
+    model.set_initial_depth("SU1", 0.5)
+    model.set_orifice_geometry("OR1", 0.2)
+    edited = SwmmInputFile.parse(model.to_text())
+    assert edited.get_value("STORAGE", "SU1", 3) == "0.5"
+    assert edited.get_value("XSECTIONS", "OR1", 2) == "0.2"
+    assert edited.get_value("XSECTIONS", "OR1", 1) == "CIRCULAR"
+    with pytest.raises(KeyError):
+        model.set_initial_depth("SU9", 0.5)
@@ -0,0 +1,100 @@
+import csv
+import datetime
+import json
+
+import numpy as np
+
+from swmm_recording import StreamingCsvWriter, TimeSeriesRecorder
+
+START = datetime.datetime(2019, 9, 5)
+
+
+def read_rows(files):
+    rows = []
+    for file in files:
+        with open(file, "r") as f:
+            reader = csv.reader(f)
+            assert next(reader) == ["time", "level"]
+            rows.extend(reader)
+    return rows
+
+
+def test_streamed_rows_rotate_and_complete_with_manifest(tmp_path):
+    file = str(tmp_path / "results.csv")
+    recorder = TimeSeriesRecorder(START, START + datetime.timedelta(hours=2), 60, chunk_size=10)
+    recorder.register("level")
+    recorder.stream_to(file, max_bytes=200)
+    for minute in range(121):
+        recorder.record(START + datetime.timedelta(minutes=minute), level=minute / 100)
+    recorder.close()
+
+    with open(file + ".manifest.json", "r") as f:
+        manifest = json.load(f)
+    assert manifest["rows"] == 121
+    assert len(manifest["files"]) > 1
+    rows = read_rows([str(tmp_path / name) for name in manifest["files"]])
+    assert [float(row[1]) for row in rows] == [minute / 100 for minute in range(121)]
+
+
+def test_rotated_files_of_an_earlier_run_are_removed(tmp_path):
+    file = str(tmp_path / "results.csv")
+    for name in ("results_1.csv", "results_2.csv", "results_2019.txt"):
+        (tmp_path / name).write_text("time,level\n")
+    writer = StreamingCsvWriter(file, ["time", "level"])
+    writer.writerows([["2019-09-05 00:00", 0.5]])
+    writer.close()
+
+    assert sorted(path.name for path in tmp_path.iterdir()) == \
+        ["results.csv", "results.csv.manifest.json", "results_2019.txt"]
+
+
+def test_recorder_saves_columns_without_streaming(tmp_path):
+    recorder = TimeSeriesRecorder(START, START + datetime.timedelta(minutes=2), 60)
+    recorder.register("level")
+    for minute in range(3):
+        recorder.record(START + datetime.timedelta(minutes=minute), level=minute / 100)
+    recorder.save(str(tmp_path / "results.npz"))
+    with np.load(str(tmp_path / "results.npz")) as data:
+        assert data["level"].tolist() == [0.0, 0.01, 0.02]
+        assert len(data["time"]) == 3
+
+
+def test_recorder_saves_streamed_columns(tmp_path):
+    recorder = TimeSeriesRecorder(START, START + datetime.timedelta(minutes=30), 60, chunk_size=4)
+    recorder.register("level")
+    recorder.register("fallback", dtype=np.int8)
+    recorder.stream_to(str(tmp_path / "results.csv"), max_bytes=100)
+    for minute in range(31):
+        recorder.record(START + datetime.timedelta(minutes=minute), level=minute / 3,
+                        fallback=minute % 3)
+    recorder.close()
+    recorder.save(str(tmp_path / "results.npz"))
+    with np.load(str(tmp_path / "results.npz")) as data:
+        assert data["level"].tolist() == [minute / 3 for minute in range(31)]
+        assert data["fallback"].dtype == np.int8
+        assert data["time"][-1] == np.datetime64(START + datetime.timedelta(minutes=30))
+
+
+def test_streaming_without_header(tmp_path):
+    file = str(tmp_path / "levels.csv")
+    writer = StreamingCsvWriter(file, None)
+    writer.writerow(["2019-09-05 00:00:00", 0.5])
+    writer.flush()
+    assert not (tmp_path / "levels.csv.manifest.json").exists()
+    writer.close()
+    with open(file, "r") as f:
+        assert list(csv.reader(f)) == [["2019-09-05 00:00:00", "0.5"]]
+    assert (tmp_path / "levels.csv.manifest.json").exists()
+
+
+def test_observable_can_be_registered_before_another(tmp_path):
+    recorder = TimeSeriesRecorder(START, START + datetime.timedelta(minutes=1), 60)
+    recorder.register("level")
+    recorder.register("rain")
+    recorder.register("setting", lambda: 0.5, before="rain")
+    recorder.record(START, level=0.1, rain=0.2)
+    recorder.write_csv(str(tmp_path / "results.csv"))
+    with open(tmp_path / "results.csv", "r") as f:
+        reader = csv.reader(f)
+        assert next(reader) == ["time", "level", "setting", "rain"]
+        assert next(reader) == ["2019-09-05 00:00", "0.1", "0.5", "0.2"]
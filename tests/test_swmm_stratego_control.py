@@ -0,0 +1,105 @@
+import datetime
+import os.path
+import shutil
+import time
+
+import pytest
+import yaml
+
+from conftest import BASE_FOLDER
+from decision_cache import DecisionCache
+from event_trigger import EventTrigger
+import swmm_stratego_control as control
+
+START = datetime.datetime(2019, 9, 5)
+FORECAST = [[0, 0, 60, 60, 0.1], [1440, 1440, 1440, 1440, 0.0]]
+PERIOD = 60
+HORIZON = 6
+
+
+@pytest.fixture
+def controller(fake_verifyta, tmp_path):
+    """
+    Controller of the demo3 pond model, synthesizing with the fake verifyta within 5 seconds.
+    """
+    uppaal_folder = os.path.join(BASE_FOLDER, "uppaal")
+    model_template_path = str(tmp_path / "pond_demo3.xml")
+    shutil.copy(os.path.join(uppaal_folder, "pond_demo3.xml"), model_template_path)
+    control.insert_paths_in_uppaal_model(model_template_path, str(tmp_path / "forecast.csv"),
+                                         os.path.join(uppaal_folder, "libtable.so"))
+    with open(os.path.join(uppaal_folder, "pond_demo3_config.yaml"), "r") as yamlfile:
+        model_cfg_dict = yaml.safe_load(yamlfile)
+    with open(os.path.join(uppaal_folder, "verifyta_demo3_config.yaml"), "r") as yamlfile:
+        learning_cfg_dict = yaml.safe_load(yamlfile)
+    return control.MPCSetupPond(model_template_path, str(tmp_path / "result.txt"),
+                                query_file=str(tmp_path / "query.q"),
+                                model_cfg_dict=model_cfg_dict, learning_args=learning_cfg_dict,
+                                verifyta_command=fake_verifyta, external_simulator=False,
+                                action_variable="Open", debug=False, deadline=5.0)
+
+
+@pytest.fixture
+def done_folder(tmp_path, monkeypatch):
+    """
+    The folder in which the fake verifyta marks the runs that were not killed.
+    """
+    done_folder = tmp_path / "done"
+    done_folder.mkdir()
+    monkeypatch.setenv("FAKE_VERIFYTA_DONE", str(done_folder))
+    return done_folder
+
+
+def synthesize(controller, water_level, date, **kwargs):
+    weather_forecast_path = os.path.join(os.path.dirname(controller.query_file), "forecast.csv")
+    return control.get_control_strategy(water_level / 100, date, controller, PERIOD, HORIZON,
+                                        None, weather_forecast_path, 0.1,
+                                        weather_forecast=FORECAST, **kwargs)
+
+
+def test_missed_deadlines_fall_back_and_kill_verifyta(controller, done_folder, monkeypatch):
+    assert synthesize(controller, 40.0, START) == pytest.approx(4 / 7)
+    assert controller.fallback == control.FALLBACK_NONE
+    done_runs = len(list(done_folder.iterdir()))
+
+    monkeypatch.setattr(controller, "deadline", 0.3)
+    monkeypatch.setenv("FAKE_VERIFYTA_SLEEP", "2")
+    next_date = START + datetime.timedelta(minutes=PERIOD)
+    start = time.monotonic()
+    # The strategy of the previous control instant planned the smallest opening for now.
+    assert synthesize(controller, 40.0, next_date) == pytest.approx(1 / 7)
+    assert controller.fallback == control.FALLBACK_LAST_STRATEGY
+    # That strategy is used up, so the level rule decides: a high level gets the widest opening.
+    assert synthesize(controller, 150.0, next_date + datetime.timedelta(minutes=PERIOD)) == 1.0
+    assert controller.fallback == control.FALLBACK_LEVEL_RULE
+    assert controller.deadline_misses == 2
+    assert time.monotonic() - start < 2.0
+    time.sleep(2.0)  # Verifyta would have finished by now, had it not been killed.
+    assert len(list(done_folder.iterdir())) == done_runs
+
+
+def test_fallback_actions_are_neither_cached_nor_planned_ahead(controller, monkeypatch):
+    decision_cache = DecisionCache()
+    event_trigger = EventTrigger(max_age=3)
+    monkeypatch.setattr(controller, "deadline", 0.3)
+    monkeypatch.setenv("FAKE_VERIFYTA_SLEEP", "2")
+    assert synthesize(controller, 40.0, START, decision_cache=decision_cache,
+                      event_trigger=event_trigger) == pytest.approx(1 / 7)
+    assert controller.fallback == control.FALLBACK_LEVEL_RULE
+    assert len(decision_cache) == 0
+    # The next control instant synthesizes again, even though the situation is the same.
+    assert event_trigger.replan(40.0, FORECAST)
+
+    monkeypatch.setattr(controller, "deadline", 5.0)
+    monkeypatch.delenv("FAKE_VERIFYTA_SLEEP")
+    assert synthesize(controller, 40.0, START, decision_cache=decision_cache,
+                      event_trigger=event_trigger) == pytest.approx(4 / 7)
+    assert controller.fallback == control.FALLBACK_NONE
+    assert len(decision_cache) == 1
+    assert not event_trigger.replan(40.0, FORECAST)
+
+
+@pytest.mark.parametrize("time_step", [0, 30, 90.5])
+def test_time_step_must_be_whole_minutes(time_step):
+    with pytest.raises(ValueError, match="whole number of minutes"):
+        control.swmm_control(os.path.join(BASE_FOLDER, "swmm_models", "swmm_demo3.inp"), "OR1",
+                             "SU1", time_step, "results", None, PERIOD, HORIZON, None, None, 0.1)
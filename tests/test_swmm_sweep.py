@@ -0,0 +1,74 @@
+import csv
+import datetime
+import os.path
+
+import pytest
+
+from conftest import BASE_FOLDER
+from swmm_inp import SwmmInputFile
+from swmm_sweep import KPI_NAMES, create_scenarios, run_scenario, run_sweep, write_sweep_results
+
+START = datetime.datetime(2019, 9, 5)
+HOURS = 3
+
+
+@pytest.fixture
+def swmm_inputfile(tmp_path):
+    """
+    The demo3 swmm model, shortened to a few hours.
+    """
+    model = SwmmInputFile.read(os.path.join(BASE_FOLDER, "swmm_models", "swmm_demo3.inp"))
+    model.set_dates(START, START + datetime.timedelta(hours=HOURS))
+    swmm_inputfile = str(tmp_path / "swmm_demo3.inp")
+    model.write(swmm_inputfile)
+    return swmm_inputfile
+
+
+@pytest.fixture
+def rain_data_file(tmp_path):
+    """
+    One hour of heavy rain, such that the basin fills during the sweep.
+    """
+    rain_data_file = tmp_path / "rain.dat"
+    with open(rain_data_file, "w") as f:
+        for minute in range(60 * (HOURS + 1)):
+            date = START + datetime.timedelta(minutes=minute)
+            rain = 30.0 if 30 <= minute < 90 else 0.0
+            f.write(f"{date:%m/%d/%Y %H:%M:%S} {rain}\n")
+    return str(rain_data_file)
+
+
+def test_sweep_kpis(swmm_inputfile, rain_data_file, tmp_path):
+    scenarios = create_scenarios([swmm_inputfile], [rain_data_file], [0.0, 1.0], [0.0, 0.5])
+    assert [(scenario["orifice_setting"], scenario["initial_depth"]) for scenario in scenarios] == \
+        [(0.0, 0.0), (0.0, 0.5), (1.0, 0.0), (1.0, 0.5)]
+    results = run_sweep(scenarios, "SU1", "OR1", 60, max_workers=2)
+    # The processes give the same KPIs as a single run, in the order of the scenarios.
+    assert results[1] == pytest.approx(run_scenario(scenarios[1], "SU1", "OR1", 60))
+
+    closed_dry, closed_wet, open_dry, open_wet = results
+    for kpis in results:
+        assert set(kpis) == set(KPI_NAMES)
+        assert 0.0 <= kpis["mean_depth"] <= kpis["max_depth"]
+        assert kpis["final_depth"] <= kpis["max_depth"]
+        assert kpis["flooding_volume"] >= 0.0
+    # A closed orifice lets no water through, so the basin only fills.
+    assert closed_dry["max_orifice_flow"] == 0.0
+    assert closed_dry["final_depth"] == pytest.approx(closed_dry["max_depth"])
+    assert closed_dry["max_depth"] > 0.1
+    assert open_dry["max_orifice_flow"] > 0.0
+    assert open_dry["max_depth"] < closed_dry["max_depth"]
+    # The initial water adds to the rain.
+    assert closed_wet["final_depth"] > closed_dry["final_depth"]
+    assert open_wet["mean_depth"] > open_dry["mean_depth"]
+
+    results_file = str(tmp_path / "swmm_sweep_results.csv")
+    write_sweep_results(results_file, scenarios, results)
+    with open(results_file, "r") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["scenario"] for row in rows] == ["0", "1", "2", "3"]
+    assert rows[3]["swmm_inputfile"] == "swmm_demo3.inp"
+    assert rows[3]["rain_data_file"] == "rain.dat"
+    assert float(rows[3]["orifice_setting"]) == 1.0
+    assert float(rows[3]["initial_depth"]) == 0.5
+    assert [float(rows[3][name]) for name in KPI_NAMES] == [open_wet[name] for name in KPI_NAMES]
@@ -0,0 +1,47 @@
+import datetime
+
+import numpy as np
+
+import weather_forecast_generation as weather
+
+START = datetime.datetime(2019, 9, 5)
+HORIZON = 360
+
+
+def rain_series(rain):
+    minutes = weather.datetime_to_minutes(START) + np.arange(len(rain), dtype=np.int64)
+    return weather.RainSeries(minutes, np.asarray(rain, dtype=float))
+
+
+def example_rain():
+    rain = np.zeros(2 * HORIZON)
+    rain[50:80] = 0.1
+    rain[200:260] = 0.05
+    rain[340:400] = 0.2
+    return rain
+
+
+def test_unperturbed_members_equal_forecast():
+    rain_data = rain_series(example_rain())
+    ensemble = weather.calculate_weather_ensemble(rain_data, START, HORIZON, 0.1, 3,
+                                                  perturbations={}, seed=0)
+    expected = weather.calculate_weather_intervals_vectorized(rain_data, START, HORIZON, 0.1)
+    assert all(member == expected for member in ensemble)
+
+
+def test_onset_shift_moves_whole_forecast():
+    rain = example_rain()
+    perturbations = {"onset": ("normal", 30.0, 0.0)}
+    member, = weather.calculate_weather_ensemble(rain_series(rain), START, HORIZON, 0.1, 1,
+                                                 perturbations=perturbations, seed=0)
+    later = rain_series(np.concatenate([np.zeros(30), rain]))
+    assert member == weather.calculate_weather_intervals_vectorized(later, START, HORIZON, 0.1)
+
+
+def test_negative_onset_shift_ends_dry():
+    rain = example_rain()
+    perturbations = {"onset": ("normal", -30.0, 0.0)}
+    member, = weather.calculate_weather_ensemble(rain_series(rain), START, HORIZON, 0.1, 1,
+                                                 perturbations=perturbations, seed=0)
+    earlier = rain_series(np.concatenate([rain[30:HORIZON + 1], np.zeros(HORIZON)]))
+    assert member == weather.calculate_weather_intervals_vectorized(earlier, START, HORIZON, 0.1)
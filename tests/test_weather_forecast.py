@@ -0,0 +1,354 @@
+import datetime
+import gc
+import os
+import re
+import shutil
+import weakref
+
+import numpy as np
+import pytest
+
+import weather_forecast_generation as weather
+from rain_index import row_index
+
+START = datetime.datetime(2019, 9, 5)
+HORIZON = 60
+
+
+def rain_series_with_gap(gap_start, gap_length):
+    minutes = weather.datetime_to_minutes(START) + np.arange(3 * HORIZON, dtype=np.int64)
+    minutes[gap_start:] += gap_length
+    rain = np.zeros(len(minutes))
+    rain[gap_start - 10:gap_start] = 0.1
+    rain[gap_start:gap_start + 10] = 0.2
+    return weather.RainSeries(minutes, rain)
+
+
+def test_forecasts_counting_rows_reject_missing_minutes():
+    rain_data = rain_series_with_gap(30, 5)
+    with pytest.raises(ValueError):
+        weather.calculate_weather_intervals_vectorized(rain_data, START, HORIZON, 0.1)
+    with pytest.raises(ValueError):
+        weather.ForecastTable.build(rain_data, START, START + datetime.timedelta(minutes=30), 5,
+                                    HORIZON, 0.1)
+    with pytest.raises(ValueError):
+        weather.IncrementalForecaster(rain_data, HORIZON, 0.1).forecast_at(START)
+
+
+def test_rain_events_count_missing_minutes_as_dry():
+    forecast = weather.RainEvents.from_series(rain_series_with_gap(30, 5)).weather_intervals(
+        START, HORIZON, 0.0)
+    assert [interval[:4] for interval in forecast[:3]] == [[20, 20, 10, 10], [5, 5, 10, 10],
+                                                           [16, 16, 0, 0]]
+    assert [interval[4] for interval in forecast[:3]] == pytest.approx([0.1, 0.2, 0])
+
+
+def test_forecasts_agree_on_contiguous_rain_data():
+    rain_data = rain_series_with_gap(30, 0)
+    expected = weather.calculate_weather_intervals_vectorized(rain_data, START, HORIZON, 0.1)
+    table = weather.ForecastTable.build(rain_data, START, START, 5, HORIZON, 0.1)
+    assert table.forecast_at(START) == expected
+    assert weather.IncrementalForecaster(rain_data, HORIZON, 0.1).forecast_at(START) == expected
+    assert weather.RainEvents.from_series(rain_data).weather_intervals(START, HORIZON, 0.1) == \
+        expected
+
+
+def original_calculate_weather_intervals(rain_data, start_date, horizon, uncertainty):
+    """
+    The minute-by-minute calculate_weather_intervals() before the faster engines were added, as
+    reference of their output.
+    """
+    # Check start_date.
+    assert horizon > 0
+    assert start_date >= rain_data[0][0]
+    assert start_date + datetime.timedelta(minutes=horizon) <= rain_data[len(rain_data) - 1][0]
+
+    # Go in rain_data to start date and time. Remember that each line represents 1 minute.
+    index = 0
+    while rain_data[index][0] != start_date:
+        index += 1
+
+    # Initialize variables.
+    raining = rain_data[index][1] > 0
+    start_current_interval = index
+    cumulative_rain = 0.0
+    weather_intervals = []
+    next_interval = []
+
+    # If we start with rain, the first dry interval will be dummy values.
+    if raining:
+        next_interval.append(0)
+        next_interval.append(0)
+
+    while rain_data[index][0] <= start_date + datetime.timedelta(minutes=horizon):
+        current_rain = rain_data[index][1]
+        if raining and current_rain > 0:
+            # It was raining and it is still raining.
+            cumulative_rain += current_rain
+
+        elif raining and current_rain == 0:
+            # It was raining but it stopped raining.
+            interval_duration = index - start_current_interval
+            next_interval.append(int(round(interval_duration * (1 - uncertainty))))
+            next_interval.append(int(round(interval_duration * (1 + uncertainty))))
+            start_current_interval = index
+            next_interval.append(cumulative_rain / interval_duration)
+            weather_intervals.append(next_interval)
+            next_interval = []
+            raining = False
+
+        elif not raining and current_rain == 0:
+            # It was dry and it is still dry. Nothing special to do.
+            pass
+
+        elif not raining and current_rain > 0:
+            # It was dry but it started raining.
+            interval_duration = index - start_current_interval
+            next_interval.append(int(round(interval_duration * (1 - uncertainty))))
+            next_interval.append(int(round(interval_duration * (1 + uncertainty))))
+            start_current_interval = index
+            cumulative_rain = current_rain
+            raining = True
+
+        else:
+            # We should not be here.
+            raise RuntimeError("Rain data has unexpected values.")
+
+        index += 1
+
+    # Wrap up the last next_interval array.
+    interval_duration = index - start_current_interval
+    if interval_duration == horizon + 1:  # Nothing will change.
+        next_interval.append(interval_duration)
+        next_interval.append(interval_duration)
+    else:
+        next_interval.append(int(round(interval_duration * (1 - uncertainty))))
+        next_interval.append(int(round(interval_duration * (1 + uncertainty))))
+
+    if raining:
+        next_interval.append(cumulative_rain / interval_duration)
+    else:
+        next_interval.append(0)
+        next_interval.append(0)
+        next_interval.append(0)
+    weather_intervals.append(next_interval)
+
+    # Add two days of dry weather for safety in Uppaal Stratego.
+    next_interval = [24 * 60, 24 * 60, 24 * 60, 24 * 60, 0]
+    weather_intervals.append(next_interval)
+    return weather_intervals
+
+
+def random_rain_rows(rng, length):
+    """
+    Rain data rows of alternating dry and rain runs of random durations, starting with either.
+    """
+    rain = []
+    raining = bool(rng.integers(2))
+    while len(rain) < length:
+        duration = int(rng.integers(1, 40))
+        if raining:
+            rain.extend(rng.uniform(0.001, 0.5, duration).tolist())
+        else:
+            rain.extend([0.0] * duration)
+        raining = not raining
+    return [[START + datetime.timedelta(minutes=minute), rain[minute]]
+            for minute in range(length)]
+
+
+def assert_engines_match_original(rows, start_date, horizon, uncertainty):
+    expected = original_calculate_weather_intervals(rows, start_date, horizon, uncertainty)
+    rain_data = weather.RainSeries.from_rows(rows)
+    assert weather.calculate_weather_intervals(rows, start_date, horizon, uncertainty) == expected
+    assert weather.calculate_weather_intervals_vectorized(rain_data, start_date, horizon,
+                                                          uncertainty) == expected
+    assert weather.RainEvents.from_series(rain_data).weather_intervals(
+        start_date, horizon, uncertainty) == expected
+    table = weather.ForecastTable.build(rain_data, start_date, start_date, 1, horizon,
+                                        uncertainty)
+    assert table.forecast_at(start_date) == expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("horizon", [1, 2, 59, 360])
+@pytest.mark.parametrize("uncertainty", [0.0, 0.1, 0.5])
+def test_forecasts_match_original_on_random_rain_data(seed, horizon, uncertainty):
+    rng = np.random.default_rng(seed)
+    length = horizon + 120
+    rows = random_rain_rows(rng, length)
+    # The original loop reads the row after the horizon, so the last possible start is one earlier
+    # than for the other engines.
+    last_start = length - horizon - 2
+    # The first and last possible start, and consecutive starts in between.
+    first_start = int(rng.integers(last_start - 20))
+    starts = [0, last_start] + list(range(first_start, first_start + 20))
+    forecaster = weather.IncrementalForecaster(weather.RainSeries.from_rows(rows), horizon,
+                                               uncertainty)
+    for start in starts:
+        start_date = START + datetime.timedelta(minutes=start)
+        assert_engines_match_original(rows, start_date, horizon, uncertainty)
+        assert forecaster.forecast_at(start_date) == \
+            original_calculate_weather_intervals(rows, start_date, horizon, uncertainty)
+
+    # The forecast table of consecutive control instants.
+    period = int(rng.integers(1, 30))
+    end_date = START + datetime.timedelta(minutes=last_start)
+    table = weather.ForecastTable.build(weather.RainSeries.from_rows(rows), START, end_date,
+                                        period, horizon, uncertainty)
+    for k in range(len(table)):
+        start_date = START + datetime.timedelta(minutes=k * period)
+        assert table.forecast_at(start_date) == \
+            original_calculate_weather_intervals(rows, start_date, horizon, uncertainty)
+
+
+@pytest.mark.parametrize("rain", [
+    [0.0] * 10,  # Dry during the whole horizon.
+    [0.1] * 10,  # Raining during the whole horizon, after a dummy dry interval.
+    [0.1, 0.0, 0.2, 0.0, 0.3, 0.0, 0.4, 0.0, 0.5, 0.0],  # Single minutes of rain and dry weather.
+    [0.0] * 8 + [0.1, 0.0],  # Rain only in the last minute of the longest horizon.
+    [0.1] + [0.0] * 9,  # Rain only in the first minute of the horizon.
+    [1e-12, 0.0, 1e-12] + [0.0] * 7,  # Rain far below a mm per minute.
+])
+def test_forecasts_match_original_on_edge_cases(rain):
+    rows = [[START + datetime.timedelta(minutes=minute), value]
+            for minute, value in enumerate(rain)]
+    for horizon in range(1, len(rain) - 1):
+        for uncertainty in (0.0, 0.1, 0.5):
+            assert_engines_match_original(rows, START, horizon, uncertainty)
+
+
+def test_forecasts_reject_start_within_a_minute():
+    rows = random_rain_rows(np.random.default_rng(0), 3 * HORIZON)
+    rain_data = weather.RainSeries.from_rows(rows)
+    start_date = START + datetime.timedelta(seconds=30)
+    with pytest.raises(IndexError):
+        original_calculate_weather_intervals(rows, start_date, HORIZON, 0.1)
+    with pytest.raises(ValueError):
+        weather.calculate_weather_intervals(rows, start_date, HORIZON, 0.1)
+    with pytest.raises(ValueError):
+        weather.calculate_weather_intervals_vectorized(rain_data, start_date, HORIZON, 0.1)
+    with pytest.raises(ValueError):
+        weather.RainEvents.from_series(rain_data).weather_intervals(start_date, HORIZON, 0.1)
+    with pytest.raises(ValueError):
+        weather.ForecastTable.build(rain_data, start_date, start_date, 5, HORIZON, 0.1)
+    with pytest.raises(ValueError):
+        weather.IncrementalForecaster(rain_data, HORIZON, 0.1).forecast_at(start_date)
+
+
+def test_rows_are_found_after_gaps():
+    rows = [[START + datetime.timedelta(minutes=minute), 0.0] for minute in [0, 1, 2, 5, 6, 9]]
+    assert [row_index(rows, row[0]) for row in rows] == list(range(len(rows)))
+    for minute in (3, 4, 7, 10, -1):
+        with pytest.raises(ValueError):
+            row_index(rows, START + datetime.timedelta(minutes=minute))
+
+
+def write_rain_data_file(file, rows):
+    """
+    Write rain data rows in mm/min to a swmm rain data file in mm/h.
+    """
+    with open(file, "w") as f:
+        for date, rain in rows:
+            f.write(f"{date:%m/%d/%Y %H:%M:%S} {rain * 60}\n")
+
+
+def test_rain_events_do_not_keep_the_rain_data(tmp_path, monkeypatch):
+    data_file = str(tmp_path / "rain.dat")
+    write_rain_data_file(data_file, random_rain_rows(np.random.default_rng(0), 600))
+    read_series = []
+    original_read_rain_data = weather.read_rain_data
+
+    def read_rain_data(file):
+        series = original_read_rain_data(file)
+        read_series.append(weakref.ref(series))
+        return series
+
+    monkeypatch.setattr(weather, "read_rain_data", read_rain_data)
+    events = weather.read_rain_events(data_file)
+    assert weather.read_rain_events(data_file) is events
+    gc.collect()
+    assert len(read_series) == 1 and read_series[0]() is None
+
+
+def rain_cache_names(cache_folder, data_file_name):
+    return sorted(name for name in os.listdir(cache_folder)
+                  if re.fullmatch(re.escape(data_file_name) + r"\.[0-9a-f]{16}\.\w+\.npy", name))
+
+
+def test_rain_cache_is_invalidated_when_the_data_file_changes(tmp_path):
+    data_file = str(tmp_path / "rain.dat")
+    cache_folder = tmp_path / weather.RAIN_CACHE_FOLDER
+    write_rain_data_file(data_file, [[START, 0.5], [START + datetime.timedelta(minutes=1), 0.0]])
+    write_rain_data_file(data_file + ".bak", [[START, 0.5]])
+    weather.read_rain_data(data_file + ".bak")
+    weather.read_rain_data(data_file)
+    first_cache = rain_cache_names(cache_folder, "rain.dat")
+    assert len(first_cache) == 2
+    rain_data = weather.read_rain_data(data_file)
+    assert isinstance(rain_data.intensities, np.memmap)
+    assert rain_data.intensities.tolist() == [0.5, 0.0]
+
+    # The same size, but a later modification time.
+    stat = os.stat(data_file)
+    write_rain_data_file(data_file, [[START, 0.0], [START + datetime.timedelta(minutes=1), 0.5]])
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert os.stat(data_file).st_size == stat.st_size
+    assert weather.read_rain_data(data_file).intensities.tolist() == [0.0, 0.5]
+    assert weather.read_rain_data(data_file).intensities.tolist() == [0.0, 0.5]
+
+    # Another size, with the same modification time.
+    stat = os.stat(data_file)
+    write_rain_data_file(data_file, [[START, 0.25]])
+    os.utime(data_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert weather.read_rain_data(data_file).intensities.tolist() == [0.25]
+
+    # Only the cache of the latest version is kept, next to that of the other data file.
+    cache = rain_cache_names(cache_folder, "rain.dat")
+    assert len(cache) == 2 and not set(cache) & set(first_cache)
+    assert len(rain_cache_names(cache_folder, "rain.dat.bak")) == 2
+
+
+def nowcast_lines(first_minute, rain):
+    """
+    Lines of a nowcast file in micrometer per second, starting at the provided minute after START.
+    """
+    return "".join(f"{START + datetime.timedelta(minutes=first_minute + minute):%d-%b-%Y %H:%M:%S},"
+                   f"{value}\n" for minute, value in enumerate(rain))
+
+
+def test_nowcast_completes_partial_lines(tmp_path):
+    nowcast_file = tmp_path / "RainfallNowcast.txt"
+    text = "timestamp,my-m/sec\n" + nowcast_lines(0, [0, 10, 20, 30])
+    nowcast = weather.NowcastSource(str(nowcast_file), 2, 0.1)
+    assert nowcast.update() == 0  # No file yet.
+    split = text.index("20\n") + 1
+    nowcast_file.write_text(text[:split])
+    assert nowcast.update() == 2
+    with open(nowcast_file, "a") as f:
+        f.write(text[split:])
+    assert nowcast.update() == 2
+    assert nowcast.rain_data.intensities.tolist() == pytest.approx([0, 0.6, 1.2, 1.8])
+    assert START + datetime.timedelta(minutes=1) in nowcast
+    assert START + datetime.timedelta(minutes=2) not in nowcast
+
+
+@pytest.mark.parametrize("replace", ["mv", "cp"])
+def test_nowcast_is_read_again_when_replaced(tmp_path, replace):
+    # The experiment scripts copy the nowcast of the FTP folder over the local one, or move a
+    # rewritten one into its place. The new nowcast starts later and updates earlier values.
+    nowcast_file = str(tmp_path / "RainfallNowcast.txt")
+    new_file = str(tmp_path / "temp.txt")
+    with open(nowcast_file, "w") as f:
+        f.write("timestamp,my-m/sec\n" + nowcast_lines(0, [10, 10, 10]))
+    nowcast = weather.NowcastSource(nowcast_file, 3, 0.1)
+    assert nowcast.update() == 3
+    with open(new_file, "w") as f:
+        f.write("timestamp,my-m/sec\n" + nowcast_lines(1, [20, 20, 20, 20, 20]))
+    if replace == "mv":
+        os.replace(new_file, nowcast_file)
+    else:
+        shutil.copyfile(new_file, nowcast_file)
+    assert nowcast.update() == 5
+    rain_data = nowcast.rain_data
+    assert rain_data.minutes[0] == weather.datetime_to_minutes(START) + 1
+    assert rain_data.intensities.tolist() == pytest.approx([1.2] * 5)